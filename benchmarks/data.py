@@ -0,0 +1,114 @@
+"""Generate synthetic delimited tables for benchmarking sqltxt.
+
+The tables form a star schema: a fact table whose rows reference each of several dimension tables
+by a key column, and dimension tables with one row per key. Keys are drawn from a Zipf
+distribution, so that a skew of 0 references every key equally often and larger skews reference
+the first keys more and more often.
+
+Run with `python -m benchmarks.data`.
+
+Usage:
+    benchmarks.data [options] DIR
+
+Options:
+    --rows=<int>            rows in the fact table [default: 100000]
+    --width=<int>           value columns in the fact table [default: 8]
+    --cardinality=<int>     distinct keys, and rows in each dimension table [default: 1000]
+    --skew=<float>          the Zipf exponent of the distribution of keys [default: 0]
+    --dimensions=<int>      the number of dimension tables [default: 4]
+    --seed=<int>            the random seed [default: 0]
+"""
+
+from __future__ import print_function
+import bisect
+import os
+import random
+
+FACT_TABLE = 'fact'
+VALUE_RANGE = 1000
+
+def get_dimension_name(dimension):
+    return 'dim{0}'.format(dimension)
+
+def get_key_column(dimension):
+    return 'k{0}'.format(dimension)
+
+class KeySampler(object):
+    """Draw keys from 1 to the given cardinality with Zipf-distributed frequencies."""
+
+    def __init__(self, cardinality, skew, rng):
+        self.rng = rng
+        weights = [1.0 / (rank ** skew) for rank in range(1, cardinality + 1)]
+        self.cumulative_weights = _accumulate(weights)
+        self.total_weight = self.cumulative_weights[-1]
+
+    def sample(self):
+        point = self.rng.random() * self.total_weight
+        return min(bisect.bisect_right(self.cumulative_weights, point),
+            len(self.cumulative_weights) - 1) + 1
+
+def _accumulate(values):
+    total = 0.0
+    totals = []
+    for value in values:
+        total += value
+        totals.append(total)
+    return totals
+
+def get_table_paths(data_dir, dimensions=4):
+    """Return a dictionary of the paths of the generated tables in a directory by table name."""
+
+    names = [FACT_TABLE] + [get_dimension_name(d) for d in range(1, dimensions + 1)]
+    return dict((name, os.path.join(data_dir, name + '.csv')) for name in names)
+
+def generate_tables(data_dir, rows=100000, width=8, cardinality=1000, skew=0.0, dimensions=4,
+        seed=0, reuse=False):
+    """Write a fact table and its dimension tables to the given directory and return a dictionary
+    of their paths by table name. If reuse is true and the tables are already there, return their
+    paths without writing them again."""
+
+    paths = get_table_paths(data_dir, dimensions)
+    if reuse and all(os.path.exists(path) for path in paths.values()):
+        return paths
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    rng = random.Random(seed)
+
+    fact_path = paths[FACT_TABLE]
+    samplers = [KeySampler(cardinality, skew, rng) for _ in range(dimensions)]
+    header = [get_key_column(d) for d in range(1, dimensions + 1)] + \
+        ['v{0}'.format(c) for c in range(1, width + 1)]
+    with open(fact_path, 'w') as f:
+        f.write(','.join(header) + '\n')
+        for _ in range(rows):
+            row = [str(sampler.sample()) for sampler in samplers] + \
+                [str(rng.randint(0, VALUE_RANGE - 1)) for _ in range(width)]
+            f.write(','.join(row) + '\n')
+
+    for dimension in range(1, dimensions + 1):
+        with open(paths[get_dimension_name(dimension)], 'w') as f:
+            f.write('{0},a{1},b{1}\n'.format(get_key_column(dimension), dimension))
+            for key in range(1, cardinality + 1):
+                f.write('{0},{1},{2}\n'.format(
+                    key, rng.randint(0, VALUE_RANGE - 1), 'label{0}'.format(key % 97)))
+
+    return paths
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+    paths = generate_tables(
+        args['DIR'],
+        rows=int(args['--rows']),
+        width=int(args['--width']),
+        cardinality=int(args['--cardinality']),
+        skew=float(args['--skew']),
+        dimensions=int(args['--dimensions']),
+        seed=int(args['--seed']),
+    )
+    for name in sorted(paths):
+        print(paths[name])
+
+if __name__ == '__main__':
+    main()
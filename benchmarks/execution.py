@@ -0,0 +1,255 @@
+"""Measure how long sqltxt takes to execute a fixed workload of queries over synthetic tables, and
+compare measurements between runs.
+
+Each query runs through `sqltxt -e` in a fresh cache directory and temporary directory. Each run
+records its wall time, the user and system CPU time and peak resident set size of sqltxt and
+every process of its pipeline, the peak disk usage of its temporary directory, and the number of
+rows it output. Results are written as JSON.
+
+Run with `python -m benchmarks.execution`.
+
+Usage:
+    benchmarks.execution run [options] [--sqltxt-arg=<arg>]... [QUERY...]
+    benchmarks.execution compare [--threshold=<ratio>] BASELINE RESULTS
+    benchmarks.execution list
+
+Arguments:
+    QUERY       names of workload queries to run; all of them by default
+    BASELINE    results of an earlier run
+    RESULTS     results to compare to the baseline
+
+Options:
+    --rows=<int>            rows in the fact table [default: 100000]
+    --width=<int>           value columns in the fact table [default: 8]
+    --cardinality=<int>     distinct join keys, and rows in each dimension table [default: 1000]
+    --skew=<float>          the Zipf exponent of the distribution of join keys [default: 0]
+    --seed=<int>            the random seed of the generated tables [default: 0]
+    --data-dir=<dir>        generate tables into this directory, or reuse the tables already
+                            there; defaults to a temporary directory
+    --repeat=<int>          run each query this many times [default: 3]
+    --sqltxt-arg=<arg>      pass an option to sqltxt, e.g. --sqltxt-arg=--partitions=4
+    --output=<file>         write results to this file instead of stdout
+    --threshold=<ratio>     flag queries whose median wall time grew by more than this ratio
+                            [default: 1.1]
+"""
+
+from __future__ import print_function
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.data import generate_tables, get_table_paths
+
+# each query names tables by {fact}, {dim1}, {dim2}, etc.
+WORKLOAD = [
+    ('filter', 'select k1, v1 from {fact} where v1 < 100'),
+    ('projection', 'select v2, v1, k2 from {fact}'),
+    ('ordered_projection', 'select k1, v2, v5 from {fact}'),
+    ('filter_disjunction',
+        'select k1, v2 from {fact} where v1 < 500 and v2 >= 250 or v3 = 7'),
+    ('join_2',
+        'select f.v1, d1.a1 from {fact} f join {dim1} d1 on f.k1 = d1.k1'),
+    ('join_3',
+        'select f.v1, d1.a1, d2.a2 from {fact} f join {dim1} d1 on f.k1 = d1.k1 '
+        'join {dim2} d2 on f.k2 = d2.k2'),
+    ('join_4',
+        'select f.v1, d1.a1, d2.a2, d3.a3 from {fact} f join {dim1} d1 on f.k1 = d1.k1 '
+        'join {dim2} d2 on f.k2 = d2.k2 join {dim3} d3 on f.k3 = d3.k3'),
+    ('join_5',
+        'select f.v1, d1.a1, d2.a2, d3.a3, d4.a4 from {fact} f join {dim1} d1 on f.k1 = d1.k1 '
+        'join {dim2} d2 on f.k2 = d2.k2 join {dim3} d3 on f.k3 = d3.k3 '
+        'join {dim4} d4 on f.k4 = d4.k4'),
+    ('filtered_join_3',
+        'select f.v1, d1.b1, d2.b2 from {fact} f join {dim1} d1 on f.k1 = d1.k1 '
+        'join {dim2} d2 on f.k2 = d2.k2 where d1.a1 < 100 and f.v2 > 500'),
+    ('self_join',
+        'select d1.k1, f.v1 from {dim1} d1 join {fact} f on d1.k1 = f.k1 where d1.a1 < 10'),
+    ('sample', 'select k1, v1 from {fact} tablesample (1000)'),
+    ('join_sample',
+        'select f.v1, d1.a1 from {fact} f join {dim1} d1 on f.k1 = d1.k1 tablesample (100)'),
+]
+
+# how often the temporary directory's disk usage is sampled, in seconds
+TEMP_USAGE_POLL_INTERVAL = 0.05
+
+def get_directory_bytes(path):
+    """Return the total size of the files under a directory, ignoring files that disappear."""
+
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                pass
+    return total
+
+def measure(argv, env, temp_dir):
+    """Run a command and return a dictionary describing its resource usage and output."""
+
+    peak_temp_bytes = [0]
+    is_done = threading.Event()
+
+    def poll_temp_usage():
+        while not is_done.is_set():
+            peak_temp_bytes[0] = max(peak_temp_bytes[0], get_directory_bytes(temp_dir))
+            is_done.wait(TEMP_USAGE_POLL_INTERVAL)
+
+    poller = threading.Thread(target=poll_temp_usage)
+    poller.daemon = True
+
+    start_time = time.time()
+    proc = subprocess.Popen(argv, env=env, stdout=subprocess.PIPE)
+    poller.start()
+
+    output_rows = 0
+    for chunk in iter(lambda: proc.stdout.read(64 * 1024), ''):
+        output_rows += chunk.count('\n')
+
+    # unlike Popen.wait, wait4 reports the resource usage of the process and all of its children
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall_seconds = time.time() - start_time
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    is_done.set()
+    poller.join()
+
+    return {
+        'exit_status': proc.returncode,
+        'wall_seconds': wall_seconds,
+        'user_seconds': usage.ru_utime,
+        'system_seconds': usage.ru_stime,
+        'peak_rss_kb': usage.ru_maxrss,  # of the largest process
+        'peak_temp_bytes': peak_temp_bytes[0],
+        'output_rows': max(output_rows - 1, 0),  # not counting the header
+    }
+
+def run_workload(table_paths, query_names=None, repeat=3, sqltxt_args=()):
+    """Run each named workload query the given number of times and return a list of results."""
+
+    queries = [(name, sql) for name, sql in WORKLOAD if not query_names or name in query_names]
+    results = []
+    for name, sql_template in queries:
+        sql = sql_template.format(**table_paths)
+        for run in range(repeat):
+            run_dir = tempfile.mkdtemp(prefix='sqltxt-benchmark-')
+            try:
+                temp_dir = os.path.join(run_dir, 'tmp')
+                os.mkdir(temp_dir)
+
+                env = dict(os.environ)
+                env['TMPDIR'] = temp_dir
+                env['SQLTXT_CACHE_DIR'] = os.path.join(run_dir, 'cache')
+                env.pop('SQLTXT_SOCKET', None)
+
+                argv = [sys.executable, '-m', 'sqltxt', '-e',
+                    '--sort-tmpdir={0}'.format(temp_dir)] + list(sqltxt_args) + [sql]
+                result = {'query': name, 'run': run, 'sql': sql, 'sqltxt_args': list(sqltxt_args)}
+                result.update(measure(argv, env, temp_dir))
+            finally:
+                shutil.rmtree(run_dir)
+
+            print('{query} #{run}: {wall_seconds:.3f}s wall, {output_rows} rows'.format(**result),
+                file=sys.stderr)
+            results.append(result)
+    return results
+
+def get_metadata(args):
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'revision': revision,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': {
+            'rows': int(args['--rows']),
+            'width': int(args['--width']),
+            'cardinality': int(args['--cardinality']),
+            'skew': float(args['--skew']),
+            'seed': int(args['--seed']),
+        },
+    }
+
+def get_median_wall_seconds(results):
+    """Return the median wall time of each query in a list of results."""
+
+    wall_seconds = {}
+    for result in results:
+        wall_seconds.setdefault(result['query'], []).append(result['wall_seconds'])
+    return dict(
+        (query, sorted(times)[len(times) // 2]) for query, times in wall_seconds.items())
+
+def compare(baseline, results, threshold):
+    """Print the ratio of the median wall time of each query to its baseline, flagging ratios
+    above the threshold, and return the number of queries flagged."""
+
+    baseline_seconds = get_median_wall_seconds(baseline['results'])
+    result_seconds = get_median_wall_seconds(results['results'])
+
+    regressions = 0
+    for query, _ in WORKLOAD:
+        if query not in baseline_seconds or query not in result_seconds:
+            continue
+        ratio = result_seconds[query] / max(baseline_seconds[query], 1e-9)
+        is_regression = ratio > threshold
+        regressions += is_regression
+        print('{0:<20} {1:8.3f}s {2:8.3f}s {3:6.2f}x{4}'.format(query, baseline_seconds[query],
+            result_seconds[query], ratio, '  REGRESSION' if is_regression else ''))
+    return regressions
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+
+    if args['list']:
+        for name, sql in WORKLOAD:
+            print('{0:<20} {1}'.format(name, sql))
+        return
+
+    if args['compare']:
+        with open(args['BASELINE']) as f:
+            baseline = json.load(f)
+        with open(args['RESULTS']) as f:
+            results = json.load(f)
+        sys.exit(1 if compare(baseline, results, float(args['--threshold'])) else 0)
+
+    data_dir = args['--data-dir'] or tempfile.mkdtemp(prefix='sqltxt-benchmark-data-')
+    try:
+        if not all(os.path.exists(path) for path in get_table_paths(data_dir).values()):
+            print('Generating tables in {0}'.format(data_dir), file=sys.stderr)
+        table_paths = generate_tables(
+            data_dir,
+            rows=int(args['--rows']),
+            width=int(args['--width']),
+            cardinality=int(args['--cardinality']),
+            skew=float(args['--skew']),
+            seed=int(args['--seed']),
+            reuse=True
+        )
+        results = run_workload(table_paths, args['QUERY'], int(args['--repeat']),
+            args['--sqltxt-arg'])
+    finally:
+        if not args['--data-dir']:
+            shutil.rmtree(data_dir)
+
+    output = json.dumps({'metadata': get_metadata(args), 'results': results}, indent=2,
+        sort_keys=True)
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
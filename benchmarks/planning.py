@@ -0,0 +1,252 @@
+"""Measure how long sqltxt takes to parse, plan and generate commands for queries that stress the
+planner: files with thousands of columns, WHERE clauses with hundreds of terms, many-way joins and
+long IN lists. The grammar has no IN, so an IN list is written as the equivalent chain of
+equalities joined by OR.
+
+Each phase records its time, the net number of objects it left allocated (counted by the garbage
+collector, which tracks containers and instances but not e.g. strings and numbers), and the number
+of calls to functions known to be hot spots, such as recomputing a Table's column indices. A phase
+that fails records its error instead. Results are written as JSON.
+
+Run with `python -m benchmarks.planning`.
+
+Usage:
+    benchmarks.planning [options] [CASE...]
+    benchmarks.planning list
+
+Arguments:
+    CASE        names of cases to run; all of them by default
+
+Options:
+    --columns=<int>     columns in the wide file [default: 2000]
+    --terms=<int>       terms in the long WHERE clauses [default: 200]
+    --joins=<int>       tables in the many-way join [default: 10]
+    --in-list=<int>     values in the long IN list [default: 5000]
+    --repeat=<int>      measure each case this many times [default: 3]
+    --output=<file>     write results to this file instead of stdout
+"""
+
+from __future__ import print_function
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import sqltxt.query
+import sqltxt.table
+import sqltxt.column
+from sqltxt.sql_tokenizer import parse, get_relations_and_conditions
+from sqltxt.query import Query, classify_conditions
+from sqltxt.table import SortOptions
+
+# (module, class name, method name) of methods whose calls are counted in each phase
+HOT_SPOTS = [
+    (sqltxt.table, 'Table', '_compute_column_indices'),
+    (sqltxt.table, 'Table', '_compute_column_name_indices'),
+    (sqltxt.table, 'Table', 'get_column_for_name'),
+    (sqltxt.column, 'Column', 'match'),
+]
+
+PHASES = ['parse', 'classify_conditions', 'plan', 'execute', 'get_cmd_str']
+
+def write_table(path, columns, rows=3):
+    with open(path, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in range(rows):
+            f.write(','.join(str(row) for _ in columns) + '\n')
+
+def get_cases(data_dir, columns=2000, terms=200, joins=10, in_list=5000):
+    """Write the tables that the cases read to the given directory and return a list of each
+    case's name and SQL."""
+
+    wide_path = os.path.join(data_dir, 'wide.csv')
+    write_table(wide_path, ['c{0}'.format(c) for c in range(columns)])
+
+    narrow_path = os.path.join(data_dir, 'narrow.csv')
+    write_table(narrow_path, ['c{0}'.format(c) for c in range(max(terms, 2))])
+
+    join_paths = []
+    for t in range(joins):
+        join_paths.append(os.path.join(data_dir, 't{0}.csv'.format(t)))
+        write_table(join_paths[-1], ['k{0}'.format(t), 'k{0}'.format(t + 1), 'v{0}'.format(t)])
+
+    wide_columns = ', '.join('c{0}'.format(c) for c in range(0, columns, 2))
+    and_terms = ' and '.join('c{0} > {0}'.format(c) for c in range(terms))
+    or_terms = ' or '.join('c0 = {0}'.format(value) for value in range(terms))
+    mixed_terms = ' and '.join(
+        '(c{0} < {0} or c{1} > {1})'.format(c, (c + 1) % terms) for c in range(terms // 2))
+    join_sql = 'select {0} from {1} t0 {2}'.format(
+        ', '.join('t{0}.v{0}'.format(t) for t in range(joins)),
+        join_paths[0],
+        ' '.join('join {0} t{1} on t{2}.k{1} = t{1}.k{1}'.format(join_paths[t], t, t - 1)
+            for t in range(1, joins)))
+    in_terms = ' or '.join('c0 = {0}'.format(value) for value in range(in_list))
+
+    return [
+        ('wide_projection', 'select {0} from {1}'.format(wide_columns, wide_path)),
+        ('wide_filter', 'select c{0}, c0 from {1} where c{0} > 1 and c1 < 2'.format(
+            columns - 1, wide_path)),
+        ('and_terms', 'select c0 from {0} where {1}'.format(narrow_path, and_terms)),
+        ('or_terms', 'select c0 from {0} where {1}'.format(narrow_path, or_terms)),
+        ('mixed_terms', 'select c0 from {0} where {1}'.format(narrow_path, mixed_terms)),
+        ('many_way_join', join_sql),
+        ('in_list', 'select c0 from {0} where {1}'.format(narrow_path, in_terms)),
+    ]
+
+
+class Profile(object):
+    """Record the time, net allocated objects and hot spot calls of each phase of a run."""
+
+    def __init__(self):
+        self.phases = {}
+        self.hot_spot_calls = dict((name, 0) for name in self._get_hot_spot_names())
+        self._patched = []
+
+    @staticmethod
+    def _get_hot_spot_names():
+        return ['{0}.{1}'.format(cls_name, func_name) for _, cls_name, func_name in HOT_SPOTS]
+
+    def install(self):
+        """Count calls to each hot spot until uninstalled."""
+
+        for (module, cls_name, func_name), name in zip(HOT_SPOTS, self._get_hot_spot_names()):
+            owner = getattr(module, cls_name)
+            function = owner.__dict__[func_name]
+            self._patched.append((owner, func_name, function))
+            setattr(owner, func_name, self._counting(function, name))
+
+    def uninstall(self):
+        for owner, func_name, function in reversed(self._patched):
+            setattr(owner, func_name, function)
+        self._patched = []
+
+    def _counting(self, function, name):
+        calls = self.hot_spot_calls
+        def counted(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def measure(self, phase, function, *args, **kwargs):
+        """Call a function as the given phase of the run and return its result, or None if it
+        raised, in which case its error is recorded."""
+
+        calls_before = dict(self.hot_spot_calls)
+        gc.collect()
+        gc.disable()
+        objects_before = len(gc.get_objects())
+        start_time = time.time()
+        error = None
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            result = None
+            error = '{0}: {1}'.format(type(e).__name__, e)
+        seconds = time.time() - start_time
+        net_objects = len(gc.get_objects()) - objects_before
+        gc.enable()
+
+        self.record(phase, seconds, net_objects, calls_before, error)
+        return result
+
+    def record(self, phase, seconds, net_objects, calls_before, error=None):
+        self.phases[phase] = {
+            'seconds': seconds,
+            'net_objects': net_objects,
+            'hot_spot_calls': dict(
+                (name, calls - calls_before[name]) for name, calls in self.hot_spot_calls.items()),
+            'error': error,
+        }
+
+
+def run_case(sql):
+    """Parse, plan and generate commands for the SQL, and return the Profile of each phase."""
+
+    profile = Profile()
+    profile.install()
+
+    # Query.execute calls plan itself, so plan is timed from inside it and also counted in execute
+    original_plan = sqltxt.query.plan
+    def timed_plan(*args, **kwargs):
+        calls_before = dict(profile.hot_spot_calls)
+        start_time = time.time()
+        result = original_plan(*args, **kwargs)
+        profile.record('plan', time.time() - start_time, None, calls_before)
+        return result
+    sqltxt.query.plan = timed_plan
+
+    try:
+        def parse_sql():
+            parsed = parse(sql)
+            return parsed, get_relations_and_conditions(parsed)
+        parsed_sql = profile.measure('parse', parse_sql)
+        if parsed_sql is None:
+            return profile
+        parsed, (relations, conditions) = parsed_sql
+
+        if profile.measure('classify_conditions', classify_conditions, conditions) is None:
+            return profile
+
+        def execute():
+            query = Query(relations, conditions=conditions, columns=parsed.column_definitions,
+                sort_options=SortOptions())
+            return query.execute()
+        result = profile.measure('execute', execute)
+        if result is None:
+            return profile
+
+        profile.measure('get_cmd_str', result.get_cmd_str, output_column_names=True)
+    finally:
+        sqltxt.query.plan = original_plan
+        profile.uninstall()
+
+    return profile
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+
+    data_dir = tempfile.mkdtemp(prefix='sqltxt-benchmark-')
+    try:
+        cases = get_cases(data_dir, columns=int(args['--columns']), terms=int(args['--terms']),
+            joins=int(args['--joins']), in_list=int(args['--in-list']))
+
+        if args['list']:
+            for name, sql in cases:
+                print('{0:<20} {1:.100}'.format(name, sql))
+            return
+
+        results = []
+        for name, sql in cases:
+            if args['CASE'] and name not in args['CASE']:
+                continue
+            for run in range(int(args['--repeat'])):
+                profile = run_case(sql)
+                results.append({'case': name, 'run': run, 'phases': profile.phases})
+                print('{0} #{1}: {2}'.format(name, run, ', '.join(
+                    '{0} {1:.1f}ms'.format(phase, profile.phases[phase]['seconds'] * 1000)
+                    if not profile.phases[phase]['error'] else '{0} failed'.format(phase)
+                    for phase in PHASES if phase in profile.phases)), file=sys.stderr)
+    finally:
+        shutil.rmtree(data_dir)
+
+    output = json.dumps({
+        'scale': {
+            'columns': int(args['--columns']),
+            'terms': int(args['--terms']),
+            'joins': int(args['--joins']),
+            'in_list': int(args['--in-list']),
+        },
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,6 @@ setup(
         'pyparsing',
         'ordered-set',
         'docopt',
-        'sympy',
     ],
     entry_points={
         'console_scripts': [
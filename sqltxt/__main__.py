@@ -2,69 +2,338 @@
 Translate SQL to coreutils and Bash shell commands.
 
 Usage:
-    txtsql [--debug] [-e | --execute] [--random-seed=<int>] [SQL]
+    txtsql serve [--debug] [--socket=<path>]
+    txtsql [--debug] [-e | --execute] [--random-seed=<int>] [--sorted-by=<spec>]... [options] [SQL]
+    txtsql [--debug] --analyze FILE...
     
 Arguments:
     SQL         the SQL statement to translate into command line tool
                 calls, e.g. cut, awk, sort, wc, etc. If none is given,
                 read from stdin instead.
+    FILE        a data file to collect statistics about
 
 Options:
     --debug             output debug messages
+    --socket=<path>     the Unix socket to serve queries on; defaults to $SQLTXT_SOCKET. While
+                        $SQLTXT_SOCKET names the socket of a running server, txtsql runs there,
+                        skipping the startup of a new interpreter
+    --timing            report the time taken to import, parse, plan and generate commands
+    --explain           output the plan of the query instead of its commands: the operations
+                        that produce its rows, each followed by its inputs, with the number of
+                        rows each is estimated to output
+    --explain-analyze   execute the query, discarding its output, and output its plan with the
+                        rows and bytes each operation actually output, how long it ran after its
+                        last input finished, and when it finished
     -e --execute        execute the resulting shell commands
     --random-seed=<int> the random seed to use for stochastic functions like TABLESAMPLE
+    --analyze           scan each FILE and write its statistics to a sidecar file used to
+                        estimate the sizes of query results
+    --sorted-by=<spec>  declare that a table's rows are already sorted by some of its columns,
+                        e.g. orders.txt:id,date, so they won't be sorted again; the table is
+                        named by its path or alias, like the SORTED BY (...) table hint
+    --verify-sorted     check declared sort orders where joins rely on them, stopping the
+                        command with an error on the first row out of order
+    --hash-join-threshold=<size>    hash join tables estimated to be at most this size, e.g. 64M,
+                                    loading them into memory instead of sorting both sides of
+                                    the join; 0 sort-merges all joins [default: 64M]
+    --partitions=<int>  filter and project each input file in this many parts concurrently,
+                        and join large tables in this many hash partitions concurrently;
+                        0 uses one part per core [default: 1]
+    --partitioned-join-threshold=<size>     join tables estimated to be at least this size, e.g.
+                                            1G, in hash partitions when --partitions is more than
+                                            1; 0 never partitions joins [default: 1G]
+    --no-plan-cache     translate the query even if its commands are cached; by default,
+                        the commands generated for each query are cached in $SQLTXT_CACHE_DIR
+                        (or ~/.cache/sqltxt) and reused while the headers of its input files
+                        are unchanged
+    --plan-cache-size=<size>    evict the least recently used cached commands once the cache
+                                is larger than this [default: 16M]
+    --cache-results     with --execute, output the cached result of the query if none of its
+                        input files has changed since it was cached, and cache the result
+                        otherwise, in $SQLTXT_CACHE_DIR (or ~/.cache/sqltxt)
+    --result-cache-size=<size>  evict the least recently used cached results once the cache is
+                                larger than this [default: 1G]
+    --awk=<awk>         the awk to run, e.g. gawk; defaults to the fastest of the awks on the
+                        PATH that run sqltxt's programs correctly, which are probed once and
+                        probed again when they change
+    --cut               drop the fields of input rows with cut, which is faster than awk, trusting
+                        that every row has every column: cut passes a row without a delimiter
+                        through whole and leaves out missing fields instead of emptying them
+    --cache-sorted-runs     instead of sorting an input file's rows for a join, read a copy
+                            of the file sorted by the join columns, which is made the first
+                            time it's needed and kept in $SQLTXT_CACHE_DIR (or
+                            ~/.cache/sqltxt) until the file changes
+    --sorted-run-cache-size=<size>  evict the least recently used sorted copies of files once the
+                                    cache is larger than this [default: 8G]
+
+Sort options:
+    --sort-locale=<locale>          the collation locale for sort and join [default: C]
+    --sort-parallel=<int>           the number of threads each sort uses; defaults to this
+                                    machine's cores shared among the query's sorts
+    --sort-buffer-size=<size>       the main memory buffer size of each sort, e.g. 1G or 10%;
+                                    defaults to half of this machine's memory shared among
+                                    the query's sorts
+    --sort-tmpdir=<dir>             the directory for sort's temporary files
+    --sort-compress-program=<prog>  compress sort's temporary files with prog, e.g. lz4
 """
 
 from __future__ import print_function
+import time
+START_TIME = time.time()
+
 import sys
 import os
 
 import logging
-import subprocess
 
-from docopt import docopt
+from util import Stopwatch, parse_size, cpu_count, physical_memory, shell_quote
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_ENV_VAR = 'SQLTXT_SOCKET'
 
-from sql_tokenizer import parse, get_relations_and_conditions
-from query import Query
+# modules that aren't needed on every code path are imported where they're used, to keep the
+# startup of this short-lived process fast
 
 # unbuffer input stream to enable --execute on piped input data
 stdin = os.fdopen(sys.stdin.fileno(), 'rb', 0)
 sys.stdin = stdin
 
 def main():
-    args = docopt(__doc__)
-    sql_str = args['SQL'] or sys.stdin.read()
+    socket_path = os.environ.get(SOCKET_ENV_VAR)
+    if socket_path and sys.argv[1:2] != ['serve']:
+        from server import request, is_socket
+        if is_socket(socket_path):
+            status = request(socket_path, sys.argv[1:])
+            if status is not None:
+                sys.exit(status)
+
+    sys.exit(run(sys.argv[1:], sys.stdin, sys.stdout, sys.stderr, execute_cmd=execute_locally))
+
+def run(argv, stdin, stdout, stderr, execute_cmd, start_time=None):
+    """Run a sqltxt command line, reading SQL from and writing results and messages to the given
+    files, and passing the commands to execute, if any, to execute_cmd with whether they read
+    standard input. Return what execute_cmd returns, or None if there's nothing to execute."""
+
+    from docopt import docopt
+
+    stopwatch = Stopwatch(start_time or START_TIME)
+    args = docopt(__doc__, argv=argv)
     debug = args['--debug']
-    execute = args['--execute']
-    random_seed = args['--random-seed']
- 
+
     if debug:
         logging.basicConfig(level=logging.DEBUG)
- 
+    elif args['serve']:
+        logging.basicConfig()
+
+    if args['serve']:
+        from server import QueryServer
+        socket_path = args['--socket'] or os.environ.get(SOCKET_ENV_VAR)
+        if not socket_path:
+            raise ValueError('serve needs --socket or ${0}'.format(SOCKET_ENV_VAR))
+        QueryServer(socket_path, run).serve_forever()
+        return
+
+    if args['--analyze']:
+        from stats import analyze, write_stats
+        for file_path in args['FILE']:
+            print(write_stats(file_path, analyze(file_path)), file=stdout)
+        return
+    stopwatch.lap('import')
+
+    sql_str = args['SQL'] or stdin.read()
+    execute = args['--execute']
+
+    # the awk chosen is part of the generated commands, so it's resolved before they're cached
+    if not args['--awk']:
+        from awk import get_awk
+        args['--awk'] = get_awk()
+
+    explain = args['--explain'] or args['--explain-analyze']
+
+    result_str = None
+    plan_cache = None
+    if not args['--no-plan-cache'] and not explain:
+        from cache import PlanCache, get_cache_dir, PLAN_CACHE_SUBDIR
+        plan_cache = get_plan_cache(
+            os.path.join(get_cache_dir(), PLAN_CACHE_SUBDIR),
+            parse_size(args['--plan-cache-size'])
+        )
+        plan_cache_key = PlanCache.get_key(sql_str, get_plan_options(args))
+        result_str = plan_cache.get(plan_cache_key)
+        if result_str is not None:
+            file_paths = plan_cache.get_input_paths(plan_cache_key)
+        stopwatch.lap('cache')
+
+    if result_str is None:
+        stage_counters = None
+        if args['--explain-analyze']:
+            from explain import StageCounters
+            stage_counters = StageCounters()
+
+        result_str, file_paths, sorted_run_paths, result = translate(
+            sql_str, args, stopwatch, stage_counters)
+        if plan_cache is not None:
+            plan_cache.put(plan_cache_key, file_paths, result_str, sorted_run_paths)
+            stopwatch.lap('cache')
+
+    if args['--explain']:
+        from explain import render_plan
+        report_timing(args, stopwatch, stderr)
+        stdout.write(render_plan(result.get_plan()) + '\n')
+
+    elif args['--explain-analyze']:
+        from explain import get_analyzing_cmd
+        cmd = get_analyzing_cmd(result_str, result.get_plan())
+        report_timing(args, stopwatch, stderr)
+        return execute_cmd(cmd, '-' in file_paths)
+
+    elif execute:
+        # explicitly use bash instead of the default for subprocess(..., shell=True) which is sh
+        cmd = "({})".format(result_str)
+        if args['--cache-results']:
+            cmd = get_result_caching_cmd(cmd, file_paths, parse_size(args['--result-cache-size']))
+            stopwatch.lap('cache')
+        report_timing(args, stopwatch, stderr)
+        return execute_cmd(cmd, '-' in file_paths)
+
+    else:
+        report_timing(args, stopwatch, stderr)
+        result_str = result_str + "\n"
+        stdout.write(result_str)
+
+def report_timing(args, stopwatch, stderr):
+    if args['--timing']:
+        print(stopwatch.report(), file=stderr)
+
+def execute_locally(cmd, reads_stdin=True):
+    """Run a command, which inherits this process's standard input, and return its exit
+    status, which is 128 plus the signal's number if a signal stopped it, as bash reports it."""
+    import subprocess
+    status = subprocess.call(['/bin/bash', '-c', cmd])
+    return 128 - status if status < 0 else status
+
+def get_result_caching_cmd(cmd, file_paths, max_bytes):
+    """Return a command that outputs the cached output of the given command if there is one, or
+    runs the command and caches its output otherwise."""
+
+    from cache import ResultCache, get_cache_dir, RESULT_CACHE_SUBDIR
+
+    key = ResultCache.get_key(cmd, file_paths)
+    if key is None:
+        return cmd
+
+    result_cache = ResultCache(os.path.join(get_cache_dir(), RESULT_CACHE_SUBDIR), max_bytes)
+    cached_path = result_cache.get(key)
+    if cached_path is not None:
+        return 'cat {0}'.format(shell_quote(cached_path))
+
+    try:
+        return result_cache.get_caching_cmd(key, cmd)
+    except OSError as e:
+        LOG.debug('Could not cache result: {0}'.format(e))
+        return cmd
+
+# the plan caches of this process by directory, which a server keeps in memory between queries
+_plan_caches = {}
+
+def get_plan_cache(cache_dir, max_bytes):
+    from cache import PlanCache
+    if cache_dir not in _plan_caches:
+        _plan_caches[cache_dir] = PlanCache(cache_dir, max_bytes)
+    _plan_caches[cache_dir].max_bytes = max_bytes
+    return _plan_caches[cache_dir]
+
+def translate(sql_str, args, stopwatch, stage_counters=None):
+    """Return the shell commands that compute the result of a SQL query, the paths of the files
+    the query reads, the paths of those it reads from sorted copies, and the Table of its result.
+    Given StageCounters, the commands count the rows each operation outputs."""
+
+    from sql_tokenizer import parse, get_relations_and_conditions
+    from query import Query
+    from table import SortOptions
+    stopwatch.lap('import')
+
     parsed = parse(sql_str)
     relations, conditions = get_relations_and_conditions(parsed)
     sample_size = parsed.sample_size if parsed.sample_size != '' else None
+    declare_sort_orders(relations, args['--sorted-by'])
+    stopwatch.lap('parse')
+
+    sorted_run_cache = None
+    if args['--cache-sorted-runs']:
+        from cache import SortedRunCache, get_cache_dir, SORTED_RUN_CACHE_SUBDIR
+        sorted_run_cache = SortedRunCache(
+            os.path.join(get_cache_dir(), SORTED_RUN_CACHE_SUBDIR),
+            parse_size(args['--sorted-run-cache-size'])
+        )
+
+    # both inputs of every join may be sorting at the same time
+    sort_options = SortOptions.from_machine(
+        concurrent_sorts=2 * (len(relations) - 1),
+        locale=args['--sort-locale'],
+        parallel=args['--sort-parallel'],
+        buffer_size=args['--sort-buffer-size'],
+        temporary_directory=args['--sort-tmpdir'],
+        compress_program=args['--sort-compress-program'],
+    )
  
     query = Query(
         relations, 
         conditions=conditions, 
         columns=parsed.column_definitions,
         sample_size=sample_size,
-        random_seed=random_seed,
-        is_top_level=True
+        random_seed=args['--random-seed'],
+        is_top_level=True,
+        sort_options=sort_options,
+        verify_sorted=args['--verify-sorted'],
+        hash_join_threshold=parse_size(args['--hash-join-threshold']),
+        partitioned_join_threshold=parse_size(args['--partitioned-join-threshold']),
+        partitions=int(args['--partitions']) or cpu_count(),
+        sorted_run_cache=sorted_run_cache,
+        stage_counters=stage_counters,
+        awk=args['--awk'],
+        use_cut=args['--cut']
     )
     result = query.execute()
+    stopwatch.lap('plan')
+
     result_str = result.get_cmd_str(output_column_names=True)
- 
-    if execute:
-        # explicitly use bash instead of the default for subprocess(..., shell=True) which is sh
-        result_str = "({})".format(result_str)
-        proc = subprocess.Popen(['/bin/bash', '-c', result_str])
+    stopwatch.lap('codegen')
 
-    else:
-        result_str = result_str + "\n"
-        print(result_str, end="")
+    sorted_run_paths = [table.name for table in query.tables if table.sorted_run is not None]
+    return result_str, [relation['path'] for relation in relations], sorted_run_paths, result
+
+# options that don't change the commands a query is translated to
+PLAN_CACHE_IGNORED_OPTIONS = (
+    'SQL', '--debug', '--timing', '--execute', '--no-plan-cache', '--plan-cache-size', 'serve',
+    '--socket', '--cache-results', '--result-cache-size')
+
+def get_plan_options(args):
+    """Return the options and machine properties that the commands for a query depend on."""
+
+    options = dict((k, v) for k, v in args.items() if k not in PLAN_CACHE_IGNORED_OPTIONS)
+    options['cores'] = cpu_count()
+    options['memory'] = physical_memory()
+    return options
+
+def declare_sort_orders(relations, sort_order_specs):
+    """Set the sort order of each relation named in a list of TABLE:COLUMN[,COLUMN...] specs."""
+
+    for spec in sort_order_specs:
+        table_name, _, column_names = spec.rpartition(':')
+        if not table_name or not column_names:
+            raise ValueError('Invalid sort order {0}, expected TABLE:COLUMN[,COLUMN...]'.format(spec))
+
+        matching_relations = [
+            relation for relation in relations
+            if table_name in (relation['path'], relation['alias'])
+        ]
+        if not matching_relations:
+            raise ValueError('Sort order {0} names no table in the query'.format(spec))
 
+        for relation in matching_relations:
+            relation['sorted_by'] = column_names.split(',')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,211 @@
+"""Choose the awk implementation that generated commands run.
+
+awk implementations differ widely in throughput: mawk typically filters and projects rows several
+times faster than gawk or busybox awk. Each implementation found on the PATH is checked to run
+programs like the ones sqltxt generates and produce the expected output, and the compatible ones
+are timed filtering a sample table. The fastest is cached in $SQLTXT_CACHE_DIR (or
+~/.cache/sqltxt) with the paths, sizes and modification times of the implementations found, and
+probed again once any of them changes.
+
+Generated programs use only POSIX awk, so any compatible implementation gives the same rows,
+except that each has its own srand/rand sequence, which TABLESAMPLE's choice of rows depends on.
+"""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from cache import get_cache_dir
+from util import find_executable
+
+LOG = logging.getLogger(__name__)
+
+# implementations in the order they're preferred when their timings tie
+CANDIDATES = ['mawk', 'gawk', 'nawk', 'busybox awk', 'awk']
+DEFAULT_AWK = 'awk'
+PROBE_FILE_NAME = 'awk.json'
+
+# the rows of the table each implementation filters, and the runs of which the fastest counts
+PROBE_ROWS = 200000
+PROBE_RUNS = 3
+
+# an implementation is preferred to those after it unless they're faster by more than this ratio
+TIE_RATIO = 1.05
+
+# a filter and projection with a regular expression, as Table.subset_rows generates
+FILTER_PROGRAM = 'OFS="," { if ($2 > 5 && $3 ~ /^label1.*$/) { print $3,$1 } }'
+
+# a hash join keyed by two fields, as joins._hash_join_tables generates
+JOIN_PROGRAM = (
+    'BEGIN { OFS="," } FILENAME == ARGV[1] { k = $1 SUBSEP $3; n[k]++; rows[k, n[k]] = $2; next } '
+    '{ k = $1 SUBSEP $3; if (k in n) { for (i = 1; i <= n[k]; i++) { print $1,$2,rows[k, i] } } }')
+
+# hashing rows into files, as joins._get_partitioning_cmd generates, and reservoir sampling, as
+# Table.sample_rows generates
+PARTITION_PROGRAM = (
+    'BEGIN { srand(1); for (i = 1; i < 256; i++) ord[sprintf("%c", i)] = i; '
+    'for (i = 0; i < n; i++) printf "" > (d "/p" i) } '
+    '{ h = 0; for (i = 1; i <= length($1); i++) h = (h * 31 + ord[substr($1, i, 1)]) % 1024; '
+    'print > (d "/p" (h % n)); if (rand() < 1) s++ } '
+    'END { print s > (d "/count") }')
+
+_fastest_awks = {}  # by cache directory and PATH, so that a server probes once for each client
+
+def get_awk(cache_dir=None):
+    """Return the command of the fastest compatible awk on this machine, or 'awk' if none of the
+    implementations found is compatible."""
+
+    key = (cache_dir or get_cache_dir(), os.environ.get('PATH'))
+    if key not in _fastest_awks:
+        _fastest_awks[key] = _get_cached_probe(key[0])['awk']
+    return _fastest_awks[key]
+
+def find_candidates():
+    """Return a list of the command and path of each awk implementation on the PATH, without
+    repeating implementations that are links to the same file."""
+
+    candidates = []
+    paths = set()
+    for candidate in CANDIDATES:
+        path = find_executable(candidate.split()[0])
+        if path is None or os.path.realpath(path) in paths:
+            continue
+        if candidate.startswith('busybox') and not _runs(candidate.split() + ['BEGIN {}']):
+            continue  # busybox may be built without awk
+        paths.add(os.path.realpath(path))
+        candidates.append((candidate, path))
+    return candidates
+
+def _get_signature(candidates):
+    signature = []
+    for candidate, path in candidates:
+        stat = os.stat(os.path.realpath(path))
+        signature.append([candidate, path, stat.st_size, stat.st_mtime])
+    return signature
+
+def _get_cached_probe(cache_dir):
+    """Return the result of probing this machine's awk implementations, from the cache if they
+    haven't changed since they were last probed."""
+
+    candidates = find_candidates()
+    signature = _get_signature(candidates)
+    probe_path = os.path.join(cache_dir, PROBE_FILE_NAME)
+    try:
+        with open(probe_path) as f:
+            probe = json.load(f)
+        if probe['signature'] == signature:
+            return probe
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    probe = probe_awks(candidates)
+    probe['signature'] = signature
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = '{0}.{1}.tmp'.format(probe_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(probe, f)
+        os.rename(tmp_path, probe_path)
+    except (IOError, OSError) as e:
+        LOG.debug('Could not cache awk probe: {0}'.format(e))
+    return probe
+
+def probe_awks(candidates):
+    """Check and time each of the given awk implementations, and return a dictionary of the
+    fastest compatible one's command as 'awk' and the seconds each took to filter the sample table
+    as 'seconds', which are None for incompatible ones and when only one is compatible."""
+
+    seconds = dict((candidate, None) for candidate, _ in candidates)
+    probe_dir = tempfile.mkdtemp(prefix='sqltxt-awk-')
+    try:
+        compatible = []
+        for candidate, path in candidates:
+            argv = [path] + candidate.split()[1:]
+            if is_compatible(argv, probe_dir):
+                compatible.append((candidate, argv))
+            else:
+                LOG.debug('{0} is not compatible with generated programs'.format(candidate))
+
+        if len(compatible) < 2:
+            return {'awk': compatible[0][0] if compatible else DEFAULT_AWK, 'seconds': seconds}
+
+        table_path = os.path.join(probe_dir, 'table')
+        with open(table_path, 'w') as f:
+            for row in range(PROBE_ROWS):
+                f.write('k{0},{1},label{2}\n'.format(row % 7, row % 10, row % 13))
+
+        for candidate, argv in compatible:
+            seconds[candidate] = min(
+                _time_filter(argv, table_path) for _ in range(PROBE_RUNS))
+            LOG.debug('{0} filtered {1} rows in {2:.3f}s'.format(
+                candidate, PROBE_ROWS, seconds[candidate]))
+    finally:
+        shutil.rmtree(probe_dir, ignore_errors=True)
+
+    fastest_seconds = min(seconds[candidate] for candidate, _ in compatible)
+    fastest = [
+        candidate for candidate, _ in compatible
+        if seconds[candidate] <= fastest_seconds * TIE_RATIO
+    ][0]
+    return {'awk': fastest, 'seconds': seconds}
+
+def is_compatible(argv, probe_dir):
+    """Return true if the awk run by the given arguments runs each kind of program sqltxt
+    generates as expected."""
+
+    rows = ['k{0},{1},label{2}'.format(row % 3, row, row % 13) for row in range(30)]
+    input_path = os.path.join(probe_dir, 'input')
+    build_path = os.path.join(probe_dir, 'build')
+    for path in (input_path, build_path):
+        with open(path, 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+
+    fields = [row.split(',') for row in rows]
+    expected_filter = ''.join('{0},{1}\n'.format(f[2], f[0])
+        for f in fields if int(f[1]) > 5 and f[2].startswith('label1'))
+    if _run(argv + ['-F,', FILTER_PROGRAM, input_path]) != expected_filter:
+        return False
+
+    # the table is joined to itself on its first and third fields
+    expected_join = ''.join(
+        '{0},{1},{2}\n'.format(f[0], f[1], b[1]) for f in fields for b in fields
+        if (b[0], b[2]) == (f[0], f[2]))
+    if _run(argv + ['-F,', JOIN_PROGRAM, build_path, input_path]) != expected_join:
+        return False
+
+    partition_dir = tempfile.mkdtemp(dir=probe_dir)
+    if _run(argv + ['-F,', '-v', 'd=' + partition_dir, '-v', 'n=3', PARTITION_PROGRAM,
+            input_path]) is None:
+        return False
+    partitioned_rows = []
+    try:
+        for partition in range(3):
+            with open(os.path.join(partition_dir, 'p{0}'.format(partition))) as f:
+                partitioned_rows.extend(f.read().splitlines())
+        with open(os.path.join(partition_dir, 'count')) as f:
+            sampled_count = f.read().strip()
+    except IOError:
+        return False
+    return sorted(partitioned_rows) == sorted(rows) and sampled_count == str(len(rows))
+
+def _run(argv):
+    """Return the output of a command, or None if it fails."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(argv, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _runs(argv):
+    return _run(argv) is not None
+
+def _time_filter(argv, table_path):
+    with open(os.devnull, 'w') as devnull:
+        start_time = time.time()
+        subprocess.call(argv + ['-F,', FILTER_PROGRAM, table_path], stdout=devnull)
+        return time.time() - start_time
@@ -0,0 +1,392 @@
+"""Cache the shell commands generated for queries on disk, so that running a query again against
+input files whose headers haven't changed skips parsing, planning and command generation."""
+
+import hashlib
+import json
+import logging
+import os
+import re
+
+from compression import open_input
+from stats import get_stats_path
+from util import shell_quote
+
+LOG = logging.getLogger(__name__)
+
+CACHE_DIR_ENV_VAR = 'SQLTXT_CACHE_DIR'
+PLAN_CACHE_SUBDIR = 'plans'
+RESULT_CACHE_SUBDIR = 'results'
+SORTED_RUN_CACHE_SUBDIR = 'sorted'
+CACHE_FILE_SUFFIX = '.json'
+RESULT_FILE_SUFFIX = '.out'
+SORTED_RUN_FILE_SUFFIX = '.sorted'
+
+# resolved on import, since __file__ may be relative to a working directory that later changes
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# quoted strings, whose whitespace is significant, or runs of whitespace outside of them
+_SQL_WHITESPACE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+def get_cache_dir():
+    """Return the directory sqltxt caches into: $SQLTXT_CACHE_DIR, or sqltxt in the user's cache
+    directory."""
+
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if cache_dir:
+        return cache_dir
+    user_cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(user_cache_dir), 'sqltxt')
+
+def normalize_sql(sql_str):
+    """Return the SQL with each run of whitespace outside of quoted strings collapsed to a single
+    space, so that reformatting a query doesn't change its cache key."""
+
+    return _SQL_WHITESPACE.sub(lambda match: match.group(1) or ' ', sql_str).strip()
+
+_code_fingerprint = None
+
+def get_code_fingerprint():
+    """Return a digest of the size and modification time of each of this package's modules, which
+    changes whenever sqltxt is upgraded or edited. It's computed once per process, since that's
+    when the modules are loaded."""
+
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        _code_fingerprint = _get_modules_digest()
+    return _code_fingerprint
+
+def _get_modules_digest():
+    digest = hashlib.sha1()
+    for file_name in sorted(os.listdir(PACKAGE_DIR)):
+        if file_name.endswith('.py'):
+            file_stat = os.stat(os.path.join(PACKAGE_DIR, file_name))
+            digest.update('{0}:{1}:{2};'.format(file_name, file_stat.st_size, file_stat.st_mtime))
+    return digest.hexdigest()
+
+def get_file_signature(file_path, exact=False):
+    """Return a description of a query's input file that changes whenever a plan made for the
+    file may no longer be valid or good.
+
+    Commands depend on the file's header, since it gives the positions of columns. Plans depend on
+    the file's size through the planner's estimates, so unless the file has statistics, its size
+    is only described to the nearest power of two. When the file has statistics, the statistics
+    and the file's exact size and modification time are described instead, as they are what the
+    statistics are checked against. A plan that reads a sorted copy of the file names the copy
+    made for the file's exact identity, so given exact, its inode, size and modification time are
+    described too.
+    """
+
+    with open_input(file_path) as f:
+        header = f.readline().rstrip()
+
+    file_stat = os.stat(file_path)
+    signature = {'path': file_path, 'header': hashlib.sha1(header).hexdigest()}
+    try:
+        stats_stat = os.stat(get_stats_path(file_path))
+    except OSError:
+        signature['size_class'] = int(file_stat.st_size).bit_length()
+    else:
+        signature['stats'] = [
+            file_stat.st_size, file_stat.st_mtime, stats_stat.st_size, stats_stat.st_mtime]
+    if exact:
+        signature['identity'] = [file_stat.st_ino, file_stat.st_size, file_stat.st_mtime]
+    return signature
+
+
+class PlanCache(object):
+    """An on-disk cache of the commands generated for queries, with one file per query. Entries
+    are evicted least recently used first once the cache grows past its maximum size."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        # entries read or written by this process, so a long-running process reads each once
+        self._entries = {}
+
+    @classmethod
+    def get_key(cls, sql_str, options):
+        """Return the cache key of a query given its SQL and the options it was translated with.
+        Options must be JSON-serializable."""
+
+        key = json.dumps([normalize_sql(sql_str), options, get_code_fingerprint()], sort_keys=True)
+        return hashlib.sha1(key).hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def get(self, key):
+        """Return the cached command for the given key, or None if there is none or an input
+        file has changed since it was generated."""
+
+        entry_path = self._get_entry_path(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+            except (IOError, ValueError):
+                return None
+
+        try:
+            is_valid = all(
+                get_file_signature(signature['path'], 'identity' in signature) == signature
+                for signature in entry['inputs'])
+        except (IOError, OSError):
+            is_valid = False
+        if not is_valid:
+            LOG.debug('Ignoring stale cached plan {0}'.format(entry_path))
+            self._entries.pop(key, None)
+            return None
+        self._entries[key] = entry
+
+        # mark the entry as recently used
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+
+        LOG.debug('Using cached plan {0}'.format(entry_path))
+        command = entry['command']
+        return command.encode('utf-8') if isinstance(command, unicode) else command
+
+    def put(self, key, file_paths, command, exact_paths=()):
+        """Cache the command generated for the given key from the given input files, of which
+        those at the exact paths must be unchanged for it to be reused, e.g. since it reads sorted
+        copies of them."""
+
+        if '-' in file_paths:
+            return  # standard input can't be checked for changes
+
+        try:
+            entry = {
+                'inputs': [
+                    get_file_signature(file_path, file_path in exact_paths)
+                    for file_path in file_paths
+                ],
+                'command': command,
+            }
+        except (IOError, OSError):
+            return
+
+        self._entries[key] = entry
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            # write to a temporary file and rename it so that concurrent readers never see a
+            # partly written entry
+            entry_path = self._get_entry_path(key)
+            tmp_path = '{0}.{1}.tmp'.format(entry_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.rename(tmp_path, entry_path)
+            self.evict()
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug('Could not cache plan: {0}'.format(e))
+
+    def get_input_paths(self, key):
+        """Return the paths of the input files of the command last returned for the given key."""
+        return [signature['path'] for signature in self._entries[key]['inputs']]
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is no larger than its maximum
+        size."""
+
+        for file_name in evict_least_recently_used(self.cache_dir, CACHE_FILE_SUFFIX, self.max_bytes):
+            self._entries.pop(file_name[:-len(CACHE_FILE_SUFFIX)], None)
+            LOG.debug('Evicted cached plan {0}'.format(file_name))
+
+
+class ResultCache(object):
+    """An on-disk cache of the output of executed queries, with one file per result, keyed on the
+    commands that produced it and the identity of their input files. Entries are evicted least
+    recently used first once the cache grows past its maximum size."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def get_key(cls, command, file_paths):
+        """Return the cache key of the output of a command reading the given files, or None if
+        its output can't be cached: it reads standard input or has random output."""
+
+        if '-' in file_paths or '$RANDOM' in command:
+            return None
+
+        identities = []
+        for file_path in file_paths:
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                return None
+            identities.append([
+                os.path.abspath(file_path), file_stat.st_ino, file_stat.st_size, file_stat.st_mtime])
+
+        return hashlib.sha1(json.dumps([command, identities])).hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key + RESULT_FILE_SUFFIX)
+
+    def get(self, key):
+        """Return the path of the file holding the cached output for the given key, or None."""
+
+        entry_path = self._get_entry_path(key)
+        try:
+            os.utime(entry_path, None)  # mark the entry as recently used
+        except OSError:
+            return None
+
+        LOG.debug('Using cached result {0}'.format(entry_path))
+        return entry_path
+
+    def get_caching_cmd(self, key, command):
+        """Return a command that outputs the output of the given command and caches it for the
+        given key if the command succeeds: its pipeline and each of its process substitutions
+        exit with status 0, and it isn't terminated."""
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # the result being cached will take some of the space freed up here
+        for file_name in evict_least_recently_used(self.cache_dir, RESULT_FILE_SUFFIX, self.max_bytes):
+            LOG.debug('Evicted cached result {0}'.format(file_name))
+
+        # pipefail doesn't see the status of process substitutions, so each writes its own
+        command, substitution_count = record_substitution_statuses(command)
+
+        # write to a temporary directory that's removed however the command exits, and rename the
+        # result into the cache so that readers never see a partial result. A terminated command,
+        # e.g. by a failed sort order check, exits once its pipeline has, without caching it.
+        return (
+            'sqltxt_tmp=$(mktemp -d {0}) || exit; trap \'rm -rf "$sqltxt_tmp"\' EXIT; '
+            'trap \'exit 143\' TERM; set -o pipefail; {1} | tee "$sqltxt_tmp/result" && '
+            '[ "$(cat "$sqltxt_tmp"/status.* 2> /dev/null | grep -cx 0)" = {2} ] && '
+            'mv "$sqltxt_tmp/result" {3}'
+        ).format(shell_quote(os.path.join(self.cache_dir, 'tmp.XXXXXX')), command,
+            substitution_count, shell_quote(self._get_entry_path(key)))
+
+def record_substitution_statuses(command):
+    """Return the given command with each of its process substitutions writing its exit status
+    to a file named status.<its pid> in the directory $sqltxt_tmp, and the number of process
+    substitutions. Text in quotes is left as it is."""
+
+    parts = []
+    substitution_count = 0
+    quote = None
+    idx = 0
+    while idx < len(command):
+        char = command[idx]
+        if quote == "'":
+            quote = None if char == "'" else quote
+        elif char == '\\':
+            parts.append(command[idx:idx + 2])
+            idx += 2
+            continue
+        elif quote == '"':
+            quote = None if char == '"' else quote
+        elif char in '\'"':
+            quote = char
+        elif command.startswith('<(', idx):
+            parts.append('<(trap \'echo $? > "$sqltxt_tmp/status.$BASHPID"\' EXIT; ')
+            substitution_count += 1
+            idx += 2
+            continue
+        parts.append(char)
+        idx += 1
+    return ''.join(parts), substitution_count
+
+class SortedRunCache(object):
+    """An on-disk cache of copies of input files with their rows sorted by some of their columns,
+    keyed on the identity of the file, the columns, the delimiter and the collation locale. Entries
+    are evicted least recently used first once the cache grows past its maximum size."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get_run(self, file_path, delimiter, column_idxs, offset, sort_options,
+            decompress_cmd=None):
+        """Return a description of the sorted copy of a file for reading it in the order of the
+        columns at the given indices, or None if the file can't be cached. Its 'path' is where
+        the copy is, 'is_cached' is true if it's already there, and 'fill_cmd' is a command that
+        sorts the file into it unless it's already there.
+
+        :param offset: the number of header lines, which are copied unsorted
+        :param decompress_cmd: a command writing the file's contents if it's compressed; the
+            sorted copy isn't
+        """
+
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        key = hashlib.sha1(json.dumps([
+            os.path.abspath(file_path), file_stat.st_ino, file_stat.st_size, file_stat.st_mtime,
+            delimiter, column_idxs, sort_options.locale,
+        ])).hexdigest()
+        run_path = os.path.join(self.cache_dir, key + SORTED_RUN_FILE_SUFFIX)
+
+        try:
+            os.utime(run_path, None)  # mark the entry as recently used
+            is_cached = True
+        except OSError:
+            is_cached = False
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                # the run being filled will take some of the space freed up here
+                for file_name in evict_least_recently_used(
+                        self.cache_dir, SORTED_RUN_FILE_SUFFIX, self.max_bytes):
+                    LOG.debug('Evicted sorted run {0}'.format(file_name))
+            except OSError as e:
+                LOG.debug('Could not cache sorted run: {0}'.format(e))
+                return None
+
+        # the run is filled whenever it's missing when the command runs, rather than only if it
+        # was missing when the command was generated, since the command may be cached and reused;
+        # it's written to a temporary file and renamed so that readers never see a partial run
+        quoted_run_path = shell_quote(run_path)
+        quoted_file_path = shell_quote(file_path)
+        sort_cmd = sort_options.get_sort_cmd(delimiter, column_idxs)
+        if decompress_cmd:
+            # the decompressor writing the header stops early when head exits
+            copy_cmd = '{0} 2> /dev/null | head -n{1}; {0} | tail -n+{2} | {3};'.format(
+                decompress_cmd, offset, offset + 1, sort_cmd)
+        else:
+            copy_cmd = 'head -n{0} {1}; tail -n+{2} {1} | {3};'.format(
+                offset, quoted_file_path, offset + 1, sort_cmd)
+        fill_cmd = (
+            '{{ [ -e {0} ] || {{ tmp={0}.$BASHPID.tmp; {{ {1} }} '
+            '> "$tmp" && mv "$tmp" {0} || {{ rm -f "$tmp"; false; }}; }}; }}'
+        ).format(quoted_run_path, copy_cmd)
+
+        return {'path': run_path, 'is_cached': is_cached, 'fill_cmd': fill_cmd}
+
+def evict_least_recently_used(cache_dir, suffix, max_bytes):
+    """Remove the least recently used files with the given suffix from the given directory until
+    they total no more than the given size, and return their names."""
+
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith(suffix):
+            try:
+                file_stat = os.stat(os.path.join(cache_dir, file_name))
+            except OSError:
+                continue
+            entries.append((file_stat.st_mtime, file_stat.st_size, file_name))
+
+    evicted = []
+    total_bytes = sum(size for mtime, size, file_name in entries)
+    for mtime, size, file_name in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, file_name))
+        except OSError:
+            continue
+        total_bytes -= size
+        evicted.append(file_name)
+    return evicted
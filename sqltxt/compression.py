@@ -0,0 +1,94 @@
+"""Read compressed input files by streaming them through a decompressor, both in generated commands
+and when reading their headers and sampling their rows, so that they never need decompressing to
+disk first.
+
+A file's format is detected by its magic bytes, or by its extension if it can't be read without
+consuming it, e.g. a named pipe. Each format is decompressed by the first of its decompressors
+found on the PATH, which are listed with parallel ones first.
+"""
+
+import os
+import signal
+import subprocess
+
+from util import find_executable, shell_quote
+
+# (format, magic bytes, file extensions, decompressor commands in order of preference)
+FORMATS = [
+    ('gzip', '\x1f\x8b', ('.gz', '.gzip'), ['pigz -dc', 'gzip -dc']),
+    ('zstd', '\x28\xb5\x2f\xfd', ('.zst', '.zstd'), ['zstd -dcq']),
+    ('bzip2', 'BZh', ('.bz2',), ['lbzip2 -dc', 'pbzip2 -dc', 'bzip2 -dc']),
+    ('xz', '\xfd7zXZ\x00', ('.xz',), ['xz -dc -T0']),
+]
+MAGIC_BYTES_LENGTH = max(len(magic) for _, magic, _, _ in FORMATS)
+
+# the assumed ratio of the decompressed size of a file to its size, for estimating its rows
+ESTIMATED_COMPRESSION_RATIO = 4.0
+
+class NoDecompressorError(Exception):
+
+    def __init__(self, file_path, format_name):
+        message = 'Found no decompressor for {0} file {1}'.format(format_name, file_path)
+        super(self.__class__, self).__init__(message)
+
+def detect_compression(file_path):
+    """Return the name of the compression format of the given file, or None if it's not
+    compressed."""
+
+    if os.path.isfile(file_path):
+        with open(file_path, 'rb') as f:
+            magic_bytes = f.read(MAGIC_BYTES_LENGTH)
+        for format_name, magic, _, _ in FORMATS:
+            if magic_bytes.startswith(magic):
+                return format_name
+        return None
+
+    for format_name, _, extensions, _ in FORMATS:
+        if file_path.lower().endswith(extensions):
+            return format_name
+    return None
+
+def get_decompress_cmd(file_path):
+    """Return a command that writes the decompressed contents of the given file, or None if the
+    file isn't compressed."""
+
+    format_name = detect_compression(file_path)
+    if format_name is None:
+        return None
+
+    decompressors = [d for name, _, _, ds in FORMATS if name == format_name for d in ds]
+    for decompressor in decompressors:
+        if find_executable(decompressor.split()[0]):
+            return '{0} {1}'.format(decompressor, shell_quote(file_path))
+    raise NoDecompressorError(file_path, format_name)
+
+class open_input(object):
+    """Open a file for reading its lines, decompressing it on the fly if it's compressed. Use as a
+    context manager, which stops the decompressor on exit even if not all of its output was
+    read."""
+
+    def __init__(self, file_path):
+        decompress_cmd = get_decompress_cmd(file_path)
+        self._process = None
+        if decompress_cmd is None:
+            self._file = open(file_path)
+        else:
+            with open(os.devnull, 'w') as devnull:
+                self._process = subprocess.Popen(['/bin/bash', '-c', decompress_cmd],
+                    stdout=subprocess.PIPE, stderr=devnull, preexec_fn=_restore_sigpipe)
+            self._file = self._process.stdout
+
+    def __enter__(self):
+        return self._file
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+
+def _restore_sigpipe():
+    # Python ignores SIGPIPE, which a decompressor would inherit, so that it would keep running
+    # after its reader stopped reading
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
@@ -0,0 +1,156 @@
+"""Describe the plan of a query as a tree of the operations that produce its rows, and instrument
+its commands to count the rows and bytes each operation actually outputs and when it finishes.
+
+Each counted command's output is copied by tee to a counter, which writes the number of lines and
+bytes it read and the time it read the last of them to a file named by the command's index. An
+instrumented query is run by a script that records its start time, discards its output, and then
+runs this module to print the plan with the counts.
+"""
+
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from util import format_size, shell_quote
+
+# the shell variable holding the directory that counters write to
+COUNTER_DIR_VAR = 'sqltxt_counters'
+PLAN_FILE_NAME = 'plan.json'
+START_FILE_NAME = 'start'
+
+# how long to wait for counters to write their files once the query's pipeline is done; they run
+# in process substitutions, which the shell doesn't wait for
+COUNTER_TIMEOUT_SECONDS = 5.0
+COUNTER_POLL_INTERVAL = 0.01
+
+class StageCounters(object):
+    """Instrument commands to count the rows they output."""
+
+    def __init__(self):
+        self._next_counter = 0
+
+    def get_counting_cmd(self, cmd, stage):
+        """Return a command that runs the given command and counts its output, assigning the
+        stage describing it a counter the first time."""
+
+        if stage.get('counter') is None:
+            stage['counter'] = self._next_counter
+            self._next_counter += 1
+
+        counter_path = '"${0}/{1}"'.format(COUNTER_DIR_VAR, stage['counter'])
+        return '{0} | tee >({{ wc -lc; date +%s.%N; }} > {1}.tmp && mv {1}.tmp {1})'.format(
+            cmd, counter_path)
+
+def get_analyzing_cmd(cmd, plan):
+    """Return a command that runs an instrumented query's command, discarding its output, and
+    then prints its plan with the counts of each counted operation's output."""
+
+    counter_dir = tempfile.mkdtemp(prefix='sqltxt-explain-')
+    with open(os.path.join(counter_dir, PLAN_FILE_NAME), 'w') as f:
+        json.dump(plan, f)
+
+    return (
+        '{0}={1}; date +%s.%N > "${0}/{2}"; ({3}) > /dev/null; status=$?; '
+        '{4} -m sqltxt.explain "${0}"; exit $status'
+    ).format(COUNTER_DIR_VAR, shell_quote(counter_dir), START_FILE_NAME, cmd,
+        shell_quote(sys.executable))
+
+def read_counters(counter_dir, plan, timeout=COUNTER_TIMEOUT_SECONDS):
+    """Return a dictionary of the rows, bytes and finish time in seconds since the query started
+    of each counter in the plan, keyed by counter. Counters that haven't written their file by the
+    timeout are left out."""
+
+    with open(os.path.join(counter_dir, START_FILE_NAME)) as f:
+        start_time = float(f.read())
+
+    counters = {}
+    pending = set(_get_counters(plan))
+    deadline = time.time() + timeout
+    while pending:
+        for counter in list(pending):
+            try:
+                with open(os.path.join(counter_dir, str(counter))) as f:
+                    rows, size, finish_time = f.read().split()
+            except (IOError, ValueError):
+                continue
+            counters[counter] = {
+                'rows': int(rows),
+                'bytes': int(size),
+                'seconds': float(finish_time) - start_time,
+            }
+            pending.remove(counter)
+
+        if pending and time.time() >= deadline:
+            break
+        elif pending:
+            time.sleep(COUNTER_POLL_INTERVAL)
+
+    return counters
+
+def _get_counters(node):
+    counters = [node['counter']] if node['counter'] is not None else []
+    for input_node in node['inputs']:
+        counters.extend(_get_counters(input_node))
+    return counters
+
+def render_plan(plan, counters=None):
+    """Return the plan as an indented tree with one operation per line, each followed by its input
+    operations. Given counters, the rows and bytes each counted operation output are included,
+    along with when it finished and how long after its last input finished."""
+
+    lines = []
+    _render_node(plan, counters, 0, lines)
+    return '\n'.join(lines)
+
+def _render_node(node, counters, depth, lines):
+    """Append the lines describing a node and its inputs, and return the time the node finished,
+    or None if it's unknown."""
+
+    line_idx = len(lines)
+    lines.append(None)
+
+    input_finish_times = [
+        _render_node(input_node, counters, depth + 1, lines) for input_node in node['inputs']]
+    known_input_finish_times = [t for t in input_finish_times if t is not None]
+    inputs_finish_time = max(known_input_finish_times) if known_input_finish_times else 0.0
+
+    properties = []
+    if node['estimated_rows'] is not None:
+        properties.append('est. {0:.0f} rows'.format(node['estimated_rows']))
+
+    finish_time = None
+    if counters is not None:
+        counter = counters.get(node['counter'])
+        if counter is not None:
+            finish_time = counter['seconds']
+            properties.append('{0} rows, {1} in {2:.3f}s, done at {3:.3f}s'.format(
+                counter['rows'], format_size(counter['bytes']),
+                max(finish_time - inputs_finish_time, 0.0), finish_time))
+        elif node['counter'] is None and known_input_finish_times:
+            finish_time = inputs_finish_time  # its rows were counted by the operation it's part of
+
+    description = ' '.join(
+        part for part in (node['operation'].capitalize(), node['detail']) if part)
+    if properties:
+        description += '  ({0})'.format('; '.join(properties))
+    lines[line_idx] = '  ' * depth + description
+    return finish_time
+
+def main():
+    """Print the plan of an instrumented query that has run, with its counts, and remove the
+    directory holding them."""
+
+    counter_dir = sys.argv[1]
+    try:
+        with open(os.path.join(counter_dir, PLAN_FILE_NAME)) as f:
+            plan = json.load(f)
+        print(render_plan(plan, read_counters(counter_dir, plan)).encode('utf-8'))
+    finally:
+        shutil.rmtree(counter_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,118 +1,181 @@
 import collections
 import re
 
-import ast
-import sympy as sp
-from sympy.logic import boolalg
-
 from column import ColumnName, InvalidColumnNameError
 
-def get_cnf_conditions(conditions_str):
-    tree = ast.parse(conditions_str)
-    cp = ConditionParser()
-    cp.visit(tree)
-    return cp.cnf_conditions
-
-
-class ConditionParser(ast.NodeVisitor):
-
-    def __init__(self, *args, **kwargs):
-        self.conditions = None
-        self.ops_stack = []
-        self.boolean_ops_map = { ast.Or: sp.Or, ast.And: sp.And, }
-        self.relational_ops_map = {
-            ast.Eq : '==',
-            ast.Gt : '>',
-            ast.GtE : '>=',
-            ast.Lt : '<',
-            ast.LtE : '<=',
-            ast.NotEq : '!=',
-        }
-        self.expression_symbols = {}
-        super(self.__class__, self).__init__(*args, **kwargs)
-
-    def visit_BoolOp(self, node):
-        """Given a BoolOp node in the AST, translate it to a SymPy operator, stash it
-        in a dictionary with its arguments and append the dictionary to the stack."""
-        boolean_op = self.boolean_ops_map[node.op.__class__]
+# the most clauses that distributing ORs over ANDs may produce for a condition; a condition that
+# would produce more is kept whole, as a single filter, instead of being converted to CNF
+MAX_CNF_CLAUSES = 64
 
-        self.ops_stack.append({'op': boolean_op, 'args': []})
+def get_cnf_conditions(conditions, max_clauses=MAX_CNF_CLAUSES):
+    """Given a list of condition dictionaries (or [left operand, operator, right operand] lists),
+    'and' and 'or' strings, and nested lists of the same, return an AndList of equivalent
+    conditions in conjunctive normal form. Each item of the AndList is an Expression or an OrList
+    of Expressions, or a condition too large to convert, as a nested AndList or OrList."""
 
-        for value in node.values:
-            self.visit(value)
+    condition = build_condition(conditions)
+    clauses = _get_cnf_clauses(condition, max_clauses)
+    clauses = _remove_subsumed_clauses(clauses)
 
-        this_op = self.ops_stack.pop()
-
-        if self.ops_stack:
-            self.ops_stack[-1]['args'].append(this_op['op'](*this_op['args']))
-        else:
-            self.conditions = this_op['op'](*this_op['args'])
+    return AndList([clause[0] if len(clause) == 1 else OrList(clause) for clause in clauses])
 
-    def visit_Compare(self, node):
-        """Given a Compare node in the AST, translate it to a sqltxt Expression and append it to
-        the stack."""
+def build_condition(tokens):
+    """Given parsed condition tokens, return the equivalent Expression, AndList, or OrList. AND
+    binds more tightly than OR, as in SQL."""
 
-        expr_operands = []
-        for child_node in (node.left, node.comparators[0], ):
-            operand = self._get_attribute_name(child_node)
-            expr_operands.append(operand)
-
-        operator = self.relational_ops_map[node.ops[0].__class__]
-
-        expr = Expression(expr_operands[0], operator, expr_operands[1])
-        expr_symbol = sp.Symbol(str(expr))
-        self.expression_symbols[expr_symbol] = expr
+    if isinstance(tokens, dict):
+        return Expression(
+            parse_operand(tokens['left_operand']),
+            tokens['operator'],
+            parse_operand(tokens['right_operand'])
+        )
+    elif isinstance(tokens, (Expression, BooleanExpression)):
+        return tokens
+    elif _is_comparison(tokens):
+        return Expression(parse_operand(tokens[0]), tokens[1], parse_operand(tokens[2]))
+
+    # split the tokens into terms separated by 'or', each of which is a conjunction
+    disjuncts = [[]]
+    for token in tokens:
+        if isinstance(token, basestring) and token.lower() == 'or':
+            disjuncts.append([])
+        elif not (isinstance(token, basestring) and token.lower() == 'and'):
+            disjuncts[-1].append(build_condition(token))
+
+    disjuncts = [d[0] if len(d) == 1 else AndList(d) for d in disjuncts if d]
+    if not disjuncts:
+        return AndList([])
+    return disjuncts[0] if len(disjuncts) == 1 else OrList(disjuncts)
+
+def format_condition(condition):
+    """Return a condition as SQL, for describing plans."""
+
+    if isinstance(condition, BooleanExpression):
+        return ' {0} '.format(condition.operator_str).join(
+            '({0})'.format(format_condition(arg)) if isinstance(arg, BooleanExpression)
+            else format_condition(arg)
+            for arg in condition.args
+        )
+    elif isinstance(condition, list):
+        # conditions separated by 'and' and 'or' strings, as Table.subset_rows also takes them
+        return ' '.join(
+            term if isinstance(term, basestring)
+            else '({0})'.format(format_condition(term)) if isinstance(term, (list, BooleanExpression))
+            else format_condition(term)
+            for term in condition
+        )
 
-        if self.ops_stack:
-            self.ops_stack[-1]['args'].append(expr_symbol)
-        else:
-            self.conditions = expr_symbol
-
-    def _get_attribute_name(self, node):
-        if isinstance(node, ast.Attribute):
-            name = self._get_attribute_name(node.value) + '.' + node.attr
-        elif isinstance(node, ast.Name):
-            name = node.id
-        elif isinstance(node, ast.Str):
-            name = '"' + node.s + '"'
+    operands = [
+        operand.original_token if isinstance(operand, ColumnName) else str(operand)
+        for operand in (condition.left_operand, condition.right_operand)
+    ]
+    operator = '=' if condition.operator == '==' else condition.operator
+    return '{0} {1} {2}'.format(operands[0], operator, operands[1])
+
+# characters of a LIKE pattern that are escaped to match themselves in a regular expression, which
+# is written between slashes in awk
+_REGEX_SPECIAL_CHARS = re.compile(r'([\\^$.|?*+()\[\]{}/])')
+
+def like_pattern_to_regex(pattern):
+    """Return an extended regular expression, which both awk and Python's re understand, that
+    matches the same strings as a SQL LIKE pattern: % matches any run of characters and _ matches
+    any one character."""
+
+    regex_parts = []
+    for char in pattern:
+        if char == '%':
+            regex_parts.append('.*')
+        elif char == '_':
+            regex_parts.append('.')
         else:
-            name = node.n
+            regex_parts.append(_REGEX_SPECIAL_CHARS.sub(r'\\\1', char))
+    return '^{0}$'.format(''.join(regex_parts))
+
+def get_like_pattern_literals(pattern):
+    """Return the runs of characters of a SQL LIKE pattern between its wildcards, all of which a
+    matching string contains."""
+    return [literal for literal in re.split('[%_]', pattern) if literal]
+
+def _is_comparison(tokens):
+    """Return true if the tokens are a [left operand, operator, right operand] list."""
+
+    if len(tokens) != 3 or any(isinstance(t, (list, dict)) for t in tokens):
+        return False
+    try:
+        normalize_relational_operator(tokens[1])
+    except InvalidExpressionOperator:
+        return False
+    return True
+
+def parse_operand(operand):
+    """Return a quoted string literal in double quotes, a numeric literal as a number, and any other
+    operand unchanged."""
+
+    if not isinstance(operand, basestring):
+        return operand
+    if len(operand) > 1 and operand[0] == operand[-1] and operand[0] in '\'"':
+        return '"' + operand[1:-1] + '"'
+    for numeric_type in (int, float):
+        try:
+            return numeric_type(operand)
+        except ValueError:
+            pass
+    return operand
+
+def _get_cnf_clauses(condition, max_clauses):
+    """Return the condition in conjunctive normal form, as a list of clauses that are each a list
+    of terms. Duplicate terms and clauses are dropped."""
+
+    if isinstance(condition, AndList):
+        clauses = []
+        for arg in condition.args:
+            _extend_unique(clauses, _get_cnf_clauses(arg, max_clauses), _is_same_clause)
+        return clauses
+
+    elif isinstance(condition, OrList):
+        clauses = [[]]
+        for arg in condition.args:
+            arg_clauses = _get_cnf_clauses(arg, max_clauses)
+
+            # distributing this OR over the ANDs in its terms would make too many clauses
+            if len(clauses) * len(arg_clauses) > max_clauses:
+                return [[condition]]
+
+            distributed = []
+            for clause in clauses:
+                for arg_clause in arg_clauses:
+                    terms = list(clause)
+                    _extend_unique(terms, arg_clause, _is_same_term)
+                    _extend_unique(distributed, [terms], _is_same_clause)
+            clauses = distributed
+        return clauses
+
+    return [[condition]]
+
+def _remove_subsumed_clauses(clauses):
+    """Drop each clause that holds all the terms of another clause, since it is implied by it."""
+
+    return [
+        clause for idx, clause in enumerate(clauses)
+        if not any(
+            other_idx != idx and _is_subset(other, clause)
+            for other_idx, other in enumerate(clauses)
+        )
+    ]
 
-        return name
+def _is_same_term(left, right):
+    return type(left) == type(right) and left == right
 
-    @property
-    def cnf_conditions(self):
-        cnf = sp.to_cnf(self.conditions)
-        cnf_expressions = self.get_expressions(cnf, self.expression_symbols)
-        if not isinstance(cnf_expressions, AndList):
-            cnf_expressions = AndList([cnf_expressions])
-
-        return cnf_expressions
-
-    @classmethod
-    def get_expressions(cls, conditions, expression_symbols):
-        """Given conditions as symbols in CNF, return those same conditions as Expressions in a
-        list."""
-
-        expressions = []
-        if isinstance(conditions, sp.Symbol):
-            expressions.append(expression_symbols[conditions])
-        elif isinstance(conditions, boolalg.BooleanFunction):
-            for arg in conditions.args:
-                if isinstance(arg, sp.Symbol):
-                    expressions.append(expression_symbols[arg])
-                elif isinstance(arg, sp.Or):
-                    or_expressions = OrList(cls.get_expressions(arg, expression_symbols))
-                    expressions.append(or_expressions)
-                else:
-                    raise Exception("Conditions aren't in CNF: {}".format(conditions))
-                
-        if isinstance(conditions, sp.Or):
-            return_wrapper = OrList
-        else:
-            return_wrapper = AndList
-        return return_wrapper(expressions)
+def _is_subset(terms, other_terms):
+    return all(any(_is_same_term(term, other) for other in other_terms) for term in terms)
 
+def _is_same_clause(left, right):
+    return _is_subset(left, right) and _is_subset(right, left)
+
+def _extend_unique(items, new_items, is_same):
+    for new_item in new_items:
+        if not any(is_same(new_item, item) for item in items):
+            items.append(new_item)
 
 def normalize_relational_operator(operator):
 
@@ -123,7 +186,8 @@ def normalize_relational_operator(operator):
         'ge': '>=',
         'gt': '>',
         'le': '<=',
-        'lt': '<'
+        'lt': '<',
+        'LIKE': 'like',
     }
 
     if operator in comparison_operators:
@@ -192,15 +256,25 @@ class Expression(object):
 
     def __eq__(self, other):
         return  \
+            isinstance(other, Expression) and \
             self.left_operand == other.left_operand and \
             self.operator == other.operator and \
             self.right_operand == other.right_operand
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.left_operand, self.operator, self.right_operand))
+
 class BooleanExpression(collections.MutableSequence):
     """A base class for boolean binary operators ('and' and 'or')."""
 
     operator_str = 'NotImplemented'
 
+    # a boolean combination of conditions is applied as a filter, never as a join condition
+    can_join = False
+
     def __init__(self, args):
         self.args = args
 
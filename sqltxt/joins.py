@@ -1,11 +1,25 @@
+import copy
+
 from column import Column, ColumnName, merge_columns
-from table import Table
+from table import Table, WAIT_FOR_PIDS_CMD
+from plan import use_hash_join, use_partitioned_join
+from expression import format_condition
 
 import logging
 LOG = logging.getLogger(__name__)
 
-def join_tables(left_table, right_table, join_type, join_conditions):
-    """Return a Table representing the join of the left and right Tables of this Query."""
+# modulus of the polynomial string hash that assigns rows to the buckets of a partitioned join
+BUCKET_HASH_MODULUS = 1000003
+
+def join_tables(left_table, right_table, join_type, join_conditions, hash_join_threshold=0,
+        partitioned_join_threshold=0, partitions=1):
+    """Return a Table representing the join of the left and right Tables of this Query.
+
+    If the right Table's estimated size is within the hash join threshold, it is loaded into memory
+    and the left Table is streamed past it unsorted. If both Tables' estimated sizes reach the
+    partitioned join threshold, they are split into the given number of partitions by the hash of
+    their join columns and the partitions are joined concurrently. Otherwise both Tables are sorted
+    and merged."""
 
     LOG.debug('Performing join on ({0})'.format(
       ', '.join([str(c) for c in join_conditions])))
@@ -16,21 +30,128 @@ def join_tables(left_table, right_table, join_type, join_conditions):
     left_indices = [li for li, ri in indices]
     right_indices = [ri for li, ri in indices]
 
+    # inputs joined on several columns are always sorted by a key combining those columns
+    inputs_sorted = len(indices) == 1 and left_table.is_sorted_by(left_indices) and \
+        right_table.is_sorted_by(right_indices)
+    if use_hash_join(right_table.estimated_bytes, hash_join_threshold, inputs_sorted):
+        join_result_table = _hash_join_tables(left_table, right_table, indices)
+    elif partitions > 1 and use_partitioned_join(left_table.estimated_bytes,
+            right_table.estimated_bytes, partitioned_join_threshold, inputs_sorted):
+        join_result_table = _partitioned_join_tables(left_table, right_table, indices, partitions)
+    else:
+        join_result_table = _merge_join_tables(left_table, right_table, indices)
+
+    # the join methods see the join conditions only as column indices
+    join_result_table.stages[0]['detail'] = 'on {0}'.format(
+        ' and '.join(format_condition(condition) for condition in join_conditions))
+    join_result_table.stage_counters = left_table.stage_counters
+    join_result_table.awk = left_table.awk
+    return join_result_table
+
+def _partitioned_join_tables(left_table, right_table, indices, partitions):
+    """Return a Table representing the join of the left and right Tables, each written to a file
+    per partition by the hash of their join columns in a single pass, with each pair of partitions
+    merge-joined concurrently and the results concatenated. Each sort sees only its partition of
+    the rows, with its share of the threads and memory."""
+
+    LOG.debug('Joining {0} and {1} in {2} partitions'.format(left_table, right_table, partitions))
+
+    left_indices = [li for li, ri in indices]
+    right_indices = [ri for li, ri in indices]
+    sort_options = left_table.sort_options
+    partition_sort_options = sort_options.shared_by(2 * partitions)
+
+    partition_cmds = [
+        _get_partitioning_cmd(left_table, left_indices, 'left', partitions),
+        _get_partitioning_cmd(right_table, right_indices, 'right', partitions),
+    ]
+
+    # join each pair of partitions as if they were the whole Tables
+    join_cmds = []
+    for partition in range(partitions):
+        partition_tables = []
+        for table, side in ((left_table, 'left'), (right_table, 'right')):
+            partition_table = Table.from_cmd(
+                name = '{0}_{1}'.format(table.name, partition),
+                cmd = 'cat "$d/{0}{1}"'.format(side, partition),
+                columns = [copy.deepcopy(col) for col in table.columns],
+                sort_options = partition_sort_options
+            )
+            partition_table.awk = table.awk
+            partition_tables.append(partition_table)
+        partition_result = _merge_join_tables(partition_tables[0], partition_tables[1], indices)
+        join_cmds.append('{{ {0} > "$d/joined{1}"; }} & pids="$pids $!";'.format(
+            partition_result.get_cmd_str(), partition))
+
+    # the command fails if any step fails, and removes the partitions however it exits
+    joined_paths = ' '.join('"$d/joined{0}"'.format(p) for p in range(partitions))
+    join_cmd = (
+        '( set -o pipefail; d=$(mktemp -d) || exit; trap \'rm -rf "$d"\' EXIT; '
+        'pids=; {{ {0}; }} & pids="$pids $!"; {{ {1}; }} & pids="$pids $!"; {4} '
+        'pids=; {2} {4} cat {3}; )'
+    ).format(partition_cmds[0], partition_cmds[1], ' '.join(join_cmds), joined_paths,
+        WAIT_FOR_PIDS_CMD)
+
+    join_result_table = Table.from_cmd(
+        name = 'join_result',
+        cmd = join_cmd,
+        columns = partition_result.columns,
+        sort_options = sort_options,
+        stage = {
+            'operation': 'merge join in {0} partitions'.format(partitions),
+            'inputs': [left_table, right_table],
+        }
+    )
+
+    # each partition's result is sorted by the join columns, but their concatenation isn't
+    join_result_table.sorted_by = []
+
+    return join_result_table
+
+def _get_partitioning_cmd(table, column_idxs, prefix, partitions):
+    """Return a command that writes each row of the given Table to the file in directory $d named by
+    the prefix and the bucket that its values at the given indices hash to."""
+
+    # awk has no hash function, so hash the key's characters by their positions in a lookup table
+    partitioning_program = (
+        'BEGIN {{ for (i = 1; i < 256; i++) ord[sprintf("%c", i)] = i; '
+        'for (i = 0; i < n; i++) printf "" > (d "/" p i) }} '
+        '{{ k = {0}; h = 0; for (i = 1; i <= length(k); i++) '
+        'h = (h * 31 + ord[substr(k, i, 1)]) % {1}; print > (d "/" p (h % n)) }}'
+    ).format(_get_awk_key(column_idxs), BUCKET_HASH_MODULUS)
+
+    return '{0} | {1} -F\'{2}\' -v d="$d" -v p={3} -v n={4} \'{5}\''.format(
+        table.get_cmd_str(), table.awk, table.delimiter, prefix, partitions, partitioning_program)
+
+def _merge_join_tables(left_table, right_table, indices):
+    """Return a Table representing the join of the left and right Tables with coreutils' join."""
+
+    if len(indices) > 1:
+        return _composite_merge_join_tables(left_table, right_table, indices)
+
+    left_indices = [li for li, ri in indices]
+    right_indices = [ri for li, ri in indices]
+
     # re-sort tables if necessary
     if not left_table.is_sorted_by(left_indices):
         LOG.debug('Table {0} not sorted prior to join'.format(left_table))
         left_table.sort([left_table.columns[i] for i in left_indices])
+    else:
+        left_table.rely_on_sort_order([left_table.columns[i] for i in left_indices])
 
     if not right_table.is_sorted_by(right_indices):
         LOG.debug('Table {0} not sorted prior to join'.format(right_table))
         right_table.sort([right_table.columns[i] for i in right_indices])
+    else:
+        right_table.rely_on_sort_order([right_table.columns[i] for i in right_indices])
 
     # construct the command that will join the data
     left_indices_arg = ','.join([str(li + 1) for li in left_indices])
     right_indices_arg = ','.join([str(ri + 1) for ri in right_indices])
 
-    join_cmd = "join -t, -1 {0} -2 {1} <({2}) <({3})".format(
-        left_indices_arg, right_indices_arg, 
+    sort_options = left_table.sort_options
+    join_cmd = "{0}join -t, -1 {1} -2 {2} <({3}) <({4})".format(
+        sort_options.get_env_prefix(), left_indices_arg, right_indices_arg,
         left_table.get_cmd_str(), right_table.get_cmd_str())
 
     join_columns = _join_columns(left_table, right_table, indices)
@@ -39,11 +160,123 @@ def join_tables(left_table, right_table, join_type, join_conditions):
     join_result_table = Table.from_cmd(
         name = 'join_result',
         cmd = join_cmd,
-        columns = join_columns
+        columns = join_columns,
+        sort_options = sort_options,
+        stage = {'operation': 'merge join', 'inputs': [left_table, right_table]}
     )
 
+    # join writes its output in the order of its sorted inputs, i.e. sorted by the join columns
+    join_result_table.sorted_by = join_columns[:len(indices)]
+
     return join_result_table
 
+def _composite_merge_join_tables(left_table, right_table, indices):
+    """Return a Table representing the join of the left and right Tables on several columns.
+
+    Coreutils' join matches rows on a single field, so a field holding all of a row's join column
+    values is prepended to each Table's rows, both Tables are sorted and joined on it, and then it is
+    dropped again."""
+
+    left_indices = [li for li, ri in indices]
+    right_indices = [ri for li, ri in indices]
+    left_nonjoin_indices = [i for i in range(len(left_table.columns)) if i not in left_indices]
+    right_nonjoin_indices = [i for i in range(len(right_table.columns)) if i not in right_indices]
+
+    sort_options = left_table.sort_options
+    join_cmd = "{0}join -t, -1 1 -2 1 <({1}) <({2})".format(
+        sort_options.get_env_prefix(),
+        _get_keyed_cmd_str(left_table, left_indices),
+        _get_keyed_cmd_str(right_table, right_indices))
+
+    # join writes the key field, then all of the left Table's fields, then all of the right Table's
+    join_result_table = Table.from_cmd(
+        name = 'join_result',
+        cmd = join_cmd,
+        columns = [Column('join_key')] + left_table.columns + right_table.columns,
+        sort_options = sort_options,
+        stage = {'operation': 'composite key merge join', 'inputs': [left_table, right_table]}
+    )
+
+    n_left_columns = len(left_table.columns)
+    join_result_table.project(
+        [1 + i for i in left_indices + left_nonjoin_indices] +
+        [1 + n_left_columns + i for i in right_nonjoin_indices]
+    )
+    join_columns = _join_columns(left_table, right_table, indices)
+    join_result_table.columns = join_columns
+
+    # the key's values are separated by awk's SUBSEP, which sorts before the (printable) characters
+    # of column values when compared bytewise, so rows sorted by the key are sorted by its columns
+    join_result_table.sorted_by = join_columns[:len(indices)] if sort_options.is_bytewise() else []
+
+    return join_result_table
+
+def _get_keyed_cmd_str(table, column_idxs):
+    """Return a command that writes the rows of the given Table, prefixed with a field holding the
+    values of the columns at the given indices, and sorted by that field."""
+
+    key_cmd = "{0} -F'{1}' 'OFS=\"{1}\" {{ print {2},$0 }}'".format(
+        table.awk, table.delimiter, _get_awk_key(column_idxs))
+    sort_cmd = table.sort_options.get_sort_cmd(table.delimiter, [0])
+    return ' | '.join([table.get_cmd_str(), key_cmd, sort_cmd])
+
+def _hash_join_tables(left_table, right_table, indices):
+    """Return a Table representing the join of the left and right Tables with an awk program that
+    loads the right Table's rows into an array keyed by their join columns, then looks up each of
+    the left Table's rows in it."""
+
+    LOG.debug('Hash joining {0} into memory'.format(right_table))
+
+    left_indices = [li for li, ri in indices]
+    right_indices = [ri for li, ri in indices]
+    left_nonjoin_indices = [i for i in range(len(left_table.columns)) if i not in left_indices]
+    right_nonjoin_indices = [i for i in range(len(right_table.columns)) if i not in right_indices]
+
+    # store the right Table's rows, without their join columns, in the order they're read
+    build_stmts = ['k = {0}'.format(_get_awk_key(right_indices)), 'n[k]++']
+    output_fields = [_get_awk_field(i) for i in left_indices + left_nonjoin_indices]
+    if right_nonjoin_indices:
+        build_stmts.append('rows[k, n[k]] = {0}'.format(
+            ' OFS '.join([_get_awk_field(i) for i in right_nonjoin_indices])))
+        output_fields.append('rows[k, i]')
+
+    # write the output columns in the same order as coreutils' join does
+    join_cmd = (
+        "{6} -F'{0}' 'BEGIN {{ OFS=\"{0}\" }} "
+        "FILENAME == ARGV[1] {{ {1}; next }} "
+        "{{ k = {2}; if (k in n) {{ for (i = 1; i <= n[k]; i++) {{ print {3} }} }} }}' "
+        "<({4}) <({5})"
+    ).format(
+        left_table.delimiter, '; '.join(build_stmts), _get_awk_key(left_indices),
+        ','.join(output_fields), right_table.get_cmd_str(), left_table.get_cmd_str(),
+        left_table.awk)
+
+    join_columns = _join_columns(left_table, right_table, indices)
+
+    join_result_table = Table.from_cmd(
+        name = 'join_result',
+        cmd = join_cmd,
+        columns = join_columns,
+        sort_options = left_table.sort_options,
+        stage = {'operation': 'hash join', 'inputs': [left_table, right_table]}
+    )
+
+    # the output keeps the order of the left Table, whose join columns were merged with the right's
+    join_result_table.sorted_by = [
+        [c for c in join_columns if sorted_column.match(c)][0]
+        for sorted_column in left_table.sorted_by
+    ]
+    join_result_table.verify_sort_order = left_table.verify_sort_order
+
+    return join_result_table
+
+def _get_awk_field(idx):
+    return '${0}'.format(idx + 1)
+
+def _get_awk_key(indices):
+    """Return an awk expression for the array key of the row's values at the given indices."""
+    return ' SUBSEP '.join([_get_awk_field(i) for i in indices])
+
 def validate_join_conditions(join_conditions):
     """Given join conditions defined as string tokens in a dictionary, return a validated set of
     join conditions defined as Column objects in a dictionary."""
@@ -51,16 +284,14 @@ def validate_join_conditions(join_conditions):
     for condition in join_conditions:
         if condition.operator != '==':
             raise ValueError('Operator {} not supported; only equality joins are supported.'.format(
-                operator))
-    
-    n_cond = len(join_conditions)
-    if n_cond > 1:
-        raise ValueError('Only 1 join condition is supported, but {} were found.'.format(n_cond))
+                condition.operator))
      
     return join_conditions
 
 def _get_join_indices(left_table, right_table, join_conditions):
-    """Given the join conditions, return the indices of the columns used in the join."""
+    """Given the join conditions, return the indices of the columns used in the join. Conditions
+    on columns already merged by an earlier join, e.g. b.k = c.k and a.k = c.k after a.k = b.k,
+    resolve to the same pair of indices, which is returned once."""
 
     left_indices = []
     right_indices = []
@@ -83,7 +314,11 @@ def _get_join_indices(left_table, right_table, join_conditions):
                     right_table
                     ))
 
-    return zip(left_indices, right_indices)
+    indices = []
+    for index_pair in zip(left_indices, right_indices):
+        if index_pair not in indices:
+            indices.append(index_pair)
+    return indices
 
 def _join_columns(left_table, right_table, join_indices):
     """Given the indices of join columns, return the ordered column names in the joined result."""
@@ -1,14 +1,63 @@
 import itertools
+import operator
+import os
+import re
 from sqltxt.column import ColumnName
+from sqltxt.compression import open_input, ESTIMATED_COMPRESSION_RATIO
+from sqltxt.expression import Expression, AndList, OrList, like_pattern_to_regex
+from sqltxt.stats import get_column_stats, equality_selectivity, range_selectivity
 from sqltxt.util import PriorityContainer, Queue
 
-def plan(tables, join_conditions, where_conditions):
+# join graphs with more relations than this are ordered greedily instead of enumerated
+MAX_ENUMERATED_RELATIONS = 10
+
+# estimates for relations whose size can't be measured, e.g. those read from stdin
+DEFAULT_ROW_COUNT = 100000
+DEFAULT_ROW_WIDTH = 100
+
+# number of bytes read from the start of a file to estimate its average row width
+ROW_WIDTH_SAMPLE_BYTES = 65536
+
+# selectivities for predicates that nothing more is known about, as in System R
+EQUALITY_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3.0
+
+FLIPPED_OPERATORS = { '<': '>', '<=': '>=', '>': '<', '>=': '<=' }
+
+COMPARISON_FUNCTIONS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'like': lambda value, pattern: re.match(like_pattern_to_regex(pattern), value) is not None,
+}
+
+# number of rows from the start of a file that conditions are evaluated on to estimate how often
+# they hold, when the file has no statistics
+SELECTIVITY_SAMPLE_ROWS = 256
+
+# the relative cost of evaluating a comparison in awk, and the added cost of each field it reads
+# and of comparing strings instead of numbers or of matching a LIKE pattern
+COMPARISON_COST = 1.0
+FIELD_COST = 0.5
+STRING_COMPARISON_COST = 1.0
+PATTERN_MATCH_COST = 2.0
+
+# the largest estimated size in bytes of a relation that a hash join loads into memory
+DEFAULT_HASH_JOIN_THRESHOLD = 64 * 1024 * 1024
+
+def plan(tables, join_conditions, where_conditions, hash_join_threshold=0, estimates=None):
     """Given a list of tables and a list of conditions across those tables, return a list
     of relation indices in an optimized join order."""
 
     graph = build_graph(tables, join_conditions)
-    priorities = prioritize_nodes(graph, where_conditions)
-    node_order = traverse(graph, priorities)
+    if estimates is None:
+        estimates = estimate_relations(tables, where_conditions)
+
+    if len(graph) > MAX_ENUMERATED_RELATIONS:
+        priorities = prioritize_nodes(graph, estimates)
+        node_order = traverse(graph, priorities)
+    else:
+        edges = get_join_edges(tables, join_conditions)
+        node_order = enumerate_join_orders(graph, edges, estimates, hash_join_threshold)
 
     ordered_indices = [
         graph[node]['idx'] for node, ordinal in sorted(node_order.items(), key=lambda x: x[1])
@@ -19,35 +68,425 @@ def build_graph(tables, join_conditions):
     """Given a list of tables and join conditions across those tables, return a graph of
     tables (nodes) connected by join conditions (edges)."""
 
-    equivalent_names = { table.alias: table.name for table in tables }
-    equivalent_names.update({ table.name: table.alias for table in tables })
-
     graph = {}
     for idx, relation in enumerate(tables):
         graph[relation.alias] = { 'idx': idx, 'neighbors': set([]) }
 
-    edges = [
-        (cond.left_operand.qualifiers[0], cond.right_operand.qualifiers[0], )
-        for cond in join_conditions
-    ]
-
-    edges_with_resolved_names = []
-    for left, right in edges:
-        resolved_left = equivalent_names[left] if left not in graph else left
-        resolved_right = equivalent_names[right] if right not in graph else right
-        edges_with_resolved_names.append((resolved_left, resolved_right))
-
-    for left, right in edges_with_resolved_names:
+    for left, right, condition in get_join_edges(tables, join_conditions):
         graph[left]['neighbors'].add(right)
         graph[right]['neighbors'].add(left)
 
     return graph
 
-def prioritize_nodes(graph, where_conditions):
-    """Assign high priority to nodes mentioned in where conditions."""
+def get_join_edges(tables, join_conditions):
+    """Given a list of tables and join conditions across those tables, return a list of
+    (left node, right node, condition) tuples with nodes named by table alias."""
+
+    equivalent_names = { table.alias: table.name for table in tables }
+    equivalent_names.update({ table.name: table.alias for table in tables })
+    aliases = set([table.alias for table in tables])
+
+    edges = []
+    for cond in join_conditions:
+        left = cond.left_operand.qualifiers[0]
+        right = cond.right_operand.qualifiers[0]
+        resolved_left = equivalent_names[left] if left not in aliases else left
+        resolved_right = equivalent_names[right] if right not in aliases else right
+        edges.append((resolved_left, resolved_right, cond))
+
+    return edges
+
+def estimate_relations(tables, where_conditions):
+    """Return a dictionary of size estimates keyed by table alias. Each estimate holds the
+    number of rows expected to pass the table's single-table where conditions, the number of rows
+    in the table, the average row width in bytes, a dictionary of distinct-value counts keyed by
+    column name, and the names of the column the table is already sorted by, if any."""
+
+    estimates = {}
+    for table in tables:
+        stats = table.stats
+        if stats:
+            rows, width = float(stats['row_count']), stats['average_row_width']
+            distinct = dict(
+                (column['name'].lower(), column['distinct']) for column in stats['columns'])
+        else:
+            rows, width = _estimate_size(table)
+            distinct = {}
+
+        input_rows = rows
+        for condition in where_conditions:
+            if _condition_applies(condition, table):
+                rows *= estimate_selectivity(condition, table)
+        estimates[table.alias] = {
+            'rows': max(rows, 1.0),
+            'input_rows': input_rows,
+            'width': width,
+            'distinct': distinct,
+            'sorted_by': tuple(table.sorted_by[0].names) if table.sorted_by else (),
+        }
+    return estimates
+
+def _estimate_size(table):
+    """Return the estimated number of rows and the average row width of an unfiltered table."""
+
+    if table.offset is None or table.name == '-' or not os.path.isfile(table.name):
+        return float(DEFAULT_ROW_COUNT), float(DEFAULT_ROW_WIDTH)
+
+    file_size = os.path.getsize(table.name)
+    if table.decompress_cmd:
+        file_size *= ESTIMATED_COMPRESSION_RATIO
+    with open_input(table.name) as f:
+        sample = f.read(ROW_WIDTH_SAMPLE_BYTES)
+
+    # the sample's first line is the header, which isn't representative of the data
+    sample_rows = sample.count('\n') - table.offset
+    if sample_rows <= 0:
+        return 1.0, float(max(len(sample), 1))
+
+    header_size = len(''.join(sample.splitlines(True)[:table.offset]))
+    width = float(sample.rindex('\n') + 1 - header_size) / sample_rows
+    return max((file_size - header_size) / width, 1.0), width
+
+def _condition_applies(condition, table):
+    """Return true if all columns in the condition are found on the given table."""
+    if not table.columns:
+        return False
+    return all(table.get_column_for_name(cn) is not None for cn in condition.column_names)
+
+def estimate_selectivity(condition, table=None):
+    """Return the estimated fraction of rows that satisfy the given condition, using statistics
+    about the given table's columns if there are any."""
+
+    if isinstance(condition, AndList):
+        selectivity = 1.0
+        for arg in condition.args:
+            selectivity *= estimate_selectivity(arg, table)
+        return selectivity
+    elif isinstance(condition, OrList):
+        non_selectivity = 1.0
+        for arg in condition.args:
+            non_selectivity *= 1.0 - estimate_selectivity(arg, table)
+        return 1.0 - non_selectivity
+
+    selectivity = _estimate_selectivity_from_stats(condition, table)
+    if selectivity is not None:
+        return selectivity
+    elif condition.operator in ('==', 'like'):
+        return EQUALITY_SELECTIVITY
+    elif condition.operator == '!=':
+        return 1.0 - EQUALITY_SELECTIVITY
+    else:
+        return RANGE_SELECTIVITY
+
+def _estimate_selectivity_from_stats(expression, table):
+    """Return the estimated selectivity of an expression comparing a column to a literal value, or
+    None if the expression has another form or there are no statistics about the column."""
+
+    if table is None or table.stats is None or expression.operator == 'like':
+        return None
+
+    operator = expression.operator
+    if isinstance(expression.left_operand, ColumnName) and \
+            not isinstance(expression.right_operand, ColumnName):
+        column_name, value = expression.left_operand, expression.right_operand
+    elif isinstance(expression.right_operand, ColumnName) and \
+            not isinstance(expression.left_operand, ColumnName):
+        column_name, value = expression.right_operand, expression.left_operand
+        operator = FLIPPED_OPERATORS.get(operator, operator)
+    else:
+        return None
+
+    column = table.get_column_for_name(column_name)
+    column_stats = column and get_column_stats(table.stats, column.names[0].name)
+    if not column_stats:
+        return None
+
+    value = _literal_value(value)
+    if operator == '==':
+        return equality_selectivity(column_stats, table.stats['row_count'], value)
+    elif operator == '!=':
+        return 1.0 - equality_selectivity(column_stats, table.stats['row_count'], value)
+    else:
+        return range_selectivity(column_stats, operator, value)
+
+def order_conditions(conditions, table=None):
+    """Return conditions that must all hold in the order that evaluating them one by one, stopping
+    at the first that doesn't hold, is expected to cost least: ordered by their cost divided by
+    the fraction of rows they reject. The terms of ORs are ordered likewise, by their cost divided
+    by the fraction of rows they accept. Comparisons have no side effects, so the order doesn't
+    change which rows satisfy the conditions.
+
+    The fraction of rows each condition holds for is estimated from the table's statistics if it
+    has them, or else by evaluating the condition on rows from the start of the table's file.
+    Conditions other than Expressions, AndLists and OrLists are left in their order.
+    """
+
+    if not all(isinstance(c, (Expression, AndList, OrList)) for c in conditions):
+        return conditions
+    if len(conditions) < 2 and not any(isinstance(c, (AndList, OrList)) for c in conditions):
+        return conditions
+
+    sample_rows = None if table is None or table.stats else _read_sample_rows(table)
+    if sample_rows:
+        selectivity = lambda condition: _sample_selectivity(condition, table, sample_rows)
+    else:
+        selectivity = lambda condition: estimate_selectivity(condition, table)
+
+    return _order_terms(conditions, AndList, selectivity)
+
+def _order_terms(terms, boolean_type, selectivity):
+    """Return the terms of an AndList or OrList of the given type in their cheapest order."""
+
+    terms = [
+        type(term)(_order_terms(term.args, type(term), selectivity))
+        if isinstance(term, (AndList, OrList)) else term
+        for term in terms
+    ]
+
+    def get_rank(term):
+        if boolean_type is AndList:
+            decisive_fraction = 1.0 - selectivity(term)
+        else:
+            decisive_fraction = selectivity(term)
+        return _estimate_cost(term) / max(decisive_fraction, 1e-6)
+
+    # sorting is stable, so terms whose estimates tie keep their order
+    return sorted(terms, key=get_rank)
+
+def _estimate_cost(condition):
+    """Return the relative cost of evaluating a condition in awk, at most that of evaluating all of
+    its terms."""
+
+    if isinstance(condition, (AndList, OrList)):
+        return sum(_estimate_cost(arg) for arg in condition.args)
+
+    operands = (condition.left_operand, condition.right_operand)
+    cost = COMPARISON_COST + FIELD_COST * sum(isinstance(o, ColumnName) for o in operands)
+    if condition.operator == 'like':
+        cost += PATTERN_MATCH_COST
+    elif any(isinstance(o, basestring) and not isinstance(o, ColumnName) for o in operands):
+        cost += STRING_COMPARISON_COST
+    return cost
+
+def _read_sample_rows(table):
+    """Return the rows at the start of the table's file split into fields, or None if the table
+    isn't read from a file or its commands have already changed its columns."""
+
+    if table.offset is None or table.name == '-' or table.cmds or not os.path.isfile(table.name):
+        return None
+
+    with open_input(table.name) as f:
+        lines = itertools.islice(f, table.offset, table.offset + SELECTIVITY_SAMPLE_ROWS)
+        return [line.rstrip('\r\n').split(table.delimiter) for line in lines]
+
+def _sample_selectivity(condition, table, sample_rows):
+    """Return the estimated fraction of rows that satisfy the condition from the fraction of the
+    sample rows that do, smoothed toward a half so that a condition is never certain."""
+
+    column_idxs = table.column_idxs
+    field_idxs = dict(
+        (column_name, column_idxs[table.get_column_for_name(column_name)][0])
+        for column_name in condition.column_names
+    )
+    matches = sum(1 for row in sample_rows if _evaluate_condition(condition, field_idxs, row))
+    return (matches + 0.5) / (len(sample_rows) + 1)
+
+def _evaluate_condition(condition, field_idxs, row):
+    """Return true if a row satisfies the condition, given the index of the field of each column
+    it names, comparing values like awk: as numbers if both look like numbers, and as strings
+    otherwise. LIKE patterns are always matched against strings."""
+
+    if isinstance(condition, AndList):
+        return all(_evaluate_condition(arg, field_idxs, row) for arg in condition.args)
+    elif isinstance(condition, OrList):
+        return any(_evaluate_condition(arg, field_idxs, row) for arg in condition.args)
+
+    strings = []
+    numbers = []
+    for operand in (condition.left_operand, condition.right_operand):
+        if isinstance(operand, ColumnName):
+            idx = field_idxs[operand]
+            strings.append(row[idx] if idx < len(row) else '')
+            numbers.append(_to_number(strings[-1]))
+        else:
+            # a quoted string constant compares as a string even if it looks like a number
+            strings.append(_literal_value(operand))
+            numbers.append(None if isinstance(operand, basestring) else float(operand))
+
+    compare = COMPARISON_FUNCTIONS[condition.operator]
+    if None in numbers or condition.operator == 'like':
+        return compare(strings[0], strings[1])
+    return compare(numbers[0], numbers[1])
+
+def _to_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _literal_value(operand):
+    """Return a literal operand as it would appear in a data file."""
+
+    if isinstance(operand, float) and operand.is_integer():
+        return str(int(operand))
+    operand = str(operand)
+    if len(operand) > 1 and operand[0] == operand[-1] and operand[0] in '\'"':
+        return operand[1:-1]
+    return operand
+
+def enumerate_join_orders(graph, edges, estimates, hash_join_threshold=0):
+    """Return a dictionary of join ordinals keyed by node for the left-deep join order with the
+    lowest estimated cost, found by dynamic programming over connected subsets of the graph.
+
+    A plan whose output is already sorted on the next join's key saves that join a sort, so the
+    cheapest plan is kept for each set of joined nodes and each sort order of their output.
+    Relations no larger than the hash join threshold are hash joined without sorting either input."""
+
+    nodes = sorted(graph.keys(), key=lambda n: graph[n]['idx'])
+
+    # best plans keyed by the frozenset of nodes they join and the columns their output is sorted by
+    best = {}
+    for node in nodes:
+        _keep_cheaper_plan(best, frozenset([node]), _relation_plan(node, estimates))
+
+    for size in range(2, len(nodes) + 1):
+        smaller_plans = [(key[0], p) for key, p in best.items() if len(key[0]) == size - 1]
+        for subset, left_plan in smaller_plans:
+            candidates = [n for n in nodes if n not in subset and graph[n]['neighbors'] & subset]
+
+            # only join disconnected relations if no connected relation remains
+            if not candidates:
+                candidates = [n for n in nodes if n not in subset]
+
+            for node in candidates:
+                joined = _join_plan(left_plan, node, edges, estimates, hash_join_threshold)
+                _keep_cheaper_plan(best, subset | frozenset([node]), joined)
+
+    all_nodes = frozenset(nodes)
+    complete_plans = [p for key, p in best.items() if key[0] == all_nodes]
+    best_order = min(complete_plans, key=lambda p: (p['cost'], p['order']))['order']
+    return dict((node, ordinal) for ordinal, node in enumerate(best_order))
+
+def estimate_join_rows(join_order, edges, estimates):
+    """Return the estimated number of rows output by each join of a left-deep join of the nodes
+    in the given order."""
+
+    joined_plan = _relation_plan(join_order[0], estimates)
+    join_rows = []
+    for node in join_order[1:]:
+        joined_plan = _join_plan(joined_plan, node, edges, estimates)
+        join_rows.append(joined_plan['rows'])
+    return join_rows
+
+def _relation_plan(node, estimates):
+    """Return the plan that reads a single relation."""
+    return {
+        'cost': 0.0,
+        'order': [node],
+        'rows': estimates[node]['rows'],
+        'width': estimates[node]['width'],
+        'sorted_by': estimates[node].get('sorted_by', ()),
+    }
+
+def _keep_cheaper_plan(best, subset, plan):
+    """Store the plan for the given set of nodes unless a cheaper plan with the same output order
+    is already stored."""
+
+    key = (subset, frozenset(plan['sorted_by']))
+    if key not in best or (plan['cost'], plan['order']) < (best[key]['cost'], best[key]['order']):
+        best[key] = plan
+
+def _join_plan(left_plan, right_node, edges, estimates, hash_join_threshold=0):
+    """Return the plan that joins a relation onto the result of the given plan."""
+
+    right = estimates[right_node]
+    rows = left_plan['rows'] * right['rows']
+    join_columns = []
+    for left_node, edge_right_node, condition in edges:
+        if right_node == edge_right_node and left_node in left_plan['order']:
+            other_node, other_column = left_node, condition.left_operand
+            right_column = condition.right_operand
+        elif right_node == left_node and edge_right_node in left_plan['order']:
+            other_node, other_column = edge_right_node, condition.right_operand
+            right_column = condition.left_operand
+        else:
+            continue
+        rows /= max(
+            _estimate_distinct(estimates[other_node], other_column, left_plan['rows']),
+            _estimate_distinct(right, right_column, right['rows']),
+        )
+
+        join_columns.append((other_column, right_column))
+
+    rows = max(rows, 1.0)
+    width = left_plan['width'] + right['width']
+
+    left_bytes = left_plan['rows'] * left_plan['width']
+    right_bytes = right['rows'] * right['width']
+    joined_bytes = left_bytes + right_bytes + rows * width
+
+    # join output is sorted by its key, so inputs already sorted by it needn't be sorted again
+    sorted_bytes = left_bytes + right_bytes
+    sorted_by = ()
+    if join_columns:
+        other_column, right_column = join_columns[0]
+        sorted_by = (other_column, right_column)
+
+        # inputs joined on several columns are always sorted by a key combining those columns
+        single_key = len(join_columns) == 1
+        left_sorted = single_key and is_sorted_on(left_plan['sorted_by'], other_column)
+        right_sorted = single_key and is_sorted_on(right.get('sorted_by', ()), right_column)
+        if left_sorted:
+            sorted_bytes -= left_bytes
+            sorted_by += tuple(left_plan['sorted_by'])
+        if right_sorted:
+            sorted_bytes -= right_bytes
+
+        # a hash join sorts neither input and its output keeps the order of the left input
+        if use_hash_join(right_bytes, hash_join_threshold, left_sorted and right_sorted):
+            sorted_bytes = 0.0
+            sorted_by = tuple(left_plan['sorted_by'])
+
+    return {
+        'cost': left_plan['cost'] + sorted_bytes + joined_bytes,
+        'order': left_plan['order'] + [right_node],
+        'rows': rows,
+        'width': width,
+        'sorted_by': sorted_by,
+    }
+
+def use_hash_join(build_bytes, hash_join_threshold, inputs_sorted=False):
+    """Return true if a join should load its right input, of the given estimated size, into
+    memory and stream its left input past it instead of merging sorted inputs."""
+    if inputs_sorted or build_bytes is None:
+        return False
+    return build_bytes <= hash_join_threshold
+
+def use_partitioned_join(left_bytes, right_bytes, partitioned_join_threshold, inputs_sorted=False):
+    """Return true if a join's inputs, of the given estimated sizes, are large enough to be split
+    into buckets by the hash of their join key and joined bucket by bucket. A size of None is
+    unknown, as for an intermediate join result, and rules the partitioned join out."""
+    if inputs_sorted or not partitioned_join_threshold:
+        return False
+    return all(size is not None and size >= partitioned_join_threshold
+        for size in (left_bytes, right_bytes))
+
+def is_sorted_on(sorted_by, column_name):
+    """Given the ColumnNames of the (equal-valued) columns that rows are sorted by, return true if
+    the rows are also sorted by the named column."""
+    return any(column_name >= c or c >= column_name for c in sorted_by)
+
+def _estimate_distinct(estimate, column_name, max_rows):
+    """Return the estimated number of distinct values in the named column of a relation, capped
+    at the given number of rows."""
+    distinct = estimate['distinct'].get(column_name.name, max_rows)
+    return max(min(distinct, max_rows), 1.0)
+
+def prioritize_nodes(graph, estimates):
+    """Assign high priority to nodes with small estimated sizes."""
     priorities = {}
     for node in graph.keys():
-        priorities[node] = 1
+        priorities[node] = -(estimates[node]['rows'] * estimates[node]['width'])
     return priorities
 
 def traverse(graph, priorities):
@@ -5,7 +5,7 @@ from ordered_set import OrderedSet
 from column import ColumnName, AmbiguousColumnNameError, UnknownColumnNameError
 from table import Table
 from joins import join_tables
-from plan import plan
+from plan import plan, estimate_relations, estimate_join_rows, estimate_selectivity, get_join_edges
 from expression import get_cnf_conditions
 
 import logging
@@ -37,6 +37,23 @@ def stage_columns(tables, column_names):
 
     return staged_columns
 
+def stage_projections(tables, column_names):
+    """Given a list of tables and a list of ColumnNames, return a list of lists of ColumnNames
+    with each list holding the aliases of the columns on the table at that index that match at
+    least one of the given ColumnNames, in the table's column order.
+
+    Unlike stage_columns, a ColumnName that matches columns on more than one table is kept on all of
+    them, since those columns may be merged by a join before the ColumnName is resolved.
+    """
+
+    return [
+        [
+            column.alias for column in table.columns
+            if any(column_name.match(*column.names) for column_name in column_names)
+        ]
+        for table in tables
+    ]
+
 def stage_conditions(tables, conditions):
     """Given a list of tables and a list of conditions, return a list of conditions with each at
     the index of the first table (from left to right) that it can be applied to.
@@ -72,7 +89,7 @@ def classify_conditions(conditions):
     join_conditions = []
     where_conditions = []
 
-    cnf_conditions = get_cnf_conditions(stringify_conditions(conditions))
+    cnf_conditions = get_cnf_conditions(conditions)
     for condition in cnf_conditions:
         if condition.can_join:
             join_conditions.append(condition)
@@ -81,28 +98,13 @@ def classify_conditions(conditions):
 
     return join_conditions, where_conditions
 
-def stringify_conditions(conditions):
-    """Given a list of condition dictionaries with 'left_operand', 'operand', and 'right_operand'
-    keys, return a list of strings expressing equivalent conditions in valid Python."""
-
-    stringified = []
-    for cond in conditions:
-        if isinstance(cond, basestring):
-            stringified.append(cond)
-        else:
-            try:
-                operator = '==' if cond['operator'] == '=' else cond['operator']
-                stringified.append(' '.join([str(cond['left_operand']), operator, str(cond['right_operand'])]))
-            except TypeError:
-                stringified.extend(['(' + stringify_conditions(cond) + ')'])
-
-    return ' '.join(stringified)
-
 class Query(object):
     """Create Tables and perform operations on them."""
 
     def __init__(self, relations, conditions=None, columns=None,
-            sample_size=None, random_seed=None, is_top_level=True):
+            sample_size=None, random_seed=None, is_top_level=True, sort_options=None,
+            verify_sorted=False, hash_join_threshold=0, partitioned_join_threshold=0, partitions=1,
+            sorted_run_cache=None, stage_counters=None, awk='awk', use_cut=False):
 
         self.relations = relations
         self.column_names = OrderedSet([
@@ -118,6 +120,15 @@ class Query(object):
         self.sample_size = sample_size
         self.random_seed = random_seed
         self.is_top_level = is_top_level  # not a subquery
+        self.sort_options = sort_options
+        self.verify_sorted = verify_sorted
+        self.hash_join_threshold = hash_join_threshold  # 0 sort-merges all joins
+        self.partitioned_join_threshold = partitioned_join_threshold  # 0 never partitions joins
+        self.partitions = partitions
+        self.sorted_run_cache = sorted_run_cache  # a SortedRunCache to read sorted inputs from
+        self.stage_counters = stage_counters  # a StageCounters to count each command's rows with
+        self.awk = awk  # the awk command to run
+        self.use_cut = use_cut  # input rows have every column, so cut may drop their fields
 
     @staticmethod
     def replace_wildcard_column_names(column_name_list, table_list):
@@ -147,7 +158,18 @@ class Query(object):
         for relation in self.relations:
             table_path = relation['path']
             table_alias = relation['alias']
-            table = Table.from_file_path(table_path, alias=table_alias)
+            table = Table.from_file_path(
+                table_path,
+                alias=table_alias,
+                sort_options=self.sort_options,
+                sorted_by=relation.get('sorted_by'),
+                verify_sorted=self.verify_sorted,
+                partitions=self.partitions,
+                sorted_run_cache=self.sorted_run_cache,
+                stage_counters=self.stage_counters,
+                awk=self.awk,
+                use_cut=self.use_cut
+            )
             self.tables.append(table)
 
         self.column_names = self.replace_wildcard_column_names(self.column_names, self.tables)
@@ -158,20 +180,21 @@ class Query(object):
         )
         condition_columns = stage_columns(self.tables, unstaged_condition_columns)
 
-        # optimize join order
-        join_order = plan(self.tables, self.join_conditions, self.where_conditions)
+        # optimize join order, and the join method for each table
+        estimates = estimate_relations(self.tables, self.where_conditions)
+        for table in self.tables:
+            table.estimated_bytes = estimates[table.alias]['rows'] * estimates[table.alias]['width']
+            table.estimated_rows = estimates[table.alias]['rows']
+            table.estimated_input_rows = estimates[table.alias]['input_rows']
+
+        join_order = plan(self.tables, self.join_conditions, self.where_conditions,
+            self.hash_join_threshold, estimates)
         self.tables = [self.tables[idx] for idx in join_order]
 
         # determine where in the join tree to apply conditions
         where_condition_stages = stage_conditions(self.tables, self.where_conditions)
         join_condition_stages = stage_conditions(self.tables, self.join_conditions)
 
-        # use only one join condition per stage
-        for stage, conditions in enumerate(join_condition_stages):
-            if len(conditions) > 0:
-                where_condition_stages[stage].extend(conditions[1:])
-                join_condition_stages[stage] = [conditions[0]]
-
         # apply single-table where conditions to source tables
         multi_table_conditions =[ [] for i in range(len(self.where_conditions)) ]
         for table, conditions in zip(self.tables, where_condition_stages):
@@ -179,9 +202,24 @@ class Query(object):
             table.subset_rows(single_table_conditions)
             multi_table_conditions.append(list(set(conditions) - set(single_table_conditions)))
 
+        # drop columns from source tables that aren't output, joined on, or used by later conditions
+        required_column_names = list(self.column_names)
+        for condition in itertools.chain(self.join_conditions, *multi_table_conditions):
+            required_column_names.extend(condition.column_names)
+
+        projections = stage_projections(self.tables, required_column_names)
+        for table, column_names in zip(self.tables, projections):
+            table.order_columns(column_names, True)
+
         # build the join tree in which nodes are intermediate Tables resulting from joins
         if len(self.tables) > 1:
-            result = self.execute_join(self.tables, join_condition_stages, multi_table_conditions)
+            join_rows = estimate_join_rows([table.alias for table in self.tables],
+                get_join_edges(self.tables, self.join_conditions), estimates)
+            result = self.execute_join(self.tables, join_condition_stages, multi_table_conditions,
+                join_rows=join_rows,
+                hash_join_threshold=self.hash_join_threshold,
+                partitioned_join_threshold=self.partitioned_join_threshold,
+                partitions=self.partitions)
         else:
             result = self.tables[0]
 
@@ -193,7 +231,13 @@ class Query(object):
         return result
 
     @classmethod
-    def execute_join(cls, tables, join_conditions, where_conditions):
+    def execute_join(cls, tables, join_conditions, where_conditions, join_rows=None,
+            **join_options):
+        """Return a Table joining the given Tables from left to right, passing the join options
+        to join_tables.
+
+        :param join_rows: the estimated number of rows output by each join, if known
+        """
 
         if len(tables) == 2:
             joined_table = join_tables(
@@ -201,6 +245,7 @@ class Query(object):
                 tables[1],
                 'inner',
                 join_conditions[-1],
+                **join_options
             )
 
         elif len(tables) > 2:
@@ -209,18 +254,27 @@ class Query(object):
                 tables[:-1],
                 join_conditions[:-1],
                 where_conditions[:-1],
+                join_rows=join_rows[:-1] if join_rows else None,
+                **join_options
             )
 
             joined_table = join_tables(
                 left_table,
                 tables[-1],
                 'inner',
-                join_conditions[-1]
+                join_conditions[-1],
+                **join_options
             )
 
         else:
             raise Exception('Need at least two tables to join but only got {}'.format(tables))
 
+        if join_rows:
+            joined_table.estimated_input_rows = join_rows[-1]
+            joined_table.estimated_rows = join_rows[-1]
+            for condition in where_conditions[-1]:
+                joined_table.estimated_rows *= estimate_selectivity(condition)
+
         joined_table.subset_rows(where_conditions[-1])
         return joined_table
 
@@ -0,0 +1,344 @@
+"""Translate and execute queries in a long-running process that listens on a Unix socket, so that
+each query doesn't pay for starting Python and importing the parser, and a thin client that sends
+the command line of a sqltxt call to the server.
+
+The client sends the server one line of JSON with its arguments, working directory and
+environment, which the server translates and executes the command line in. Both sides then send
+frames of a one-byte channel and a four-byte length followed by that many bytes. The server sends
+frames of output on the stdout and stderr channels, a frame on the stdin channel when it wants the
+client's standard input, i.e. to read SQL or a table from it, and finally a frame on the exit
+channel holding the exit status. The client answers a request for standard input by sending all of
+it on the stdin channel, followed by an empty frame.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+STDOUT = 'o'
+STDERR = 'e'
+STDIN = 'i'
+EXIT = 'x'
+
+FRAME_HEADER = struct.Struct('!cI')
+CHUNK_SIZE = 64 * 1024
+
+def write_frame(sock_file, channel, payload=''):
+    sock_file.write(FRAME_HEADER.pack(channel, len(payload)) + payload)
+    sock_file.flush()
+
+def read_frame(sock_file):
+    """Return the channel and payload of the next frame, or (None, None) if the peer is gone."""
+
+    header = sock_file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None, None
+    channel, length = FRAME_HEADER.unpack(header)
+    payload = sock_file.read(length)
+    if len(payload) < length:
+        return None, None
+    return channel, payload
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+def request(socket_path, argv):
+    """Run a sqltxt command line on the server listening on the given socket, relaying its output
+    and, when asked for, this process's standard input. Return the command's exit status, or None
+    if no server is listening."""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        return None
+
+    # die quietly like other commands when output is piped to a command that stops reading it
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+    sock_file = sock.makefile('rwb', 0)
+    write_frame_lock = threading.Lock()
+
+    def send_stdin():
+        while True:
+            data = os.read(sys.stdin.fileno(), CHUNK_SIZE)
+            with write_frame_lock:
+                write_frame(sock_file, STDIN, data)
+            if not data:
+                break
+
+    sock_file.write(json.dumps({
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+    }) + '\n')
+
+    stdin_thread = None
+    outputs = {STDOUT: sys.stdout, STDERR: sys.stderr}
+    while True:
+        channel, payload = read_frame(sock_file)
+        if channel in outputs:
+            outputs[channel].write(payload)
+            outputs[channel].flush()
+        elif channel == STDIN and stdin_thread is None:
+            stdin_thread = threading.Thread(target=send_stdin)
+            stdin_thread.daemon = True  # don't wait for input the query never reads
+            stdin_thread.start()
+        elif channel == EXIT:
+            return int(payload)
+        elif channel is None:
+            sys.stderr.write('Lost connection to the sqltxt server at {0}\n'.format(socket_path))
+            return 1
+
+
+class ChannelFile(object):
+    """A writable file whose contents are sent to the client on one channel."""
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def write(self, data):
+        if data:
+            self.connection.write_frame(self.channel, data)
+
+    def flush(self):
+        pass
+
+
+class RemoteStdin(object):
+    """The standard input of a client, read from frames sent once it's asked for."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_requested = False
+        self.is_exhausted = False
+        self._buffer = ''
+
+    def iter_chunks(self):
+        if self._buffer:
+            chunk, self._buffer = self._buffer, ''
+            yield chunk
+        if self.is_exhausted:
+            return
+        if not self.is_requested:
+            self.connection.write_frame(STDIN)
+            self.is_requested = True
+
+        while True:
+            channel, payload = read_frame(self.connection.rfile)
+            if not payload:
+                self.is_exhausted = True
+                return
+            if channel == STDIN:
+                yield payload
+
+    def read(self):
+        return ''.join(self.iter_chunks())
+
+    def readline(self):
+        """Return the first line of the remaining input, leaving the rest for later reads."""
+
+        chunks = []
+        for chunk in self.iter_chunks():
+            line_end = chunk.find('\n') + 1
+            if line_end:
+                chunks.append(chunk[:line_end])
+                self._buffer = chunk[line_end:]
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+
+class ClientConnection(object):
+    """A client's connection, whose frames may be written from several threads."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._write_lock = threading.Lock()
+
+    def write_frame(self, channel, payload=''):
+        with self._write_lock:
+            write_frame(self.wfile, channel, payload)
+
+
+class QueryServer(object):
+    """Serve sqltxt command lines on a Unix socket, running them with a function like
+    __main__.run."""
+
+    def __init__(self, socket_path, run):
+        # absolute, since handling a request changes the working directory while it translates
+        self.socket_path = os.path.abspath(socket_path)
+        self.run = run
+
+        # translation reads input files relative to the client's working directory, which is
+        # process-wide state, so queries are translated one at a time; execution is concurrent
+        self.translation_lock = threading.Lock()
+
+    def serve_forever(self):
+        import SocketServer
+
+        server = self
+
+        class RequestHandler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                server.handle(ClientConnection(self.rfile, self.wfile))
+
+            def finish(self):
+                try:
+                    SocketServer.StreamRequestHandler.finish(self)
+                except socket.error:
+                    pass  # the client is gone
+
+        class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        if is_socket(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error:
+                os.remove(self.socket_path)  # left behind by a server that didn't shut down cleanly
+            else:
+                raise ValueError('A server is already listening on {0}'.format(self.socket_path))
+            finally:
+                probe.close()
+
+        unix_server = UnixServer(self.socket_path, RequestHandler)
+        LOG.debug('Serving queries on {0}'.format(self.socket_path))
+
+        # remove the socket when stopped by kill as well as by an interrupt
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            unix_server.serve_forever()
+        finally:
+            unix_server.server_close()
+            os.remove(self.socket_path)
+
+    def handle(self, connection):
+        try:
+            request = json.loads(connection.rfile.readline())
+            request['argv'], request['cwd'], request['env']
+        except (ValueError, KeyError, TypeError) as e:
+            LOG.debug('Malformed request: {0}'.format(e))
+            try:
+                connection.write_frame(EXIT, '1')
+            except (IOError, socket.error):
+                pass
+            return
+
+        stdin = RemoteStdin(connection)
+        stdout = ChannelFile(connection, STDOUT)
+        stderr = ChannelFile(connection, STDERR)
+
+        cmds = []
+        status = 0
+        with self.translation_lock:
+            # a table read from standard input reads its header from sys.stdin
+            server_stdin, sys.stdin = sys.stdin, stdin
+
+            # the client's environment decides e.g. the cache directory, and the awk and
+            # decompressors found on the PATH
+            server_environ = dict(os.environ)
+            os.environ.clear()
+            os.environ.update(request['env'])
+            server_cwd = os.getcwd()
+            try:
+                os.chdir(request['cwd'])
+                self.run(request['argv'], stdin, stdout, stderr,
+                    execute_cmd=lambda cmd, reads_stdin: cmds.append((cmd, reads_stdin)),
+                    start_time=time.time())
+            except SystemExit as e:
+                # docopt exits with a usage message on bad arguments
+                if e.code is not None and not isinstance(e.code, int):
+                    stderr.write('{0}\n'.format(e.code))
+                    status = 1
+                else:
+                    status = e.code or 0
+            except Exception as e:
+                LOG.exception('Failed to translate {0}'.format(request['argv']))
+                stderr.write('{0}: {1}\n'.format(type(e).__name__, e))
+                status = 1
+            finally:
+                sys.stdin = server_stdin
+                os.environ.clear()
+                os.environ.update(server_environ)
+                os.chdir(server_cwd)
+
+        for cmd, reads_stdin in cmds:
+            status = self.execute(cmd, request, stdin if reads_stdin else None, stdout, stderr)
+
+        try:
+            connection.write_frame(EXIT, str(status))
+        except (IOError, socket.error):
+            pass
+
+    def execute(self, cmd, request, stdin, stdout, stderr):
+        """Run a command in the client's working directory and environment, relaying its output
+        and, unless stdin is None, its input, and return its exit status."""
+
+        import subprocess
+
+        with open(os.devnull) as devnull:
+            proc = subprocess.Popen(
+                ['/bin/bash', '-c', cmd],
+                cwd=request['cwd'],
+                env=request['env'],
+                stdin=subprocess.PIPE if stdin is not None else devnull,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                preexec_fn=os.setsid  # in its own process group, to stop the whole pipeline at once
+            )
+
+        def relay_input():
+            try:
+                for chunk in stdin.iter_chunks():
+                    proc.stdin.write(chunk)
+            except IOError:
+                pass  # the command exited without reading all of its input
+            finally:
+                try:
+                    proc.stdin.close()
+                except IOError:
+                    pass
+
+        def relay_output(proc_file, channel_file):
+            try:
+                for chunk in iter(lambda: os.read(proc_file.fileno(), CHUNK_SIZE), ''):
+                    channel_file.write(chunk)
+            except (IOError, socket.error):
+                # the client is gone, e.g. its output was piped to head
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+        threads = [
+            threading.Thread(target=relay_output, args=(proc.stdout, stdout)),
+            threading.Thread(target=relay_output, args=(proc.stderr, stderr)),
+        ]
+        if stdin is not None:
+            input_thread = threading.Thread(target=relay_input)
+            input_thread.daemon = True  # the client may never send input the command doesn't read
+            input_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # a pipeline stopped by a signal exits with 128 plus its number, as bash reports it
+        status = proc.wait()
+        return 128 - status if status < 0 else status
@@ -30,9 +30,9 @@ from pyparsing import (
 # keywords
 (UNION, ALL, AND, INTERSECT, EXCEPT, COLLATE, ASC, DESC, ON, USING, NATURAL, INNER, 
  CROSS, RIGHT, LEFT, OUTER, JOIN, AS, INDEXED, NOT, SELECT, DISTINCT, FROM, WHERE, GROUP, BY,
- HAVING, ORDER, BY, LIMIT, OFFSET, TABLESAMPLE) =  map(CaselessKeyword, """UNION, ALL, AND, INTERSECT, 
+ HAVING, ORDER, BY, LIMIT, OFFSET, TABLESAMPLE, SORTED) =  map(CaselessKeyword, """UNION, ALL, AND, INTERSECT, 
  EXCEPT, COLLATE, ASC, DESC, ON, USING, NATURAL, INNER, CROSS, RIGHT, LEFT, OUTER, JOIN, AS, INDEXED, NOT, SELECT, 
- DISTINCT, FROM, WHERE, GROUP, BY, HAVING, ORDER, BY, LIMIT, OFFSET, TABLESAMPLE""".replace(",","").split())
+ DISTINCT, FROM, WHERE, GROUP, BY, HAVING, ORDER, BY, LIMIT, OFFSET, TABLESAMPLE, SORTED""".replace(",","").split())
 (CAST, ISNULL, NOTNULL, NULL, IS, BETWEEN, ELSE, END, CASE, WHEN, THEN, EXISTS,
  COLLATE, IN, LIKE, GLOB, REGEXP, MATCH, ESCAPE, CURRENT_TIME, CURRENT_DATE, 
  CURRENT_TIMESTAMP) = map(CaselessKeyword, """CAST, ISNULL, NOTNULL, NULL, IS, BETWEEN, ELSE, 
@@ -42,7 +42,7 @@ keyword = MatchFirst((UNION, ALL, INTERSECT, EXCEPT, COLLATE, ASC, DESC, ON, USI
  CROSS, RIGHT, LEFT, OUTER, JOIN, AS, INDEXED, NOT, SELECT, DISTINCT, FROM, WHERE, GROUP, BY,
  HAVING, ORDER, BY, LIMIT, OFFSET, CAST, ISNULL, NOTNULL, NULL, IS, BETWEEN, ELSE, END, CASE, WHEN, THEN, EXISTS,
  COLLATE, IN, LIKE, GLOB, REGEXP, MATCH, ESCAPE, CURRENT_TIME, CURRENT_DATE, 
- CURRENT_TIMESTAMP, TABLESAMPLE))
+ CURRENT_TIMESTAMP, TABLESAMPLE, SORTED))
 
 select_tok = Keyword('select', caseless=True)
 from_tok = Keyword('from', caseless=True) 
@@ -50,11 +50,15 @@ from_tok = Keyword('from', caseless=True)
 # for parsing select-from statements
 idr = ~keyword + Word(alphas + '*', alphanums + '_/-.*').setName('identifier')
 
+column_idr = delimitedList(idr, '.', combine=True)
+
+# a hint declaring the columns that a table's rows are already sorted by
+sort_hint = Suppress(SORTED + BY) + Suppress("(") + \
+    Group(delimitedList(column_idr)).setResultsName('sorted_by') + Suppress(")")
+
 table_path = Word(''.join([c for c in printables if c not in "?"])).setResultsName('path')
 table_alias = idr.setResultsName('alias')
-table_idr = table_path + Optional(Optional(Suppress('as')) + table_alias)
-
-column_idr = delimitedList(idr, '.', combine=True)
+table_idr = table_path + Optional(Optional(Suppress('as')) + table_alias) + Optional(sort_hint)
 aggregate_function = Combine(Keyword('count') + '(' + column_idr + ')')
 column_list = Group(delimitedList((column_idr ^ aggregate_function.setResultsName('aggregate_functions', listAllMatches=True))))
 
@@ -86,6 +90,10 @@ where_cond = Group(
     binary_op.setResultsName('operator') + 
     column_val.setResultsName('right_operand') 
     ) |
+  ( column_idr.setResultsName('left_operand') + 
+    LIKE.setResultsName('operator') + 
+    quotedString.setResultsName('right_operand') 
+    ) |
   ( column_idr.setResultsName('left_operand') + 
     in_ + 
     Suppress("(") + delimitedList( column_val ).setResultsName('right_operand') + Suppress(")") 
@@ -99,7 +107,9 @@ where_cond = Group(
 
 group_by_expr = Group(column_idr + ZeroOrMore( "," + column_idr ))
 
-where_expr << where_cond + ZeroOrMore( (and_ | or_) + where_expr )
+# iterative rather than recursive, so that long conditions don't exhaust the stack; the tokens are
+# the same flat list either way
+where_expr << where_cond + ZeroOrMore( (and_ | or_) + where_cond )
 
 on_ = Keyword('on', caseless=True)
 join = ((oneOf('left right') + 'join' ) | (Optional('inner') + 'join')
@@ -127,7 +137,8 @@ select_stmt << (
 def _normalize_relation(relation_clause):
     return {
         'path': relation_clause['path'],
-        'alias': relation_clause.get('alias', [False])[0] or relation_clause['path']
+        'alias': relation_clause.get('alias', [False])[0] or relation_clause['path'],
+        'sorted_by': list(relation_clause.get('sorted_by', [])),
     }
 
 def _normalize_condition(condition_clause):
@@ -184,7 +195,8 @@ def get_relations_and_conditions(parsed_sql):
         subclause['join_conditions'] for subclause in parsed_sql.from_clause
         if 'join_conditions' in subclause
     ]
-    conditions.extend(parsed_sql.where_clause)
+    if parsed_sql.where_clause:
+        conditions.append(list(parsed_sql.where_clause))
     conjunctions = ['and'] * len(conditions)
     conditions = [ part for parts in zip(conditions, conjunctions) for part in parts ][:-1]
 
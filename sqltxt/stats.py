@@ -0,0 +1,276 @@
+"""Collect per-file statistics in a single scan, store them in a sidecar file next to the data, and
+use them to estimate the selectivity of conditions."""
+
+import bisect
+import heapq
+import json
+import logging
+import os
+import random
+import zlib
+
+from compression import open_input
+
+LOG = logging.getLogger(__name__)
+
+STATS_FILE_SUFFIX = '.stats.json'
+
+# number of smallest value hashes kept to estimate a column's distinct-value count
+DISTINCT_SKETCH_SIZE = 1024
+
+# number of values tracked per column to find its most common values
+MOST_COMMON_VALUES_CANDIDATES = 100
+MOST_COMMON_VALUES_COUNT = 10
+
+# number of numeric values sampled per column to build its equi-depth histogram
+HISTOGRAM_SAMPLE_SIZE = 1000
+HISTOGRAM_BUCKETS = 10
+
+HASH_SPACE = float(2 ** 32)
+
+def get_stats_path(file_path):
+    """Return the path of the sidecar statistics file for the given data file."""
+    return file_path + STATS_FILE_SUFFIX
+
+def analyze(file_path, delimiter=','):
+    """Scan the given file once and return a dictionary of statistics describing it."""
+
+    file_stat = os.stat(file_path)
+    with open_input(file_path) as f:
+        header = f.readline().rstrip('\r\n')
+        collectors = [ColumnStatsCollector(name) for name in header.split(delimiter)]
+
+        row_count = 0
+        row_bytes = 0
+        for line in f:
+            row_count += 1
+            row_bytes += len(line)
+            values = line.rstrip('\r\n').split(delimiter)
+            for collector, value in zip(collectors, values):
+                collector.add(value)
+            for collector in collectors[len(values):]:
+                collector.add('')
+
+    return {
+        'path': os.path.abspath(file_path),
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime,
+        'delimiter': delimiter,
+        'row_count': row_count,
+        'average_row_width': float(row_bytes) / row_count if row_count else 0.0,
+        'columns': [collector.get_stats(row_count) for collector in collectors],
+    }
+
+def write_stats(file_path, stats):
+    """Write statistics to the sidecar file of the given data file and return its path. The file is
+    replaced whole, so that queries planned meanwhile never read part of it."""
+
+    stats_path = get_stats_path(file_path)
+    tmp_path = '{0}.{1}.tmp'.format(stats_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, stats_path)
+    return stats_path
+
+def load_stats(file_path):
+    """Return the statistics in the sidecar file of the given data file, or None if there is no
+    readable sidecar file or the data file has changed since it was written."""
+
+    stats_path = get_stats_path(file_path)
+    if not os.path.isfile(stats_path):
+        return None
+
+    try:
+        with open(stats_path) as f:
+            stats = json.load(f)
+        file_stat = os.stat(file_path)
+        is_stale = stats['path'] != os.path.abspath(file_path) or \
+            stats['size'] != file_stat.st_size or stats['mtime'] != file_stat.st_mtime
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        LOG.debug('Ignoring unreadable statistics in {0}: {1}'.format(stats_path, e))
+        return None
+
+    if is_stale:
+        LOG.debug('Ignoring stale statistics in {0}'.format(stats_path))
+        return None
+
+    return stats
+
+def get_column_stats(stats, column_name):
+    """Return the statistics of the named column, or None if it isn't described."""
+
+    for column_stats in stats['columns']:
+        if column_stats['name'].lower() == column_name.lower():
+            return column_stats
+    return None
+
+def equality_selectivity(column_stats, row_count, value):
+    """Return the estimated fraction of rows in which the column is equal to the given value."""
+
+    if row_count == 0:
+        return 0.0
+    if value == '':
+        return float(column_stats['nulls']) / row_count
+
+    most_common_values = dict(column_stats['most_common_values'])
+    if value in most_common_values:
+        return float(most_common_values[value]) / row_count
+
+    # spread the rows that aren't null or a most common value evenly over the remaining values
+    uncommon_rows = row_count - column_stats['nulls'] - sum(most_common_values.values())
+    uncommon_distinct = column_stats['distinct'] - len(most_common_values)
+    return max(float(uncommon_rows) / row_count, 0.0) / max(uncommon_distinct, 1)
+
+def range_selectivity(column_stats, operator, value):
+    """Return the estimated fraction of rows in which the column compares to the given value with
+    the given operator ('<', '<=', '>', or '>='), or None if the column isn't numeric."""
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    bounds = column_stats.get('histogram')
+    if not bounds:
+        return None
+
+    fraction_below = _histogram_fraction_below(bounds, value)
+    non_null_fraction = 1.0 - column_stats['null_fraction']
+    if operator in ('<', '<='):
+        return non_null_fraction * fraction_below
+    return non_null_fraction * (1.0 - fraction_below)
+
+def _histogram_fraction_below(bounds, value):
+    """Given the bucket bounds of an equi-depth histogram, return the fraction of values below the
+    given value, interpolating linearly within its bucket."""
+
+    if value <= bounds[0]:
+        return 0.0
+    if value >= bounds[-1]:
+        return 1.0
+
+    n_buckets = len(bounds) - 1
+    bucket = bisect.bisect_right(bounds, value) - 1
+    low, high = bounds[bucket], bounds[bucket + 1]
+    within = (value - low) / (high - low) if high > low else 1.0
+    return (bucket + within) / n_buckets
+
+
+class ColumnStatsCollector(object):
+    """Accumulate the statistics of one column's values in bounded memory."""
+
+    def __init__(self, name):
+        self.name = name
+        self.nulls = 0
+        self.min_value = None
+        self.max_value = None
+        self.min_number = None
+        self.max_number = None
+        self.is_numeric = True
+        self.numeric_seen = 0
+
+        # k-minimum-values sketch: the smallest distinct hashes seen, as a max-heap
+        self._hash_heap = []
+        self._hashes = set()
+
+        # Misra-Gries summary of frequent values
+        self._candidate_counts = {}
+
+        # reservoir sample of numeric values
+        self._numeric_sample = []
+        self._random = random.Random(0)
+
+    def add(self, value):
+        if value == '':
+            self.nulls += 1
+            return
+
+        self._add_to_sketch(value)
+        self._add_to_candidates(value)
+
+        if self.is_numeric:
+            try:
+                number = float(value)
+            except ValueError:
+                self.is_numeric = False
+            else:
+                self._add_to_sample(number)
+                if self.min_number is None or number < self.min_number:
+                    self.min_number = number
+                if self.max_number is None or number > self.max_number:
+                    self.max_number = number
+
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def _add_to_sketch(self, value):
+        value_hash = zlib.crc32(value) & 0xffffffff
+        if value_hash in self._hashes:
+            return
+        if len(self._hash_heap) < DISTINCT_SKETCH_SIZE:
+            heapq.heappush(self._hash_heap, -value_hash)
+            self._hashes.add(value_hash)
+        elif value_hash < -self._hash_heap[0]:
+            evicted = -heapq.heapreplace(self._hash_heap, -value_hash)
+            self._hashes.discard(evicted)
+            self._hashes.add(value_hash)
+
+    def _add_to_candidates(self, value):
+        if value in self._candidate_counts:
+            self._candidate_counts[value] += 1
+        elif len(self._candidate_counts) < MOST_COMMON_VALUES_CANDIDATES:
+            self._candidate_counts[value] = 1
+        else:
+            for candidate in self._candidate_counts.keys():
+                self._candidate_counts[candidate] -= 1
+                if self._candidate_counts[candidate] == 0:
+                    del self._candidate_counts[candidate]
+
+    def _add_to_sample(self, number):
+        self.numeric_seen += 1
+        if len(self._numeric_sample) < HISTOGRAM_SAMPLE_SIZE:
+            self._numeric_sample.append(number)
+        else:
+            idx = self._random.randint(0, self.numeric_seen - 1)
+            if idx < HISTOGRAM_SAMPLE_SIZE:
+                self._numeric_sample[idx] = number
+
+    def estimate_distinct(self):
+        """Return the estimated number of distinct non-null values in the column."""
+
+        if len(self._hash_heap) < DISTINCT_SKETCH_SIZE:
+            return len(self._hash_heap)
+        kth_smallest_hash = -self._hash_heap[0]
+        return int((DISTINCT_SKETCH_SIZE - 1) / ((kth_smallest_hash + 1) / HASH_SPACE))
+
+    def get_histogram(self):
+        """Return the bucket bounds of an equi-depth histogram of the column's values, or None if
+        the column isn't numeric."""
+
+        if not self.is_numeric or not self._numeric_sample:
+            return None
+
+        sample = sorted(self._numeric_sample)
+        last = len(sample) - 1
+        return [
+            sample[int(round(float(bucket) * last / HISTOGRAM_BUCKETS))]
+            for bucket in range(HISTOGRAM_BUCKETS + 1)
+        ]
+
+    def get_stats(self, row_count):
+        most_common_values = sorted(
+            self._candidate_counts.items(), key=lambda item: (-item[1], item[0])
+        )[:MOST_COMMON_VALUES_COUNT]
+
+        return {
+            'name': self.name,
+            'distinct': max(self.estimate_distinct(), len(most_common_values)),
+            'nulls': self.nulls,
+            'null_fraction': float(self.nulls) / row_count if row_count else 0.0,
+            'min': self.min_number if self.is_numeric else self.min_value,
+            'max': self.max_number if self.is_numeric else self.max_value,
+            'most_common_values': [list(item) for item in most_common_values],
+            'histogram': self.get_histogram(),
+        }
@@ -1,12 +1,18 @@
 import sys
+import os
 import itertools
 import logging
 import re
 import copy
 import collections
 
-from column import Column, ColumnName, AmbiguousColumnNameError
-from expression import BooleanExpression
+from column import Column, ColumnName, AmbiguousColumnNameError, UnknownColumnNameError
+from expression import (BooleanExpression, Expression, OrList, format_condition,
+    like_pattern_to_regex, get_like_pattern_literals)
+from stats import load_stats
+from plan import order_conditions
+from compression import open_input, get_decompress_cmd
+from util import parse_size, cpu_count, physical_memory, shell_quote, sort_supports
 
 def dedupe_with_order(dupes):
     """Given a list, return it without duplicates and order preserved."""
@@ -19,6 +25,110 @@ def dedupe_with_order(dupes):
             deduped.append(c)
     return deduped
 
+# waits for each of the background processes in $pids, and exits with the first failing status.
+# Each process must be a single shell running a pipeline, since once a background pipeline exits
+# bash may report only its last command's status, ignoring pipefail.
+WAIT_FOR_PIDS_CMD = (
+    'status=0; for pid in $pids; do wait "$pid" || status=$?; done; '
+    '[ "$status" = 0 ] || exit "$status";')
+
+# gathers rows into writes of whole rows of at most PIPE_BUF bytes (Linux's), which a pipe never
+# interleaves with other processes' writes, so that concurrent parts can share their output
+WHOLE_ROW_WRITES_PROGRAM = (
+    '{ if (length(b) + length($0) >= 4096) { printf "%s", b; fflush(); b = "" } b = b $0 "\\n" } '
+    'END { printf "%s", b }')
+
+class SortOptions(object):
+    """Settings for the sort commands that Tables emit and the join commands that consume their
+    output. Both must collate with the same locale for join to see its inputs as sorted."""
+
+    # fraction of physical memory shared by the sort buffers of a query when chosen by default
+    DEFAULT_MEMORY_FRACTION = 0.5
+
+    def __init__(self, locale='C', parallel=None, buffer_size=None, temporary_directory=None,
+            compress_program=None):
+        """
+        :param locale: the collation locale for sort and join; 'C' compares bytes, which is
+            several times faster than most other locales
+        :param parallel: the number of threads each sort may use
+        :param buffer_size: the main memory buffer size of each sort, e.g. '512M' or '10%'
+        :param temporary_directory: the directory in which sort writes its temporary files
+        :param compress_program: the program with which sort compresses its temporary files
+        """
+
+        self.locale = locale
+        self.parallel = parallel
+        self.buffer_size = buffer_size
+        self.temporary_directory = temporary_directory
+        self.compress_program = compress_program
+
+    @classmethod
+    def from_machine(cls, concurrent_sorts=1, **kwargs):
+        """Return SortOptions with each sort's thread count and buffer size chosen from this
+        machine's cores and physical memory, shared among the given number of concurrent sorts.
+        Settings given as keyword arguments take precedence."""
+
+        concurrent_sorts = max(concurrent_sorts, 1)
+        if kwargs.get('parallel') is None:
+            kwargs['parallel'] = max(cpu_count() // concurrent_sorts, 1)
+
+        if kwargs.get('buffer_size') is None:
+            memory_bytes = physical_memory()
+            if memory_bytes:
+                kwargs['buffer_size'] = '{0}K'.format(
+                    int(memory_bytes * cls.DEFAULT_MEMORY_FRACTION / concurrent_sorts / 1024))
+
+        return cls(**kwargs)
+
+    def shared_by(self, concurrent_sorts):
+        """Return a copy of these SortOptions for each of the given number of concurrent sorts,
+        dividing the threads and buffer memory among them."""
+
+        shared = copy.copy(self)
+        if self.parallel:
+            shared.parallel = max(int(self.parallel) // concurrent_sorts, 1)
+
+        if self.buffer_size:
+            buffer_size = str(self.buffer_size)
+            if buffer_size.endswith('%'):
+                shared.buffer_size = '{0}%'.format(
+                    max(int(float(buffer_size[:-1]) / concurrent_sorts), 1))
+            else:
+                shared.buffer_size = '{0}K'.format(
+                    max(parse_size(buffer_size) // concurrent_sorts // 1024, 1))
+
+        return shared
+
+    def is_bytewise(self):
+        """Return true if sort and join compare bytes rather than collating with a locale."""
+        return self.locale in ('C', 'POSIX')
+
+    def get_env_prefix(self):
+        """Return the environment assignments to prefix sort and join commands with."""
+        return 'LC_ALL={0} '.format(shell_quote(self.locale)) if self.locale else ''
+
+    def get_sort_cmd(self, delimiter, column_idxs):
+        """Return a command that sorts delimited rows by the columns at the given indices. Options
+        the local sort doesn't support are left out."""
+
+        args = ['-t{0}'.format(delimiter)]
+        if self.parallel and sort_supports('--parallel=1'):
+            args.append('--parallel={0}'.format(self.parallel))
+        if self.buffer_size and sort_supports('-S 1M'):
+            args.append('-S {0}'.format(shell_quote(str(self.buffer_size))))
+        if self.temporary_directory:
+            args.append('-T {0}'.format(shell_quote(self.temporary_directory)))
+        if self.compress_program and sort_supports('--compress-program=cat'):
+            args.append('--compress-program={0}'.format(shell_quote(self.compress_program)))
+        args.extend(self._get_key_args(column_idxs))
+
+        return '{0}sort {1}'.format(self.get_env_prefix(), ' '.join(args))
+
+    @staticmethod
+    def _get_key_args(column_idxs):
+        return ['-k {0},{0}'.format(idx + 1) for idx in column_idxs]
+
+
 class Table(object):
     """Translate abstract data-manipulation operations to commands that perform them.
 
@@ -28,24 +138,79 @@ class Table(object):
     """
 
     VALID_IDENTIFIER_REGEX = '^[a-zA-Z_][a-zA-Z0-9_.]*$'
+
+    # the smallest part of a file worth scanning in its own process
+    MIN_PARTITION_BYTES = 16 * 1024 * 1024
+
+    # a filter's awk stage is preceded by a cut of the fields it reads when its input has at
+    # least this many fields and it reads at most this fraction of them; cut drops fields much
+    # faster than awk splits records into them
+    MIN_EARLY_CUT_FIELDS = 8
+    MAX_EARLY_CUT_FIELD_RATIO = 0.25
+
+    # an awk field reference, or a string or regular expression literal that may contain text
+    # that looks like one
+    AWK_FIELD_REGEX = re.compile(r'"(?:[^"\\]|\\.)*"|/(?:[^/\\]|\\.)*/|\$(\d+)')
     LOG = logging.getLogger(__name__)
 
     def __str__(self):
         return self.name
 
     def __init__(self, 
-        name, delimiter=',', cmd=None, columns=None, offset=None, alias=None):
+        name, delimiter=',', cmd=None, columns=None, offset=None, alias=None, sort_options=None):
 
         self.name = name
         self.delimiter = delimiter
+        self.sort_options = sort_options or SortOptions()
         self.cmds = [] if cmd == None else [cmd]
+
+        # a description of the operation each command performs, for explaining the plan
+        self.stages = [] if cmd == None else [{'operation': 'command', 'detail': name}]
         self.columns = columns
         self.offset = offset
         self.alias = alias
 
         self.sorted_by = []
+        self.verify_sort_order = False  # check the declared sort order once it's relied on
+        self.sorted_run_cache = None  # a SortedRunCache to read sorted copies of the file from
+        self.sorted_run = None  # the sorted copy of the file this Table reads, if any
+        self.decompress_cmd = None  # a command writing the contents of a compressed file
+        self.estimated_bytes = None  # the planner's estimate of the size of this Table's rows
+        self.estimated_rows = None  # the planner's estimate of the number of rows it outputs
+        self.estimated_input_rows = None  # and of the rows its file or first command outputs
+        self.stage_counters = None  # a StageCounters to count the rows output by each command
+        self.partitions = 1
+        self.awk = 'awk'  # the awk command to filter, project and sample with
+
+        # rows have every column, so cut can drop fields instead of awk: cut passes a row without
+        # a delimiter through whole and leaves missing fields out, where awk prints empty ones
+        self.use_cut = False
+
+        # the number of leading commands that transform each row independently of the others, so
+        # that they can run on parts of the file separately
+        self._row_local_cmd_count = 0
         self.outfile_name = "{0}.out".format(name)
 
+        # the filter/projection awk program at the end of self.cmds, if any, kept in structured
+        # form so that the next filter or projection can be fused into it
+        self._awk_stage = None
+
+        self._scan_stage = None
+
+        self._stats = None
+        self._stats_loaded = False
+
+    @property
+    def stats(self):
+        """Statistics about the file backing this Table, loaded on first access. None if this
+        Table isn't backed by a file or its file has no up-to-date statistics."""
+
+        if not self._stats_loaded:
+            if self.offset is not None and self.name != '-':
+                self._stats = load_stats(self.name)
+            self._stats_loaded = True
+        return self._stats
+
     @property
     def column_idxs(self):
         return self._compute_column_indices()
@@ -80,18 +245,31 @@ class Table(object):
         return idxs
 
     @classmethod
-    def from_file_path(cls, file_path, columns=None, delimiter=',', alias=None):
+    def from_file_path(cls, file_path, columns=None, delimiter=',', alias=None, sort_options=None,
+            sorted_by=None, verify_sorted=False, partitions=1, sorted_run_cache=None,
+            stage_counters=None, awk='awk', use_cut=False):
         """Given the path to a file, return an instance of a Table representing that file.
         
         :param file_path: a string containing the path to the file
         :param columns: an exhaustive list of column names or Column objects on this table
         :param delimiter: the column delimiter for this table; defaults to ','
+        :param sort_options: the SortOptions for sorting this table; defaults to SortOptions()
+        :param sorted_by: names of the columns the file's rows are already sorted by, if any
+        :param verify_sorted: check the order declared by sorted_by while reading the file
+        :param partitions: the number of parts of the file to filter and project concurrently
+        :param sorted_run_cache: a SortedRunCache of sorted copies of the file to read instead of
+            sorting its rows
+        :param stage_counters: a StageCounters to count the rows output by each command with
+        :param awk: the awk command to filter, project and sample with, e.g. mawk
+        :param use_cut: every row of the file has every column, so fields may be dropped with cut
         """
 
+        decompress_cmd = None
         if file_path == '-':
             columns = columns or cls._parse_column_names(sys.stdin, delimiter)
         else:
-            with open(file_path) as f:
+            decompress_cmd = get_decompress_cmd(file_path)
+            with open_input(file_path) as f:
                 columns = columns or cls._parse_column_names(f, delimiter)
 
         alias = alias or file_path
@@ -101,16 +279,28 @@ class Table(object):
             if not isinstance(col, Column):
                 columns[idx] = Column(col, qualifiers=column_qualifiers)
 
-        return cls(file_path, delimiter, None, columns, 1, alias)
+        table = cls(file_path, delimiter, None, columns, 1, alias, sort_options)
+        table.partitions = partitions
+        table.sorted_run_cache = sorted_run_cache
+        table.stage_counters = stage_counters
+        table.awk = awk
+        table.use_cut = use_cut
+        table.decompress_cmd = decompress_cmd
+        if sorted_by:
+            table.declare_sorted_by(sorted_by, verify_sorted)
+        return table
 
     @classmethod
-    def from_cmd(cls, name, cmd, columns, delimiter=','):
+    def from_cmd(cls, name, cmd, columns, delimiter=',', sort_options=None, stage=None):
         """Given a command, instantiate a Table representing the output of that command.
         
         :param name: the name of the table
         :param cmd: a string of commands whose execution materializes this table
         :param columns: an exhaustive list of column names or Column objects on this table
         :param delimiter: the column delimiter for this table; defaults to ','
+        :param sort_options: the SortOptions for sorting this table; defaults to SortOptions()
+        :param stage: a description of the operation the command performs, with the Tables it
+            reads as its 'inputs', for explaining the plan
         """
 
         column_qualifiers = [name.lower()]
@@ -118,7 +308,10 @@ class Table(object):
             if not isinstance(col, Column):
                 columns[idx] = Column(col, qualifiers=column_qualifiers)
 
-        return cls(name, delimiter, cmd, columns)
+        table = cls(name, delimiter, cmd, columns, sort_options=sort_options)
+        if stage is not None:
+            table.stages = [stage]
+        return table
 
     @staticmethod
     def _parse_column_names(table_file, delimiter):
@@ -148,15 +341,84 @@ class Table(object):
         if not drop_other_columns:
             col_idxs += unchanged_col_idxs
 
-        reorder_cmd = "awk -F'{0}' 'OFS=\"{0}\" {{ print {1} }}'".format(
-            self.delimiter, ','.join('$' + str(idx + 1) for idx in col_idxs))
+        self.project(col_idxs)
 
-        # reorder and re-alias the Columns on this Table
-        self.columns = [copy.deepcopy(self.columns[idx]) for idx in col_idxs]
+        # re-alias the reordered Columns on this Table
         for column, alias in zip(self.columns, column_names_in_order):
             column.alias = alias
 
-        self.cmds.append(reorder_cmd)
+    def project(self, column_idxs):
+        """Keep only the columns at the given indices of this Table, in the given order."""
+
+        self._append_awk_stage(column_idxs)
+        self.columns = [copy.deepcopy(self.columns[idx]) for idx in column_idxs]
+
+        # rows are still sorted by the leading sort columns that weren't dropped
+        sorted_by = []
+        for sorted_column in self.sorted_by:
+            matched_columns = [c for c in self.columns if sorted_column.match(c)]
+            if not matched_columns:
+                break
+            sorted_by.append(matched_columns[0])
+        self.sorted_by = sorted_by
+
+    def declare_sorted_by(self, column_names, verify=False):
+        """Declare that this Table's rows are already sorted by the named columns in the collation
+        of its SortOptions, so that sorting by them is skipped.
+
+        :param column_names: a list of column names or ColumnNames on this table
+        :param verify: check the declared order as the rows stream past wherever it's relied on,
+            stopping the whole command instead of producing wrong results if they are out of
+            order. awk compares bytes, so in a collating locale the order is left undeclared and
+            the rows are sorted.
+        """
+
+        columns = []
+        for column_name in column_names:
+            if not isinstance(column_name, ColumnName):
+                column_name = ColumnName(column_name)
+            column = self.get_column_for_name(column_name)
+            if column is None:
+                raise UnknownColumnNameError(column_name)
+            columns.append(column)
+
+        if verify and not self.sort_options.is_bytewise():
+            self.LOG.debug('{0} declared sorted by {1} in locale {2}, which can\'t be checked, '
+                'so it will be sorted'.format(self.name, columns, self.sort_options.locale))
+            return
+
+        self.LOG.debug('{0} declared sorted by {1}'.format(self.name, columns))
+        self.sorted_by = columns
+        self.verify_sort_order = verify
+
+    def rely_on_sort_order(self, columns):
+        """Note that this Table's rows are used without sorting them as if sorted by the given
+        leading columns of its sort order. If the order was declared and is to be verified, append
+        a command that passes the rows through and, on the first row out of order, writes an error
+        and stops the whole command, even from within a process substitution, by terminating the
+        top-level shell. The check follows any filters, so the row it reports is counted among the
+        rows they keep."""
+
+        if not self.verify_sort_order:
+            return
+        self.verify_sort_order = False
+
+        # the key's values are separated by awk's SUBSEP, which sorts before the (printable)
+        # characters of column values, so comparing keys as strings compares them column by column
+        column_idxs = [self.column_idxs[col][0] for col in columns]
+        key = ' SUBSEP '.join('${0}'.format(idx + 1) for idx in column_idxs)
+        check_cmd = (
+            "{0} -F'{1}' -v pid=$$ '{{ k = {2} \"\"; if (NR > 1 && k < p) {{ "
+            "print \"sqltxt: row \" NR \" of the rows left after filtering is out of its declared sort "
+            "order\" | \"cat 1>&2\"; "
+            "close(\"cat 1>&2\"); system(\"kill -TERM \" pid); exit 1 }} p = k; print }}'"
+        ).format(self.awk, self.delimiter, key)
+
+        self.cmds.append(check_cmd)
+        self.stages.append({
+            'operation': 'check order',
+            'detail': 'by {0}'.format(', '.join(str(c) for c in columns)),
+        })
 
     def is_sorted_by(self, sort_order_indices):
         """Return true if this Table's rows are sorted by columns at the given indices."""
@@ -181,21 +443,49 @@ class Table(object):
 
         # if this table is already sorted by the requested sort order, do nothing
         if columns_to_sort_by == self.sorted_by[0:len(columns_to_sort_by)]:
+            self.rely_on_sort_order(columns_to_sort_by)
             return None
         self.LOG.debug('Sorting {0} by {1}'.format(self.name, columns_to_sort_by))
 
         column_idxs_to_sort_by = [self.column_idxs[col][0] for col in columns_to_sort_by]
+        if self._read_sorted_run(column_idxs_to_sort_by):
+            self.sorted_by = columns_to_sort_by
+            return
 
-        sort_key_params = ' -k '.join(
-              ','.join([str(idx + 1),str(idx + 1)]) for idx in column_idxs_to_sort_by)
-
-        sort_cmd = 'sort -t{0} -k {1}'.format(self.delimiter, sort_key_params)
+        sort_cmd = self.sort_options.get_sort_cmd(self.delimiter, column_idxs_to_sort_by)
         self.sorted_by = columns_to_sort_by
         self.cmds.append(sort_cmd)
+        self.stages.append({
+            'operation': 'sort',
+            'detail': 'by {0}'.format(', '.join(str(c) for c in columns_to_sort_by)),
+        })
     
+    def _read_sorted_run(self, column_idxs):
+        """Read this Table's rows from a copy of its file sorted by the columns at the given
+        indices, if there's a cache of sorted copies and every command on this Table so far
+        preserves the order of rows. Return true if it will."""
+
+        if self.sorted_run_cache is None or self.sorted_run is not None or self.offset is None \
+                or self.name == '-' or self._row_local_cmd_count != len(self.cmds):
+            return False
+
+        # the commands so far are at most one filter/projection, which may have moved columns
+        field_idxs = self._get_awk_input_field_idxs()
+        self.sorted_run = self.sorted_run_cache.get_run(self.name, self.delimiter,
+            [field_idxs[idx] for idx in column_idxs], self.offset, self.sort_options,
+            self.decompress_cmd)
+        if self.sorted_run is None:
+            return False
+
+        self.LOG.debug('Reading {0} from {1} sorted run {2}'.format(self.name,
+            'cached' if self.sorted_run['is_cached'] else 'new', self.sorted_run['path']))
+        return True
+
     def subset_rows(self, conditions):
-        """Subset the rows of this Table to rows that satisfy the given conditions."""
+        """Subset the rows of this Table to rows that satisfy the given conditions, evaluated in
+        the order expected to reject rows at least cost."""
 
+        conditions = order_conditions(conditions, self)
         conditions_list = [
             cond.args_with_operator() if isinstance(cond, BooleanExpression) else cond
             for cond in conditions
@@ -203,21 +493,230 @@ class Table(object):
         and_conditions_list = [
             i for pair in zip(conditions_list, ['and'] * len(conditions_list)) for i in pair
         ][:-1]
-        condition_str = self.get_awk_statement(and_conditions_list)
+        condition_str = self.get_awk_statement(
+            and_conditions_list, self._get_awk_input_field_idxs())
 
         if not condition_str:
             self.LOG.debug('Empty condition string so not subsetting columns on {0}'.format(
                 self.name))
             return
 
-        columns = ','.join(['$' + str(self.column_idxs[c][0] + 1) for c in self.columns])
-        awk_cmd = "awk -F'{0}' 'OFS=\"{0}\" {{ if ({1}) {{ print {2} }} }}'".format(
-            self.delimiter, condition_str, columns)
-        self.cmds.append(awk_cmd)
+        self._append_awk_stage(range(len(self.columns)), condition_str,
+            [format_condition(cond) for cond in conditions])
+        self._prefilter_rows(conditions)
+
+    def _prefilter_rows(self, conditions):
+        """Insert a grep ahead of the last awk stage that passes only lines containing a literal
+        string that one of the given conditions requires each satisfying row to contain. grep
+        rejects lines much faster than awk can split them into fields; awk still evaluates the
+        conditions exactly on the lines that pass."""
+
+        for condition in conditions:
+            literals = self._get_required_literals(condition)
+            if literals:
+                break
+        else:
+            return
+
+        grep_cmd = 'LC_ALL=C grep -F {0}'.format(
+            ' '.join('-e ' + shell_quote(literal) for literal in literals))
+
+        # grep exits with status 1 when it matches nothing, which isn't an error here
+        idx = self._awk_stage['cmd_idx']
+        self.cmds.insert(idx, '{{ {0} || test $? = 1; }}'.format(grep_cmd))
+        self.stages.insert(idx, {
+            'operation': 'prefilter',
+            'detail': 'lines containing {0}'.format(
+                ' or '.join('"{0}"'.format(literal) for literal in literals)),
+        })
+        self._awk_stage['cmd_idx'] += 1
+        if self._row_local_cmd_count >= idx:
+            self._row_local_cmd_count += 1
+
+    @classmethod
+    def _get_required_literals(cls, condition):
+        """Return a list of literal strings at least one of which every line holding a row that
+        satisfies the condition contains, or None if there's no such list."""
+
+        if isinstance(condition, OrList):
+            literals = []
+            for arg in condition.args:
+                arg_literals = cls._get_required_literals(arg)
+                if not arg_literals:
+                    return None
+                literals.extend(l for l in arg_literals if l not in literals)
+            return literals
+        elif not isinstance(condition, Expression):
+            return None
+
+        operands = (condition.left_operand, condition.right_operand)
+        if condition.operator not in ('==', 'like') or \
+                not isinstance(operands[0], ColumnName) or isinstance(operands[1], ColumnName):
+            return None
+
+        # only quoted strings: awk compares numbers by value, so that 10 also equals 1e1
+        value = operands[1]
+        if not (isinstance(value, basestring) and len(value) > 1 and value[0] == value[-1] == '"'):
+            return None
+        value = value[1:-1]
+
+        # leave out strings that awk would unescape
+        if '\\' in value:
+            return None
+
+        if condition.operator == 'like':
+            literals = get_like_pattern_literals(value)
+            value = max(literals, key=len) if literals else ''
+        return [value] if value else None
+
+    def _get_awk_input_field_idxs(self):
+        """Return the input field index of each column of this Table as seen by the awk stage
+        that the next filter or projection will be fused into."""
+
+        if self._is_awk_stage_fusable():
+            return self._awk_stage['field_idxs']
+        return range(len(self.columns))
+
+    def _is_awk_stage_fusable(self):
+        """Return true if the last command on this Table is a filter/projection awk stage."""
+        return self._awk_stage is not None and self._awk_stage['cmd_idx'] == len(self.cmds) - 1
+
+    def _append_awk_stage(self, column_idxs, condition_str=None, condition_descriptions=()):
+        """Append an awk stage that prints the columns at the given indices of rows satisfying
+        the given awk condition. If the last command on this Table is also such a stage, fuse the
+        two into a single awk program.
+
+        :param column_idxs: indices of the columns to print, relative to this Table's columns
+        :param condition_str: an awk condition referencing the stage's input fields, or None
+        :param condition_descriptions: the conditions as SQL, for explaining the plan
+        """
+
+        condition_descriptions = list(condition_descriptions)
+        if self._is_awk_stage_fusable():
+            previous_stage = self._awk_stage
+            self.cmds.pop()
+            self.stages.pop()
+            self._row_local_cmd_count = min(self._row_local_cmd_count, len(self.cmds))
+            field_idxs = [previous_stage['field_idxs'][idx] for idx in column_idxs]
+            n_input_fields = previous_stage['n_input_fields']
+            condition_str = ' && '.join(
+                [c for c in (previous_stage['condition'], condition_str) if c])
+            condition_descriptions = previous_stage['condition_descriptions'] + \
+                condition_descriptions
+        else:
+            field_idxs = list(column_idxs)
+            n_input_fields = len(self.columns)
+
+        self._awk_stage = None
+        is_identity = (field_idxs == range(n_input_fields))
+        if is_identity and not condition_str:
+            self.LOG.debug('Awk stage on {0} is a no-op so not adding it'.format(self.name))
+            return
+
+        self.cmds.append(self._get_awk_stage_cmd(
+            field_idxs, condition_str, n_input_fields, is_identity))
+        self.stages.append(self._describe_awk_stage(
+            condition_descriptions, None if is_identity else [self.columns[i] for i in column_idxs]))
+        if self._row_local_cmd_count == len(self.cmds) - 1:
+            self._row_local_cmd_count += 1
+        self._awk_stage = {
+            'cmd_idx': len(self.cmds) - 1,
+            'condition': condition_str,
+            'condition_descriptions': condition_descriptions,
+            'field_idxs': field_idxs,
+            'n_input_fields': n_input_fields,
+        }
+
+    def _get_awk_stage_cmd(self, field_idxs, condition_str, n_input_fields, is_identity):
+        """Return the command of a filter/projection stage. A projection that keeps its fields in
+        order is done by cut, and a filter that reads few of many fields is preceded by a cut of
+        those fields, if this Table's rows are known to have every column."""
+
+        can_cut = self.use_cut and len(self.delimiter) == 1 and self.delimiter not in '\\\''
+        if not condition_str and can_cut and field_idxs == sorted(set(field_idxs)):
+            return "cut -d'{0}' -f{1}".format(self.delimiter, self._get_cut_fields_str(field_idxs))
+
+        fields = [idx + 1 for idx in field_idxs]
+        if condition_str and not is_identity and can_cut:
+            read_fields = sorted(set(fields) | set(self._get_awk_fields(condition_str)))
+            if n_input_fields >= self.MIN_EARLY_CUT_FIELDS and \
+                    len(read_fields) <= n_input_fields * self.MAX_EARLY_CUT_FIELD_RATIO:
+                cut_cmd = "cut -d'{0}' -f{1}".format(
+                    self.delimiter, self._get_cut_fields_str([f - 1 for f in read_fields]))
+                renumbered = dict((field, idx + 1) for idx, field in enumerate(read_fields))
+                condition_str = self._renumber_awk_fields(condition_str, renumbered)
+                fields = [renumbered[field] for field in fields]
+                return '{0} | {1}'.format(
+                    cut_cmd, self._get_awk_cmd(condition_str, fields, is_identity))
+
+        return self._get_awk_cmd(condition_str, fields, is_identity)
+
+    def _get_awk_cmd(self, condition_str, fields, is_identity):
+
+        # printing an unchanged record avoids having awk rebuild it from its fields
+        fields_str = '$0' if is_identity else ','.join('$' + str(field) for field in fields)
+        if condition_str:
+            return "{0} -F'{1}' 'OFS=\"{1}\" {{ if ({2}) {{ print {3} }} }}'".format(
+                self.awk, self.delimiter, condition_str, fields_str)
+        return "{0} -F'{1}' 'OFS=\"{1}\" {{ print {2} }}'".format(
+            self.awk, self.delimiter, fields_str)
 
-    def get_awk_statement(self, conditions):
+    @staticmethod
+    def _get_cut_fields_str(field_idxs):
+        """Return cut's list of the fields at the given ascending indices, with runs of adjacent
+        fields as ranges."""
+
+        ranges = []
+        for idx in field_idxs:
+            if ranges and ranges[-1][1] == idx:
+                ranges[-1][1] = idx + 1
+            else:
+                ranges.append([idx + 1, idx + 1])
+        return ','.join(
+            str(first) if first == last else '{0}-{1}'.format(first, last)
+            for first, last in ranges)
+
+    @classmethod
+    def _get_awk_fields(cls, awk_str):
+        """Return the numbers of the fields an awk expression references."""
+        return [int(m.group(1)) for m in cls.AWK_FIELD_REGEX.finditer(awk_str) if m.group(1)]
+
+    @classmethod
+    def _renumber_awk_fields(cls, awk_str, field_numbers):
+        """Return an awk expression with each field reference renumbered by the given dictionary
+        of new field numbers by old."""
+
+        def renumber(match):
+            if not match.group(1):
+                return match.group(0)
+            return '$' + str(field_numbers[int(match.group(1))])
+        return cls.AWK_FIELD_REGEX.sub(renumber, awk_str)
+
+    @staticmethod
+    def _describe_awk_stage(condition_descriptions, columns):
+        """Describe a filter/projection awk stage that keeps the rows satisfying the given
+        conditions, printing the given columns, or all of them if None."""
+
+        operations = []
+        details = []
+        if condition_descriptions:
+            operations.append('filter')
+            details.append(' and '.join(condition_descriptions))
+        if columns is not None:
+            operations.append('project')
+            details.append(', '.join(str(c) for c in columns))
+        return {
+            'operation': ' and '.join(operations),
+            'detail': '; '.join(details),
+            'is_filter': bool(condition_descriptions),
+        }
+
+    def get_awk_statement(self, conditions, field_idxs=None):
         """Given a list of 'and', 'or', Expressions, and nested lists of the same, return the
         equivalent conditional Awk string.
+
+        :param field_idxs: the awk input field index of each column on this Table; defaults to the
+            columns' own indices
         """
 
         operator_map = {'or': '||', 'and': '&&'}
@@ -227,20 +726,26 @@ class Table(object):
             if isinstance(term, basestring):
                 string_parts.append(operator_map[term])
             elif isinstance(term, collections.Iterable):
-                string_parts.append('(' + self.get_awk_statement(term) + ')')
+                string_parts.append('(' + self.get_awk_statement(term, field_idxs) + ')')
             else:
                 expr_parts = []
 
                 for operand in (term.left_operand, term.right_operand, ):
                     if isinstance(operand, ColumnName):
-                        ordinal = self.column_idxs[self.get_column_for_name(operand)][0] + 1
+                        idx = self.column_idxs[self.get_column_for_name(operand)][0]
+                        ordinal = (field_idxs[idx] if field_idxs is not None else idx) + 1
                         expr_parts.append('$' + str(ordinal))
                     else:
                         expr_parts.append(operand)
 
-                string_parts.append(
-                    ' '.join((str(expr_parts[0]), term.operator, str(expr_parts[1]), ))
-                )
+                if term.operator == 'like':
+                    pattern = str(expr_parts[1])[1:-1]
+                    string_parts.append('{0} ~ /{1}/'.format(
+                        expr_parts[0], like_pattern_to_regex(pattern)))
+                else:
+                    string_parts.append(
+                        ' '.join((str(expr_parts[0]), term.operator, str(expr_parts[1]), ))
+                    )
 
         return ' '.join(string_parts)
 
@@ -248,14 +753,40 @@ class Table(object):
         """Return a string of commands whose output is the contents of this Table.""" 
 
         cmds = self.cmds
+        stages = self.stages
 
-        if self.name == '-':
-            data_path = ''
-        else:
-            data_path = self.name
+        data_path = self._get_data_path()
 
         if self.offset:
-            cmds = ['tail -n+{0} {1}'.format(self.offset+1, data_path)] + cmds 
+            # a sorted copy of a compressed file isn't compressed
+            if self.decompress_cmd and self.sorted_run is None:
+                tail_cmd = '{0} | tail -n+{1}'.format(self.decompress_cmd, self.offset + 1)
+            else:
+                tail_cmd = 'tail -n+{0} {1}'.format(self.offset+1, data_path)
+
+            partitions = self._get_scan_partitions()
+            if partitions > 1:
+                scan_cmd = self._get_partitioned_scan_cmd(partitions, self._scan_needs_order())
+                cmds = cmds[self._row_local_cmd_count:]
+
+                # the parts' row-local commands run within the scan, which outputs their rows
+                scan_stage = stages[self._row_local_cmd_count - 1]
+                stages = stages[self._row_local_cmd_count:]
+            else:
+                scan_cmd = tail_cmd
+                scan_stage = self._get_scan_stage()
+
+            if self.sorted_run is not None:
+                scan_cmd = '{{ {0} && {1}; }}'.format(self.sorted_run['fill_cmd'], scan_cmd)
+
+            cmds = [scan_cmd] + cmds 
+            stages = [scan_stage] + stages
+
+        if self.stage_counters is not None:
+            cmds = [
+                self.stage_counters.get_counting_cmd(cmd, stage)
+                for cmd, stage in zip(cmds, stages)
+            ]
 
         cmd_str = ' | '.join(cmds)
 
@@ -267,6 +798,117 @@ class Table(object):
 
         return cmd_str
 
+    def _get_scan_stage(self):
+        """Return the description of the scan of this Table's file, the same one each time, so
+        that its rows are counted once."""
+
+        if self._scan_stage is None:
+            details = ['standard input' if self.name == '-' else self.name]
+            if self.decompress_cmd and self.sorted_run is None:
+                details.append('decompressed by {0}'.format(self.decompress_cmd.split()[0]))
+            if self._get_scan_partitions() > 1:
+                details.append('in {0} parts'.format(self._get_scan_partitions()))
+            if self.sorted_run is not None:
+                details.append('from {0} sorted copy {1}'.format(
+                    'cached' if self.sorted_run['is_cached'] else 'new', self.sorted_run['path']))
+            self._scan_stage = {'operation': 'scan', 'detail': ', '.join(details)}
+        return self._scan_stage
+
+    def get_plan(self):
+        """Return a tree describing the operations that produce this Table's rows. Each node holds
+        an operation, its detail, the planner's estimate of the number of rows it outputs, the
+        index of its counter if its rows are counted, and the nodes of its inputs."""
+
+        stages = ([self._get_scan_stage()] if self.offset else []) + self.stages
+
+        node = None
+        estimated_rows = self.estimated_input_rows
+        for stage in stages:
+            if stage.get('is_filter'):
+                estimated_rows = self.estimated_rows
+            if stage.get('max_rows') is not None and estimated_rows is not None:
+                estimated_rows = min(estimated_rows, stage['max_rows'])
+
+            inputs = [node] if node else [table.get_plan() for table in stage.get('inputs', [])]
+            node = {
+                'operation': stage['operation'],
+                'detail': stage.get('detail', ''),
+                'estimated_rows': estimated_rows,
+                'counter': stage.get('counter'),
+                'inputs': inputs,
+            }
+        return node
+
+    def _get_data_path(self):
+        """Return the path of the file this Table's rows are read from, or '' for stdin."""
+
+        if self.name == '-':
+            return ''
+        if self.sorted_run is not None:
+            return shell_quote(self.sorted_run['path'])
+        return shell_quote(self.name)
+
+    def _get_scan_partitions(self):
+        """Return the number of parts of this Table's file to filter and project concurrently."""
+
+        # a compressed file can only be read from its start
+        if self.partitions <= 1 or self._row_local_cmd_count == 0 or self.name == '-' or \
+                (self.decompress_cmd and self.sorted_run is None):
+            return 1
+        try:
+            file_size = os.path.getsize(self.name)
+        except OSError:
+            return self.partitions
+        return max(min(self.partitions, file_size // max(self.MIN_PARTITION_BYTES, 1)), 1)
+
+    def _scan_needs_order(self):
+        """Return true if the rows of this Table's file must be output in their order: when a sort
+        order is relied on without sorting, or rows are sampled, which picks them by their
+        order."""
+
+        operations = [stage['operation'] for stage in self.stages[self._row_local_cmd_count:]]
+        if operations[:1] == ['sort']:
+            return False
+        return bool(self.sorted_by) and 'sort' not in operations or 'sample' in operations
+
+    def _get_partitioned_scan_cmd(self, partitions, ordered):
+        """Return a command that splits this Table's file into line-aligned parts and runs this
+        Table's leading row-local commands on each part in the background. The command fails if
+        any part fails.
+
+        If ordered, the parts' results are written to temporary files, which are output in the
+        order of the parts once all are done and removed however the command exits. That costs a
+        write and read of the results and holds back the first row until the whole scan is done,
+        so otherwise each part's results are output as they come, in writes of whole rows."""
+
+        row_local_cmds = self.cmds[:self._row_local_cmd_count]
+        if not ordered:
+            row_local_cmds = row_local_cmds + ["{0} '{1}'".format(self.awk, WHOLE_ROW_WRITES_PROGRAM)]
+
+        part_cmds = []
+        for part in range(1, partitions + 1):
+            cmds = ['split -n l/{0}/{1} {2}'.format(part, partitions, self._get_data_path())]
+
+            # only the first part holds the header
+            if part == 1:
+                cmds.append('tail -n+{0}'.format(self.offset + 1))
+
+            part_cmds.append('{{ {0}{1}; }} & pids="$pids $!";'.format(
+                ' | '.join(cmds + row_local_cmds), ' > "$d/{0}"'.format(part) if ordered else ''))
+
+        if not ordered:
+            return '( set -o pipefail; pids=; {0} {1} )'.format(
+                ' '.join(part_cmds), WAIT_FOR_PIDS_CMD)
+
+        temporary_directory = self.sort_options.temporary_directory
+        mktemp_cmd = 'mktemp -d' + (
+            ' -p {0}'.format(shell_quote(temporary_directory)) if temporary_directory else '')
+        part_paths = ' '.join('"$d/{0}"'.format(part) for part in range(1, partitions + 1))
+        return (
+            '( set -o pipefail; d=$({0}) || exit; trap \'rm -rf "$d"\' EXIT; pids=; {1} {2} '
+            'cat {3}; )'
+        ).format(mktemp_cmd, ' '.join(part_cmds), WAIT_FOR_PIDS_CMD, part_paths)
+
     def set_column_aliases(self, column_names):
         for col, col_name in zip(self.columns, column_names):
             col.alias = col_name
@@ -290,13 +932,20 @@ class Table(object):
             return matched_columns[0]
 
     def sample_rows(self, sample_size, random_seed=None):
-        sample_cmd = """awk -v seed={0} -v n={1} '
+        sample_cmd = """{0} -v seed={1} -v n={2} '
             BEGIN {{ srand(seed) }}
             NR <= n {{ reservoir[NR] = $0 }}
             NR > n {{ M = int(rand() * NR) + 1; if (M <= n) {{ reservoir[M] = $0 }}}}
             END {{ for (key in reservoir) {{ print reservoir[key] }}}}'""".format(
+                self.awk,
                 random_seed if random_seed is not None else '$RANDOM',
                 sample_size
             )
         self.cmds.append(sample_cmd)
+        self.stages.append({
+            'operation': 'sample',
+            'detail': '{0} rows'.format(sample_size),
+            'max_rows': int(sample_size),
+        })
+        self.sorted_by = []
 
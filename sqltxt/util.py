@@ -1,5 +1,12 @@
+import json
+import logging
+import os
+import pipes
+import time
 import Queue
 
+LOG = logging.getLogger(__name__)
+
 class PriorityContainer(Queue.PriorityQueue):
     """A priority queue that supports inspection of its contents and retrieves the highest-valued
     entry first. Not thread-safe."""
@@ -21,3 +28,132 @@ class PriorityContainer(Queue.PriorityQueue):
 
     def __contains__(self, key):
         return key in self._contents
+
+SIZE_SUFFIXES = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
+
+def parse_size(size_str):
+    """Return the number of bytes in a size like 512, 64K, 100M, or 2G."""
+
+    size_str = str(size_str).strip().upper()
+    multiplier = SIZE_SUFFIXES.get(size_str[-1:], 1)
+    if size_str[-1:] in SIZE_SUFFIXES:
+        size_str = size_str[:-1]
+    return int(float(size_str) * multiplier)
+
+def format_size(size):
+    """Return a number of bytes as a size like 512B, 64.0K, or 1.5G, the inverse of parse_size."""
+
+    for suffix, multiplier in sorted(SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if size >= multiplier:
+            return '{0:.1f}{1}'.format(float(size) / multiplier, suffix)
+    return '{0}B'.format(int(size))
+
+def cpu_count():
+    """Return the number of online processors. Cheaper than importing multiprocessing for it."""
+    try:
+        return max(os.sysconf('SC_NPROCESSORS_ONLN'), 1)
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+def find_executable(name):
+    """Return the path of the named executable on the PATH, or None if there's none."""
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def physical_memory():
+    """Return the number of bytes of physical memory on this machine, or None if it's unknown."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+SORT_PROBE_FILE_NAME = 'sort.json'
+
+_supported_sort_options = {}  # by the signature of the sort on the PATH and option
+
+def sort_supports(option, cache_dir=None):
+    """Return true if the sort on the PATH accepts the given option, e.g. '--parallel=1'. GNU
+    sort's --parallel, -S and --compress-program aren't POSIX, and other sorts may reject them.
+    Each option is probed once per sort, and the results are cached in the cache directory next
+    to awk's, with the path, size and modification time of the sort they were probed with."""
+
+    path = find_executable('sort')
+    if path is None:
+        return False
+    file_stat = os.stat(os.path.realpath(path))
+    signature = [path, file_stat.st_size, file_stat.st_mtime]
+
+    key = (tuple(signature), option)
+    if key not in _supported_sort_options:
+        _supported_sort_options[key] = _get_cached_sort_probe(signature, option, cache_dir)
+    return _supported_sort_options[key]
+
+def _get_cached_sort_probe(signature, option, cache_dir):
+    from cache import get_cache_dir
+
+    probe_path = os.path.join(cache_dir or get_cache_dir(), SORT_PROBE_FILE_NAME)
+    try:
+        with open(probe_path) as f:
+            probe = json.load(f)
+        if probe['signature'] != signature:
+            probe = {'signature': signature, 'options': {}}
+        elif option in probe['options']:
+            return probe['options'][option]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        probe = {'signature': signature, 'options': {}}
+
+    probe['options'][option] = _probe_sort(signature[0], option)
+    try:
+        if not os.path.isdir(os.path.dirname(probe_path)):
+            os.makedirs(os.path.dirname(probe_path))
+        tmp_path = '{0}.{1}.tmp'.format(probe_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(probe, f)
+        os.rename(tmp_path, probe_path)
+    except (IOError, OSError) as e:
+        LOG.debug('Could not cache sort probe: {0}'.format(e))
+    return probe['options'][option]
+
+def _probe_sort(path, option):
+    import subprocess
+
+    with open(os.devnull, 'r+') as devnull:
+        try:
+            returncode = subprocess.call(
+                [path] + option.split(), stdin=devnull, stdout=devnull, stderr=devnull)
+        except OSError:
+            returncode = None
+    return returncode == 0
+
+class Stopwatch(object):
+    """Record the time taken by consecutive steps of a process."""
+
+    def __init__(self, start_time=None):
+        self.laps = []
+        self._lap_start_time = start_time if start_time is not None else time.time()
+
+    def lap(self, name):
+        """Record the time since the previous lap (or the start) as the time taken by the named
+        step, adding it to any time already recorded for that step."""
+
+        now = time.time()
+        elapsed = now - self._lap_start_time
+        self._lap_start_time = now
+
+        for idx, (lap_name, lap_elapsed) in enumerate(self.laps):
+            if lap_name == name:
+                self.laps[idx] = (name, lap_elapsed + elapsed)
+                return
+        self.laps.append((name, elapsed))
+
+    def report(self):
+        """Return a table of the time taken by each step and in total, in milliseconds."""
+        laps = self.laps + [('total', sum(elapsed for name, elapsed in self.laps))]
+        return '\n'.join('{0:<8} {1:8.1f} ms'.format(name, elapsed * 1000) for name, elapsed in laps)
+
+def shell_quote(s):
+    """Return a shell-escaped version of the string."""
+    return pipes.quote(s)
@@ -3,10 +3,16 @@ import os
 import subprocess
 import re
 import warnings
+import tempfile
+import shutil
+import time
+from sqltxt.awk import get_awk
 
 def get_awk_version():
+    """Return the version of the awk that sqltxt runs by default."""
     awk_version = None
-    awk_version_str = subprocess.check_output(['awk -Wversion 2>/dev/null || awk --version'], shell=True)
+    awk_version_str = subprocess.check_output(
+        ['{0} -Wversion 2>/dev/null || {0} --version'.format(get_awk())], shell=True)
     if re.compile('awk version').match(awk_version_str):
         awk_version = 'AWK'
     elif re.compile('GNU Awk').match(awk_version_str):
@@ -16,9 +22,22 @@ def get_awk_version():
     return awk_version
 
 class SqltxtTest(unittest.TestCase):
-        
+
+    def setUp(self):
+        # keep the plans, results and probes the commands cache out of the user's cache
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved_cache_dir = os.environ.get('SQLTXT_CACHE_DIR')
+        os.environ['SQLTXT_CACHE_DIR'] = self.cache_dir
+
+    def tearDown(self):
+        if self.saved_cache_dir is None:
+            del os.environ['SQLTXT_CACHE_DIR']
+        else:
+            os.environ['SQLTXT_CACHE_DIR'] = self.saved_cache_dir
+        shutil.rmtree(self.cache_dir)
+
     def test_select(self):
-        cmd = "sqltxt 'select col_a from tests/data/table_a.txt'"
+        cmd = "sqltxt --awk=awk 'select col_a from tests/data/table_a.txt'"
         actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
         expected_output = """echo "col_a"; tail -n+2 tests/data/table_a.txt | awk -F',' 'OFS="," { print $1 }'\n"""
         self.assertEqual(expected_output, actual_output)
@@ -30,9 +49,9 @@ class SqltxtTest(unittest.TestCase):
         self.assertEqual(expected_output, actual_output)
 
     def test_where(self):
-        cmd = "sqltxt 'select col_a from tests/data/table_a.txt where col_b > 2'"
+        cmd = "sqltxt --awk=awk 'select col_a from tests/data/table_a.txt where col_b > 2'"
         actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
-        expected_output = """echo "col_a"; tail -n+2 tests/data/table_a.txt | awk -F',' 'OFS="," { if ($2 > 2) { print $1,$2 } }' | awk -F',' 'OFS="," { print $1 }'\n"""
+        expected_output = """echo "col_a"; tail -n+2 tests/data/table_a.txt | awk -F',' 'OFS="," { if ($2 > 2) { print $1 } }'\n"""
         self.assertEqual(expected_output, actual_output)
 
     def test_executed_where(self):
@@ -47,6 +66,14 @@ class SqltxtTest(unittest.TestCase):
         expected_output = """col_a,col_z\n2,x\n2,y\n"""
         self.assertEqual(expected_output, actual_output)
 
+    def test_rows_out_of_declared_order_stop_with_the_status_bash_reports(self):
+        cmd = "sqltxt -e --hash-join-threshold=0 --sorted-by=tests/data/table_a.txt:col_b --verify-sorted 'select ta.col_a, col_z from tests/data/table_a.txt ta join tests/data/table_b.txt tb on (ta.col_b = tb.col_a)'"
+        process = subprocess.Popen(['/bin/bash', '-c', cmd],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        self.assertEqual(process.returncode, 143)
+        self.assertIn('is out of its declared sort order', stderr)
+
     def test_rows_are_sampled_for_sample_size_one(self):
 
         cmd = "sqltxt -e --random-seed=100 'select ta.col_a, col_z from tests/data/table_a.txt ta join tests/data/table_b.txt tb on (ta.col_a = tb.col_a) tablesample (1)'"
@@ -75,3 +102,118 @@ class SqltxtTest(unittest.TestCase):
         awk_version = get_awk_version() or 'AWK'
         expected_output = expected_output_for_awk[awk_version]
         self.assertEqual(expected_output, actual_output)
+
+    def test_explain_analyze_counts_rows_of_each_operation(self):
+        cmd = "sqltxt --explain-analyze 'select col_a from tests/data/table_a.txt where col_b > 1'"
+        lines = subprocess.check_output(['/bin/bash', '-c', cmd]).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('Filter and project col_b > 1; col_a  (est. 1 rows; 2 rows, 4B in '))
+        self.assertTrue(lines[1].startswith('  Scan tests/data/table_a.txt  (est. 3 rows; 3 rows, 12B in '))
+
+    def test_cached_commands_follow_changed_headers(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            table_path = os.path.join(tmp_path, 'table.txt')
+            cmd = "SQLTXT_CACHE_DIR={0} sqltxt -e 'select col_a from {1}'".format(tmp_path, table_path)
+
+            with open(table_path, 'w') as f:
+                f.write('col_a,col_b\n1,2\n')
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]), 'col_a\n1\n')
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]), 'col_a\n1\n')
+
+            with open(table_path, 'w') as f:
+                f.write('col_b,col_a\n1,2\n')
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]), 'col_a\n2\n')
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_cached_commands_reading_sorted_copies_follow_appended_rows(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            # the appended row doesn't change the file's size to the nearest power of two
+            table_path = os.path.join(tmp_path, 'table.txt')
+            with open(table_path, 'w') as f:
+                f.write('col_a,col_z\n1,w\n2,x\n2,y\n4,p\n5,q\n6,r\n')
+            cmd = ("sqltxt -e --cache-sorted-runs --hash-join-threshold=0 'select col_b, col_z "
+                "from tests/data/table_a.txt a join {0} b on (a.col_a = b.col_a)'").format(table_path)
+
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]).split(),
+                ['col_b,col_z', '1,w', '3,x', '3,y'])
+            with open(table_path, 'a') as f:
+                f.write('3,z\n')
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]).split(),
+                ['col_b,col_z', '1,w', '3,x', '3,y', '2,z'])
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_compressed_input_is_decompressed_while_read(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            table_path = os.path.join(tmp_path, 'table_a.txt.gz')
+            subprocess.check_call(['/bin/bash', '-c',
+                'gzip -c tests/data/table_a.txt > {0}'.format(table_path)])
+
+            cmd = "sqltxt -e 'select col_b from {0} where col_a > 1'".format(table_path)
+            self.assertEqual(subprocess.check_output(['/bin/bash', '-c', cmd]), 'col_b\n3\n2\n')
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_queries_run_on_server(self):
+        tmp_path = tempfile.mkdtemp()
+        socket_path = os.path.join(tmp_path, 'sqltxt.sock')
+        server = subprocess.Popen(['sqltxt', 'serve', '--socket={0}'.format(socket_path)])
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.05)
+
+            cmd = "SQLTXT_SOCKET={0} sqltxt -e 'select col_a from tests/data/table_a.txt where col_b > 2'".format(socket_path)
+            actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
+            self.assertEqual(actual_output, 'col_a\n2\n')
+
+            cmd = "echo 'select col_a from tests/data/table_a.txt' | SQLTXT_SOCKET={0} sqltxt --cut".format(socket_path)
+            actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
+            expected_output = """echo "col_a"; tail -n+2 tests/data/table_a.txt | cut -d',' -f1\n"""
+            self.assertEqual(actual_output, expected_output)
+
+            # translated in the client's environment, and leaving input it doesn't read unread
+            client_cache_dir = os.path.join(tmp_path, 'client')
+            cmd = "echo unread | {{ SQLTXT_SOCKET={0} SQLTXT_CACHE_DIR={1} sqltxt -e 'select col_a from tests/data/table_a.txt where col_b > 2'; cat; }}".format(socket_path, client_cache_dir)
+            actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
+            self.assertEqual(actual_output, 'col_a\n2\nunread\n')
+            self.assertTrue(os.listdir(client_cache_dir))
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(tmp_path)
+
+    def test_server_with_relative_socket_survives_requests_from_elsewhere(self):
+        import socket
+        tmp_path = tempfile.mkdtemp()
+        server_path = os.path.join(tmp_path, 'server')
+        os.mkdir(server_path)
+        socket_path = os.path.join(server_path, 'rel.sock')
+        server = subprocess.Popen(['sqltxt', 'serve', '--socket=rel.sock'], cwd=server_path)
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.05)
+
+            cmd = "cd {0} && SQLTXT_SOCKET={1} sqltxt -e 'select col_a from table_a.txt where col_b > 2'".format(
+                os.path.abspath('tests/data'), socket_path)
+            actual_output = subprocess.check_output(['/bin/bash', '-c', cmd])
+            self.assertEqual(actual_output, 'col_a\n2\n')
+
+            # a malformed request gets a failed exit status rather than no answer
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            client.sendall('not json\n')
+            self.assertEqual(client.makefile('rb').read(), 'x\x00\x00\x00\x011')
+            client.close()
+        finally:
+            server.terminate()
+            self.assertEqual(server.wait(), 0)
+            self.assertFalse(os.path.exists(socket_path))
+            shutil.rmtree(tmp_path)
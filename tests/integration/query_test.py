@@ -158,6 +158,25 @@ class QueryTest(unittest.TestCase):
         table_actual_out = subprocess.check_output(['/bin/bash', '-c', table_actual.get_cmd_str(output_column_names=True)])
         self.assertEqual(table_actual_out, table_expected_out)
 
+    def test_where_like(self):
+
+        query = Query(
+            [{'path': 'table_b.txt', 'alias': 'table_b.txt'}],
+            conditions=[['col_z', 'LIKE', "'%x%'"], 'or', ['col_z', 'LIKE', "'y%'"]],
+            columns=['col_a']
+        )
+        table_actual = query.execute()
+
+        table_expected = Table.from_cmd(
+          'expected',
+          cmd = 'echo -e "2\n2"',
+          columns = ['col_a']
+          )
+
+        table_expected_out = subprocess.check_output(['/bin/bash', '-c', table_expected.get_cmd_str(output_column_names=True)])
+        table_actual_out = subprocess.check_output(['/bin/bash', '-c', table_actual.get_cmd_str(output_column_names=True)])
+        self.assertEqual(table_actual_out, table_expected_out)
+
     def test_join_columns(self):
 
         query = Query(
@@ -197,6 +216,31 @@ class QueryTest(unittest.TestCase):
         
         self.assertEqual(table_actual_out, table_expected_out)
 
+    def test_plan_describes_operations_with_estimates(self):
+
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'table_a.txt'},
+                {'path': 'table_b.txt', 'alias': 'table_b.txt'}
+            ],
+            conditions=[
+                ['table_a.txt.col_a', '==', 'table_b.txt.col_a'], 'and', ['col_b', '>', '1'] ],
+            columns=['table_a.txt.col_a', 'col_z']
+        )
+
+        join = query.execute().get_plan()
+        self.assertEqual(join['operation'], 'merge join')
+        self.assertEqual(join['detail'], 'on table_a.txt.col_a = table_b.txt.col_a')
+
+        left_sort, right_sort = join['inputs']
+        self.assertEqual(left_sort['operation'], 'sort')
+        left_filter = left_sort['inputs'][0]
+        self.assertEqual(left_filter['detail'], 'col_b > 1; col_a')
+        self.assertEqual(left_filter['inputs'][0]['operation'], 'scan')
+        self.assertEqual(left_filter['inputs'][0]['detail'], 'table_a.txt')
+        self.assertEqual(left_filter['inputs'][0]['estimated_rows'], 3)
+        self.assertEqual(left_filter['estimated_rows'], 1)
+
     def test_join_two_tables_with_sort(self):
         
         query = Query(
@@ -211,7 +255,7 @@ class QueryTest(unittest.TestCase):
         cmd_actual = table_actual.get_cmd_str(output_column_names=True)
         cmd_expected = \
           'echo "col_b,col_a,col_z"; ' + \
-          "join -t, -1 2 -2 1 <(tail -n+2 table_a.txt | sort -t, -k 2,2) <(tail -n+2 table_b.txt | sort -t, -k 1,1) | awk -F\',\' \'OFS=\",\" { print $1,$1,$3 }\'"
+          "LC_ALL=C join -t, -1 1 -2 1 <(tail -n+2 table_a.txt | awk -F\',\' \'OFS=\",\" { print $2 }\' | LC_ALL=C sort -t, -k 1,1) <(tail -n+2 table_b.txt | LC_ALL=C sort -t, -k 1,1) | awk -F\',\' \'OFS=\",\" { print $1,$1,$2 }\'"
         assert cmd_actual == cmd_expected
         
         table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
@@ -219,6 +263,109 @@ class QueryTest(unittest.TestCase):
 
         self.assertEqual(table_actual_out, table_expected_out)
 
+    def test_hash_join_two_tables(self):
+
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'table_a.txt', 'sorted_by': ['col_a']},
+                {'path': 'table_b.txt', 'alias': 'table_b.txt'}
+            ],
+            conditions=[ ['table_a.txt.col_a', '==', 'table_b.txt.col_a'], ],
+            columns=['table_a.txt.col_a', 'col_b', 'col_z'],
+            hash_join_threshold=1024
+        )
+        table_actual = query.execute()
+        cmd_actual = table_actual.get_cmd_str()
+        self.assertNotIn('sort', cmd_actual)
+        self.assertNotIn('join -t', cmd_actual)
+
+        # the joined rows keep the order of the table streamed past the in-memory table
+        self.assertEqual([str(col) for col in table_actual.sorted_by], ['col_a'])
+
+        table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
+        self.assertEqual(table_actual_out.split(), ['1,1,w', '2,3,x', '2,3,y'])
+
+    def test_partitioned_join_two_tables(self):
+
+        relations = [
+            {'path': 'table_a.txt', 'alias': 'table_a.txt'},
+            {'path': 'table_d.txt', 'alias': 'table_d.txt'}
+        ]
+        conditions = [ ['table_a.txt.col_a', '==', 'table_d.txt.col_a'], ]
+        columns = ['table_a.txt.col_a', 'table_a.txt.col_b', 'col_x']
+
+        query = Query(relations, conditions=conditions, columns=columns,
+            partitioned_join_threshold=1, partitions=3)
+        cmd_actual = query.execute().get_cmd_str()
+        self.assertIn('"$d/joined2"', cmd_actual)
+
+        query = Query(relations, conditions=conditions, columns=columns)
+        cmd_expected = query.execute().get_cmd_str()
+        self.assertNotIn('"$d/joined', cmd_expected)
+
+        table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
+        table_expected_out = subprocess.check_output(['/bin/bash', '-c', cmd_expected])
+        self.assertEqual(sorted(table_actual_out.split()), sorted(table_expected_out.split()))
+
+        # a failure to read either input fails the join rather than dropping its rows
+        failing_cmd = cmd_actual.replace('table_d.txt', 'missing_table.txt')
+        with open(os.devnull, 'w') as devnull:
+            self.assertNotEqual(
+                subprocess.call(['/bin/bash', '-c', failing_cmd], stderr=devnull), 0)
+
+    def test_source_tables_are_projected_to_required_columns(self):
+
+        query = Query(
+            [
+                {'path': 'table_d.txt', 'alias': 'table_d.txt'},
+                {'path': 'table_b.txt', 'alias': 'table_b.txt'}
+            ],
+            conditions=[
+                ['table_d.txt.col_a', '==', 'table_b.txt.col_a'], 'and',
+                ['col_b', '>', '2'], 'and',
+                ['col_x', '<', 'col_z'],
+            ],
+            columns=['col_z']
+        )
+        query.execute()
+        table_d, table_b = sorted(query.tables, key=lambda t: t.name, reverse=True)
+
+        # col_b is only used by a condition applied to the source table, so it is dropped after it
+        self.assertEqual([str(col) for col in table_d.columns], ['col_a', 'col_x'])
+        self.assertEqual([str(col) for col in table_b.columns], ['col_a', 'col_z'])
+
+    def test_declared_sort_order_skips_sort(self):
+
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'table_a.txt', 'sorted_by': ['col_a']},
+                {'path': 'table_b.txt', 'alias': 'table_b.txt', 'sorted_by': ['col_a']}
+            ],
+            conditions=[['table_a.txt.col_a', '==', 'table_b.txt.col_a']],
+            columns=['col_b', 'col_z'],
+            verify_sorted=True
+        )
+        cmd_actual = query.execute().get_cmd_str()
+        self.assertNotIn(' sort -t', cmd_actual)
+        self.assertEqual(cmd_actual.count('is out of its declared sort order'), 2)
+
+        output = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
+        self.assertEqual(output.split(), ['1,w', '3,x', '3,y'])
+
+        # a hash join doesn't rely on the order of its inputs, so it isn't checked
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'table_a.txt', 'sorted_by': ['col_a']},
+                {'path': 'table_b.txt', 'alias': 'table_b.txt'}
+            ],
+            conditions=[['table_a.txt.col_a', '==', 'table_b.txt.col_a']],
+            columns=['col_b', 'col_z'],
+            verify_sorted=True,
+            hash_join_threshold=1024 ** 2
+        )
+        cmd_actual = query.execute().get_cmd_str()
+        self.assertNotIn('is out of its declared sort order', cmd_actual)
+
     def test_join_two_tables_with_multiple_join_conditions(self):
         
         query = Query(
@@ -236,13 +383,32 @@ class QueryTest(unittest.TestCase):
         cmd_actual = table_actual.get_cmd_str(output_column_names=True)
         cmd_expected = \
           'echo "col_b,col_a,col_x"; ' + \
-          "join -t, -1 1 -2 1 <(tail -n+2 table_d.txt | sort -t, -k 1,1) <(tail -n+2 table_a.txt | sort -t, -k 1,1) | awk -F\',\' \'OFS=\",\" { if ($4 == $2) { print $1,$2,$3,$4 } }\' | awk -F\',\' \'OFS=\",\" { print $4,$1,$3 }\'"
+          "LC_ALL=C join -t, -1 1 -2 1 <(tail -n+2 table_a.txt | awk -F\',\' \'OFS=\",\" { print $1 SUBSEP $2,$0 }\' | LC_ALL=C sort -t, -k 1,1) <(tail -n+2 table_d.txt | awk -F\',\' \'OFS=\",\" { print $1 SUBSEP $2,$0 }\' | LC_ALL=C sort -t, -k 1,1) | awk -F\',\' \'OFS=\",\" { print $3,$2,$6 }\'"
         assert cmd_actual == cmd_expected
         
         table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
-        table_expected_out = subprocess.check_output(['/bin/bash', '-c', cmd_expected])
+        self.assertEqual(table_actual_out, 'col_b,col_a,col_x\n3,2,-2\n2,3,-3\n')
+        self.assertEqual([str(col) for col in table_actual.sorted_by], ['col_a', 'col_b'])
 
-        self.assertEqual(table_actual_out, table_expected_out)
+    def test_hash_join_two_tables_with_multiple_join_conditions(self):
+
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'table_a.txt'},
+                {'path': 'table_d.txt', 'alias': 'table_d.txt'}
+            ],
+            conditions=[
+                ['table_a.txt.col_a', '==', 'table_d.txt.col_a'], 'and',
+                ['table_a.txt.col_b', '==', 'table_d.txt.col_b'],
+            ],
+            columns=['table_a.txt.col_b', 'table_a.txt.col_a', 'col_x'],
+            hash_join_threshold=1024
+        )
+        cmd_actual = query.execute().get_cmd_str()
+        self.assertIn('k = $1 SUBSEP $2', cmd_actual)
+
+        table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
+        self.assertEqual(sorted(table_actual_out.split()), ['2,3,-3', '3,2,-2'])
 
     def test_join_three_tables(self):
         query = Query(
@@ -261,12 +427,12 @@ class QueryTest(unittest.TestCase):
         cmd_actual = table_actual.get_cmd_str(output_column_names=True)
         cmd_expected = \
           'echo "col_z,col_a,col_x"; ' + \
-          'join -t, -1 1 -2 1 ' + \
-              '<(join -t, -1 1 -2 1 ' + \
-                  '<(tail -n+2 table_d.txt | sort -t, -k 1,1) ' + \
-                  '<(tail -n+2 table_a.txt | sort -t, -k 1,1) | sort -t, -k 1,1) ' + \
-              '<(tail -n+2 table_b.txt | sort -t, -k 1,1) ' + \
-          '| awk -F\',\' \'OFS="," { print $5,$1,$3 }\''
+          'LC_ALL=C join -t, -1 1 -2 1 ' + \
+              '<(LC_ALL=C join -t, -1 1 -2 1 ' + \
+                  '<(tail -n+2 table_a.txt | awk -F\',\' \'OFS="," { print $1 }\' | LC_ALL=C sort -t, -k 1,1) ' + \
+                  '<(tail -n+2 table_b.txt | LC_ALL=C sort -t, -k 1,1)) ' + \
+              '<(tail -n+2 table_d.txt | awk -F\',\' \'OFS="," { print $1,$3 }\' | LC_ALL=C sort -t, -k 1,1) ' + \
+          '| awk -F\',\' \'OFS="," { print $2,$1,$3 }\''
         assert cmd_actual == cmd_expected
         
         table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
@@ -274,6 +440,26 @@ class QueryTest(unittest.TestCase):
 
         self.assertEqual(table_actual_out, table_expected_out)
 
+    def test_join_three_tables_on_transitive_conditions(self):
+        # once table_a and table_b are joined, both conditions on table_d join the same columns
+        query = Query(
+            [
+                {'path': 'table_a.txt', 'alias': 'a'},
+                {'path': 'table_b.txt', 'alias': 'b'},
+                {'path': 'table_d.txt', 'alias': 'd'}
+            ],
+            conditions=[
+                ['a.col_a', '==', 'b.col_a'], 'and',
+                ['b.col_a', '==', 'd.col_a'], 'and',
+                ['a.col_a', '==', 'd.col_a'],
+            ],
+            columns=['a.col_a', 'col_z', 'col_x']
+        )
+        cmd_actual = query.execute().get_cmd_str()
+
+        table_actual_out = subprocess.check_output(['/bin/bash', '-c', cmd_actual])
+        self.assertEqual(sorted(table_actual_out.split()), ['1,w,-1', '1,w,-4', '2,x,-2', '2,y,-2'])
+
     def test_wildcard_selects_all_columns(self):
 
         query = Query(
@@ -0,0 +1,30 @@
+import unittest
+import os
+import shutil
+import tempfile
+from sqltxt.awk import find_candidates, probe_awks, is_compatible, get_awk, PROBE_FILE_NAME
+
+class AwkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_probe_awks_excludes_incompatible_awks(self):
+        candidates = find_candidates()
+        self.assertTrue(candidates)
+        self.assertTrue(is_compatible([candidates[0][1]], self.tmp_path))
+        self.assertFalse(is_compatible(['false'], self.tmp_path))
+
+        probe = probe_awks([('false', 'false')] + candidates)
+        self.assertIsNone(probe['seconds']['false'])
+        self.assertIn(probe['awk'], [candidate for candidate, _ in candidates])
+
+        self.assertEqual(probe_awks([('false', 'false')])['awk'], 'awk')
+
+    def test_get_awk_caches_probe(self):
+        awk = get_awk(self.tmp_path)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_path, PROBE_FILE_NAME)))
+        self.assertEqual(get_awk(self.tmp_path), awk)
@@ -0,0 +1,154 @@
+import unittest
+import os
+import shutil
+import tempfile
+import subprocess
+from sqltxt.cache import PlanCache, ResultCache, normalize_sql, record_substitution_statuses
+from sqltxt.stats import analyze, write_stats
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache = PlanCache(os.path.join(self.tmp_path, 'plans'), max_bytes=1024 ** 2)
+        self.file_path = os.path.join(self.tmp_path, 'table_a.txt')
+        with open(self.file_path, 'w') as f:
+            f.write('col_a,col_b\n1,1\n2,3\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("  select col_a\n  from t\twhere col_b = 'a  b' "),
+            "select col_a from t where col_b = 'a  b'"
+        )
+
+    def test_get_key(self):
+        key = PlanCache.get_key('select col_a from t', {'--partitions': '1'})
+        self.assertEqual(key, PlanCache.get_key('select  col_a\nfrom t', {'--partitions': '1'}))
+        self.assertNotEqual(key, PlanCache.get_key('select col_a from t', {'--partitions': '2'}))
+
+    def test_get_cached_command(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.put('key', [self.file_path], 'cut -d, -f1')
+        self.assertEqual(self.cache.get('key'), 'cut -d, -f1')
+        self.assertEqual(self.cache.get_input_paths('key'), [self.file_path])
+
+    def test_changed_header_invalidates_command(self):
+        self.cache.put('key', [self.file_path], 'cut -d, -f1')
+        with open(self.file_path, 'w') as f:
+            f.write('col_b,col_a\n1,1\n2,3\n')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_appended_rows_keep_command_without_stats(self):
+        self.cache.put('key', [self.file_path], 'cut -d, -f1')
+        with open(self.file_path, 'a') as f:
+            f.write('3,2\n')
+        self.assertEqual(self.cache.get('key'), 'cut -d, -f1')
+
+    def test_appended_rows_invalidate_command_reading_sorted_copy(self):
+        self.cache.put('key', [self.file_path], 'cut -d, -f1', exact_paths=[self.file_path])
+        self.assertEqual(self.cache.get('key'), 'cut -d, -f1')
+        with open(self.file_path, 'a') as f:
+            f.write('3,2\n')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_new_stats_invalidate_command(self):
+        self.cache.put('key', [self.file_path], 'cut -d, -f1')
+        write_stats(self.file_path, analyze(self.file_path))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_standard_input_is_not_cached(self):
+        self.cache.put('key', ['-'], 'cut -d, -f1')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_least_recently_used_commands_are_evicted(self):
+        self.cache.put('a', [self.file_path], 'cut -d, -f1')
+        entry_bytes = os.path.getsize(os.path.join(self.cache.cache_dir, 'a.json'))
+        self.cache.max_bytes = 2 * entry_bytes
+
+        self.cache.put('b', [self.file_path], 'cut -d, -f1')
+        os.utime(os.path.join(self.cache.cache_dir, 'a.json'), (0, 0))
+        os.utime(os.path.join(self.cache.cache_dir, 'b.json'), (1, 1))
+        self.cache.get('a')
+        self.cache.put('c', [self.file_path], 'cut -d, -f1')
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tmp_path, 'results'), max_bytes=1024 ** 2)
+        self.file_path = os.path.join(self.tmp_path, 'table_a.txt')
+        with open(self.file_path, 'w') as f:
+            f.write('col_a,col_b\n1,1\n2,3\n')
+        self.cmd = 'tail -n+2 {0} | cut -d, -f1'.format(self.file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_get_key(self):
+        key = ResultCache.get_key(self.cmd, [self.file_path])
+        self.assertEqual(key, ResultCache.get_key(self.cmd, [self.file_path]))
+        self.assertIsNone(ResultCache.get_key(self.cmd, ['-']))
+        self.assertIsNone(ResultCache.get_key('awk -v seed=$RANDOM', [self.file_path]))
+
+        with open(self.file_path, 'a') as f:
+            f.write('3,2\n')
+        self.assertNotEqual(key, ResultCache.get_key(self.cmd, [self.file_path]))
+
+    def test_successful_output_is_cached(self):
+        key = ResultCache.get_key(self.cmd, [self.file_path])
+        self.assertIsNone(self.cache.get(key))
+
+        output = subprocess.check_output(['/bin/bash', '-c', self.cache.get_caching_cmd(key, self.cmd)])
+        self.assertEqual(output, '1\n2\n')
+        with open(self.cache.get(key)) as f:
+            self.assertEqual(f.read(), output)
+
+    def test_failed_output_is_not_cached(self):
+        cmd = self.cmd + ' && false'
+        key = ResultCache.get_key(cmd, [self.file_path])
+
+        caching_cmd = self.cache.get_caching_cmd(key, cmd)
+        self.assertNotEqual(subprocess.call(['/bin/bash', '-c', caching_cmd]), 0)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_output_of_failed_process_substitution_is_not_cached(self):
+        # join succeeds on whatever a failing process substitution wrote before it failed
+        cmd = "join -t, <({0}) <({0}; false)".format(self.cmd)
+        key = ResultCache.get_key(cmd, [self.file_path])
+
+        caching_cmd = self.cache.get_caching_cmd(key, cmd)
+        self.assertNotEqual(subprocess.call(['/bin/bash', '-c', caching_cmd]), 0)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+        cmd = "join -t, <({0}) <({0})".format(self.cmd)
+        key = ResultCache.get_key(cmd, [self.file_path])
+        subprocess.check_output(['/bin/bash', '-c', self.cache.get_caching_cmd(key, cmd)])
+        self.assertIsNotNone(self.cache.get(key))
+
+    def test_terminated_output_is_not_cached(self):
+        cmd = 'cat <({0}; kill -TERM $$; {0})'.format(self.cmd)
+        key = ResultCache.get_key(cmd, [self.file_path])
+
+        caching_cmd = self.cache.get_caching_cmd(key, cmd)
+        with open(os.devnull, 'w') as devnull:
+            self.assertNotEqual(subprocess.call(['/bin/bash', '-c', caching_cmd], stdout=devnull), 0)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_record_substitution_statuses_leaves_quoted_text(self):
+        command, substitution_count = record_substitution_statuses(
+            "join <(awk '$1 ~ /<(/') <(echo \"<(\")")
+        self.assertEqual(substitution_count, 2)
+        self.assertEqual(command.count('<(trap'), 2)
+        self.assertIn("awk '$1 ~ /<(/'", command)
+        self.assertIn('echo "<("', command)
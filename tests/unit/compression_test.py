@@ -0,0 +1,53 @@
+import unittest
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+from sqltxt.compression import detect_compression, get_decompress_cmd, open_input
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.contents = 'col_a,col_b\n' + ''.join(
+            '{0},{1}\n'.format(i, i % 7) for i in range(10000))
+
+        self.gzip_path = os.path.join(self.tmp_path, 'table.csv.gz')
+        f = gzip.open(self.gzip_path, 'wb')
+        f.write(self.contents)
+        f.close()
+
+        # compressed files are recognized by their contents, whatever their names
+        self.bzip2_path = os.path.join(self.tmp_path, 'table.csv')
+        f = bz2.BZ2File(self.bzip2_path, 'wb')
+        f.write(self.contents)
+        f.close()
+
+        self.plain_path = os.path.join(self.tmp_path, 'plain.gz')
+        with open(self.plain_path, 'w') as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_detect_compression(self):
+        self.assertEqual(detect_compression(self.gzip_path), 'gzip')
+        self.assertEqual(detect_compression(self.bzip2_path), 'bzip2')
+        self.assertEqual(detect_compression(self.plain_path), None)
+
+        # files that can't be read without consuming them are recognized by their extensions
+        self.assertEqual(detect_compression('/dev/fd/63.zst'), 'zstd')
+        self.assertEqual(detect_compression('/dev/fd/63'), None)
+
+    def test_get_decompress_cmd(self):
+        self.assertTrue(get_decompress_cmd(self.gzip_path).split()[0] in ('pigz', 'gzip'))
+        self.assertEqual(get_decompress_cmd(self.plain_path), None)
+
+    def test_open_input_decompresses(self):
+        for path in (self.gzip_path, self.bzip2_path, self.plain_path):
+            with open_input(path) as f:
+                self.assertEqual(f.readline(), 'col_a,col_b\n')
+
+            with open_input(path) as f:
+                self.assertEqual(f.read(), self.contents)
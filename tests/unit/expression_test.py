@@ -1,6 +1,7 @@
 import unittest
 
-from sqltxt.expression import Expression, AndList, OrList
+from sqltxt.expression import (Expression, AndList, OrList, get_cnf_conditions, format_condition,
+    like_pattern_to_regex, get_like_pattern_literals)
 from sqltxt.column import ColumnName
 
 class ExpressionTest(unittest.TestCase):
@@ -52,3 +53,70 @@ class ExpressionTest(unittest.TestCase):
             ColumnName('a.a'), ColumnName('b.b'), ColumnName('c.c'), ColumnName('d.d')
         ])
         self.assertEqual(expected_column_names, boolean_condition.column_names)
+
+    def test_get_cnf_conditions_distributes_or_over_and(self):
+        conditions = [
+            {'left_operand': 'a.a', 'operator': '=', 'right_operand': '1'},
+            'or',
+            [
+                {'left_operand': 'b.b', 'operator': '=', 'right_operand': "'x'"},
+                'and',
+                ['c.c', '<', '-2.5'],
+            ],
+        ]
+
+        expected_conditions = AndList([
+            OrList([Expression('a.a', '==', 1), Expression('b.b', '==', '"x"')]),
+            OrList([Expression('a.a', '==', 1), Expression('c.c', '<', -2.5)]),
+        ])
+        self.assertEqual(get_cnf_conditions(conditions), expected_conditions)
+
+    def test_get_cnf_conditions_binds_and_before_or(self):
+        conditions = [
+            ['a.a', '==', '1'], 'and', ['b.b', '==', '2'], 'or', ['c.c', '==', '3'],
+        ]
+
+        expected_conditions = AndList([
+            OrList([Expression('a.a', '==', 1), Expression('c.c', '==', 3)]),
+            OrList([Expression('b.b', '==', 2), Expression('c.c', '==', 3)]),
+        ])
+        self.assertEqual(get_cnf_conditions(conditions), expected_conditions)
+
+    def test_get_cnf_conditions_removes_duplicate_and_subsumed_clauses(self):
+        conditions = [
+            ['a.a', '==', '1'], 'and',
+            [['a.a', '==', '1'], 'or', ['b.b', '==', '2'], 'or', ['a.a', '==', '1']], 'and',
+            [['c.c', '==', '3'], 'or', ['c.c', '==', '3']], 'and',
+            ['a.a', '==', '1'],
+        ]
+
+        expected_conditions = AndList([Expression('a.a', '==', 1), Expression('c.c', '==', 3)])
+        self.assertEqual(get_cnf_conditions(conditions), expected_conditions)
+
+    def test_get_cnf_conditions_keeps_large_conditions_whole(self):
+        conditions = []
+        for value in range(1, 5):
+            conditions.extend([[['a.a', '==', str(value)], 'and', ['b.b', '==', str(value)]], 'or'])
+        conditions = conditions[:-1]
+
+        # distributing four two-term conjunctions would make 2 ** 4 clauses
+        expected_condition = OrList([
+            AndList([Expression('a.a', '==', value), Expression('b.b', '==', value)])
+            for value in range(1, 5)
+        ])
+        self.assertEqual(
+            get_cnf_conditions(conditions, max_clauses=8), AndList([expected_condition]))
+        self.assertEqual(len(get_cnf_conditions(conditions, max_clauses=16)), 16)
+
+    def test_format_condition(self):
+        condition = AndList([
+            Expression('a.a', '==', 1),
+            OrList([Expression('b', '<', '"x"'), Expression('a.c', '>=', 'b')]),
+        ])
+        self.assertEqual(format_condition(condition), 'a.a = 1 and (b < "x" or a.c >= b)')
+
+    def test_like_pattern_to_regex(self):
+        self.assertEqual(like_pattern_to_regex('a%b_c'), '^a.*b.c$')
+        self.assertEqual(like_pattern_to_regex('1.5/2%'), r'^1\.5\/2.*$')
+        self.assertEqual(get_like_pattern_literals('%ab_cde%'), ['ab', 'cde'])
+        self.assertEqual(get_like_pattern_literals('%_'), [])
@@ -2,9 +2,12 @@ import unittest
 import os
 from sqltxt.table import Table 
 from sqltxt.column import Column, ColumnName
-from sqltxt.plan import build_graph, traverse
+from sqltxt import plan as plan_module
+from sqltxt.plan import (build_graph, traverse, get_join_edges, enumerate_join_orders,
+    estimate_relations, estimate_selectivity, plan, use_hash_join, use_partitioned_join,
+    order_conditions)
 from sqltxt.query import classify_conditions
-from sqltxt.expression import Expression
+from sqltxt.expression import Expression, AndList, OrList
 
 class PlanTest(unittest.TestCase):
 
@@ -70,3 +73,216 @@ class PlanTest(unittest.TestCase):
         actual_node_order = traverse(graph, priorities)
         expected_node_order = { 'a': 0, 'b': 1, 'c': 2 }
         self.assertEqual(actual_node_order, expected_node_order)
+
+    def test_enumerate_join_orders_keeps_intermediate_results_small(self):
+        relations = [
+            {'path': 'a.txt', 'alias': 'a'},
+            {'path': 'b.txt', 'alias': 'b'},
+            {'path': 'c.txt', 'alias': 'c'},
+        ]
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('a.col1'), '=', ColumnName('b.col1')),
+            Expression(ColumnName('b.col2'), '=', ColumnName('c.col2')),
+        ]
+        graph = build_graph(tables, conditions)
+        edges = get_join_edges(tables, conditions)
+
+        # joining b to a first multiplies b's rows, so join b to the selective c first
+        estimates = {
+            'a': { 'rows': 1000000.0, 'width': 10.0, 'distinct': { 'col1': 10.0 } },
+            'b': { 'rows': 1000.0, 'width': 10.0, 'distinct': {} },
+            'c': { 'rows': 10.0, 'width': 10.0, 'distinct': {} },
+        }
+        node_order = enumerate_join_orders(graph, edges, estimates)
+        self.assertEqual(node_order['a'], 2)
+
+    def test_enumerate_join_orders_avoids_cross_products(self):
+        relations = [
+            {'path': 'a.txt', 'alias': 'a'},
+            {'path': 'b.txt', 'alias': 'b'},
+            {'path': 'c.txt', 'alias': 'c'},
+        ]
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('a.col1'), '=', ColumnName('b.col1')),
+            Expression(ColumnName('b.col2'), '=', ColumnName('c.col2')),
+        ]
+        graph = build_graph(tables, conditions)
+        edges = get_join_edges(tables, conditions)
+
+        # a and c are the smallest relations, but they don't share a join condition
+        estimates = {
+            'a': { 'rows': 10.0, 'width': 10.0, 'distinct': {} },
+            'b': { 'rows': 1000.0, 'width': 10.0, 'distinct': {} },
+            'c': { 'rows': 10.0, 'width': 10.0, 'distinct': {} },
+        }
+        node_order = enumerate_join_orders(graph, edges, estimates)
+        self.assertEqual(node_order['b'], 1)
+
+    def test_enumerate_join_orders_streams_large_relation_past_hash_joins(self):
+        relations = [
+            {'path': 'd1.txt', 'alias': 'd1'},
+            {'path': 'd2.txt', 'alias': 'd2'},
+            {'path': 'f.txt', 'alias': 'f'},
+        ]
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('f.d1_id'), '=', ColumnName('d1.id')),
+            Expression(ColumnName('f.d2_id'), '=', ColumnName('d2.id')),
+        ]
+        graph = build_graph(tables, conditions)
+        edges = get_join_edges(tables, conditions)
+        estimates = {
+            'd1': { 'rows': 100.0, 'width': 10.0, 'distinct': {} },
+            'd2': { 'rows': 100.0, 'width': 10.0, 'distinct': {} },
+            'f': { 'rows': 1000000.0, 'width': 10.0, 'distinct': {} },
+        }
+
+        node_order = enumerate_join_orders(graph, edges, estimates)
+        self.assertNotEqual(node_order['f'], 0)
+
+        # both dimensions fit in memory, so the fact relation is streamed past them unsorted
+        node_order = enumerate_join_orders(graph, edges, estimates, hash_join_threshold=1000)
+        self.assertEqual(node_order['f'], 0)
+
+    def test_use_hash_join(self):
+        self.assertTrue(use_hash_join(1000, 1000))
+        self.assertFalse(use_hash_join(1001, 1000))
+        self.assertFalse(use_hash_join(None, 1000))
+        self.assertFalse(use_hash_join(1000, 1000, inputs_sorted=True))
+        self.assertFalse(use_hash_join(1000, 0))
+
+    def test_use_partitioned_join(self):
+        self.assertTrue(use_partitioned_join(2000, 1000, 1000))
+        self.assertFalse(use_partitioned_join(None, 1000, 1000))
+        self.assertFalse(use_partitioned_join(2000, 999, 1000))
+        self.assertFalse(use_partitioned_join(2000, 1000, 1000, inputs_sorted=True))
+        self.assertFalse(use_partitioned_join(2000, 1000, 0))
+
+    def test_estimate_selectivity(self):
+        equality = Expression(ColumnName('a.col1'), '=', 1)
+        inequality = Expression(ColumnName('a.col1'), '!=', 1)
+        range_ = Expression(ColumnName('a.col1'), '<', 1)
+
+        self.assertAlmostEqual(estimate_selectivity(equality), 0.1)
+        self.assertAlmostEqual(estimate_selectivity(inequality), 0.9)
+        self.assertAlmostEqual(estimate_selectivity(AndList([equality, range_])), 0.1 / 3)
+        self.assertAlmostEqual(estimate_selectivity(OrList([equality, equality])), 0.19)
+
+    def test_order_conditions_puts_cheap_selective_terms_first(self):
+        range_ = Expression(ColumnName('a.col1'), '<', 1)
+        string_equality = Expression(ColumnName('a.col2'), '==', '"x"')
+        equality = Expression(ColumnName('a.col3'), '==', 1)
+
+        self.assertEqual(
+            order_conditions([range_, string_equality, equality]),
+            [equality, range_, string_equality])
+
+        # an OR stops at its first term that holds, so the likeliest terms go first
+        self.assertEqual(
+            order_conditions([OrList([equality, range_])]), [OrList([range_, equality])])
+
+    def test_order_conditions_estimates_selectivity_from_sampled_rows(self):
+        data_path = os.path.join(os.path.dirname(__file__), '../data')
+        table_d = Table.from_file_path(os.path.join(data_path, 'table_d.txt'), alias='d')
+
+        # half of the rows have col_b = 4, but only one has col_x < -3
+        equality = Expression(ColumnName('d.col_b'), '==', 4)
+        range_ = Expression(ColumnName('d.col_x'), '<', -3)
+        self.assertEqual(order_conditions([equality, range_]), [equality, range_])
+        self.assertEqual(order_conditions([equality, range_], table_d), [range_, equality])
+
+    def test_estimate_relations_from_file_sizes(self):
+        data_path = os.path.join(os.path.dirname(__file__), '../data')
+        table_a = Table.from_file_path(os.path.join(data_path, 'table_a.txt'), alias='a')
+        table_d = Table.from_file_path(os.path.join(data_path, 'table_d.txt'), alias='d')
+        where_conditions = [Expression(ColumnName('d.col_x'), '==', 1)]
+
+        estimates = estimate_relations([table_a, table_d], where_conditions)
+        self.assertAlmostEqual(estimates['a']['rows'], 3)
+        self.assertAlmostEqual(estimates['a']['width'], 4)
+        self.assertAlmostEqual(estimates['d']['rows'], 1)
+        self.assertAlmostEqual(estimates['d']['width'], 7)
+
+    def test_plan_falls_back_to_greedy_traversal_for_large_join_graphs(self):
+        relations = [{'path': '{}.txt'.format(c), 'alias': c} for c in 'abcd']
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('a.col1'), '=', ColumnName('b.col1')),
+            Expression(ColumnName('b.col1'), '=', ColumnName('c.col1')),
+            Expression(ColumnName('c.col1'), '=', ColumnName('d.col1')),
+        ]
+
+        # d's rows all share one join key, which multiplies the rows of whatever it joins early
+        rows = {'a': 1000.0, 'b': 100.0, 'c': 1.0, 'd': 10.0}
+        estimates = dict(
+            (alias, {'rows': n, 'input_rows': n, 'width': 10.0, 'distinct': {}, 'sorted_by': ()})
+            for alias, n in rows.items())
+        estimates['d']['distinct'] = {'col1': 1.0}
+
+        max_enumerated_relations = plan_module.MAX_ENUMERATED_RELATIONS
+        try:
+            plan_module.MAX_ENUMERATED_RELATIONS = 3
+            greedy_order = plan(tables, conditions, [], estimates=estimates)
+        finally:
+            plan_module.MAX_ENUMERATED_RELATIONS = max_enumerated_relations
+
+        # starting from the smallest relation, each step joins the smallest neighbor
+        self.assertEqual(greedy_order, [2, 3, 1, 0])
+
+        # while enumerating join orders finds one that joins d last, and costs less
+        enumerated_order = plan(tables, conditions, [], estimates=estimates)
+        self.assertEqual(enumerated_order, [1, 2, 0, 3])
+
+        edges = get_join_edges(tables, conditions)
+        def get_cost(join_order):
+            joined_plan = plan_module._relation_plan('abcd'[join_order[0]], estimates)
+            for idx in join_order[1:]:
+                joined_plan = plan_module._join_plan(joined_plan, 'abcd'[idx], edges, estimates)
+            return joined_plan['cost']
+        self.assertLess(get_cost(enumerated_order), get_cost(greedy_order))
+
+    def test_enumerate_join_orders_prefers_reusing_sort_orders(self):
+        relations = [
+            {'path': 'a.txt', 'alias': 'a'},
+            {'path': 'b.txt', 'alias': 'b'},
+            {'path': 'c.txt', 'alias': 'c'},
+            {'path': 'd.txt', 'alias': 'd'},
+        ]
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('a.k'), '=', ColumnName('b.k')),
+            Expression(ColumnName('a.j'), '=', ColumnName('c.j')),
+            Expression(ColumnName('a.k'), '=', ColumnName('d.k')),
+        ]
+        graph = build_graph(tables, conditions)
+        edges = get_join_edges(tables, conditions)
+        estimates = dict(
+            (node, { 'rows': 1000.0, 'width': 10.0, 'distinct': {} }) for node in graph)
+
+        # joining c between b and d sorts by j in between, so the join to d can't reuse the order
+        node_order = enumerate_join_orders(graph, edges, estimates)
+        self.assertEqual(abs(node_order['b'] - node_order['d']), 1)
+
+    def test_enumerate_join_orders_uses_sorted_relations(self):
+        relations = [
+            {'path': 'a.txt', 'alias': 'a'},
+            {'path': 'b.txt', 'alias': 'b'},
+            {'path': 'c.txt', 'alias': 'c'},
+        ]
+        tables = [Table(r['path'], alias=r['alias']) for r in relations]
+        conditions = [
+            Expression(ColumnName('a.k'), '=', ColumnName('b.k')),
+            Expression(ColumnName('a.j'), '=', ColumnName('c.j')),
+        ]
+        graph = build_graph(tables, conditions)
+        edges = get_join_edges(tables, conditions)
+        estimates = dict(
+            (node, { 'rows': 1000.0, 'width': 10.0, 'distinct': {} }) for node in graph)
+
+        # a and c are both already sorted by j, so joining them first sorts nothing
+        estimates['a']['sorted_by'] = (ColumnName('j', qualifiers=['a.txt', 'a']), )
+        estimates['c']['sorted_by'] = (ColumnName('j', qualifiers=['c.txt', 'c']), )
+        node_order = enumerate_join_orders(graph, edges, estimates)
+        self.assertEqual(node_order['b'], 2)
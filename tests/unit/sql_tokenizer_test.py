@@ -1,5 +1,5 @@
 import unittest
-from sqltxt.sql_tokenizer import select_stmt, parse
+from sqltxt.sql_tokenizer import select_stmt, parse, get_relations_and_conditions
 
 class SqlTokenizerTest(unittest.TestCase):
 
@@ -32,6 +32,39 @@ class SqlTokenizerTest(unittest.TestCase):
         self.assertEqual(relation_path, 'table1')
         self.assertEqual(relation_alias, 't1')
 
+    def test_parse_from_list_with_sort_hint(self):
+        parsed = select_stmt.parseString('select col1 from table1 t1 sorted by (col1, t1.col2)')
+        relation = parsed.from_clause.relation
+        self.assertEqual(relation.alias[0], 't1')
+        self.assertEqual(list(relation.sorted_by), ['col1', 't1.col2'])
+
+        relations, _ = get_relations_and_conditions(parse('''
+            select col1
+            from table1 join table2 sorted by (col1) on (table1.col1 = table2.col1)
+        '''))
+        self.assertEqual(relations, [
+            {'path': 'table1', 'alias': 'table1', 'sorted_by': []},
+            {'path': 'table2', 'alias': 'table2', 'sorted_by': ['col1']},
+        ])
+
+    def test_get_conditions_keeps_where_clause_conjunctions(self):
+        _, conditions = get_relations_and_conditions(parse('''
+            select col1
+            from table1 join table2 on (table1.col1 = table2.col1)
+            where col2 > 1 and col3 = 2 or col4 = 3
+        '''))
+        self.assertEqual(conditions, [
+            [{'left_operand': 'table1.col1', 'operator': '=', 'right_operand': 'table2.col1'}],
+            'and',
+            [
+                {'left_operand': 'col2', 'operator': '>', 'right_operand': '1'},
+                'and',
+                {'left_operand': 'col3', 'operator': '=', 'right_operand': '2'},
+                'or',
+                {'left_operand': 'col4', 'operator': '=', 'right_operand': '3'},
+            ],
+        ])
+
     def test_parse_from_list_with_joins_to_get_join_type(self):
         parsed = select_stmt.parseString('''
             select col1
@@ -124,6 +157,14 @@ class SqlTokenizerTest(unittest.TestCase):
             ],
         ])
 
+    def test_parse_like_condition(self):
+        parsed = parse("select cola from table1 where colz like 'a%' and colb = 1")
+        self.assertEqual(parsed.where_clause, [
+            {'left_operand': 'colz', 'operator': 'LIKE', 'right_operand': "'a%'"},
+            'and',
+            {'left_operand': 'colb', 'operator': '=', 'right_operand': '1'},
+        ])
+
     def test_parse_tablesample_clause(self):
         parsed = parse('''
             select cola
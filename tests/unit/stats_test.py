@@ -0,0 +1,104 @@
+import unittest
+import os
+import shutil
+import tempfile
+from sqltxt.stats import (analyze, write_stats, load_stats, get_stats_path, get_column_stats,
+    equality_selectivity, range_selectivity)
+from sqltxt.table import Table
+from sqltxt.column import ColumnName
+from sqltxt.expression import Expression
+from sqltxt.plan import estimate_relations, estimate_selectivity
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = os.path.join(os.path.dirname(__file__), '../data')
+        self.tmp_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_path, 'table_d.txt')
+        shutil.copy(os.path.join(self.data_path, 'table_d.txt'), self.file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_analyze(self):
+        stats = analyze(os.path.join(self.data_path, 'table_a_nulls.txt'))
+
+        self.assertEqual(stats['row_count'], 3)
+        self.assertAlmostEqual(stats['average_row_width'], 10 / 3.0)
+        self.assertEqual([c['name'] for c in stats['columns']], ['col_a', 'col_b'])
+
+        col_a_stats = stats['columns'][0]
+        self.assertEqual(col_a_stats['nulls'], 1)
+        self.assertEqual(col_a_stats['distinct'], 2)
+        self.assertEqual(col_a_stats['min'], 1)
+        self.assertEqual(col_a_stats['max'], 3)
+        self.assertEqual(col_a_stats['most_common_values'], [['1', 1], ['3', 1]])
+
+    def test_analyze_non_numeric_column(self):
+        stats = analyze(os.path.join(self.data_path, 'geos.txt'))
+        state_stats = get_column_stats(stats, 'STATE')
+
+        self.assertEqual(state_stats['min'], 'ca')
+        self.assertEqual(state_stats['max'], 'mo')
+        self.assertIsNone(state_stats['histogram'])
+        self.assertEqual(state_stats['most_common_values'][0], ['ca', 3])
+
+    def test_load_stats(self):
+        self.assertIsNone(load_stats(self.file_path))
+
+        stats_path = write_stats(self.file_path, analyze(self.file_path))
+        self.assertEqual(stats_path, get_stats_path(self.file_path))
+        self.assertEqual(load_stats(self.file_path)['row_count'], 4)
+
+    def test_load_stats_ignores_stale_stats(self):
+        write_stats(self.file_path, analyze(self.file_path))
+        with open(self.file_path, 'a') as f:
+            f.write('4,4,-4\n')
+
+        self.assertIsNone(load_stats(self.file_path))
+
+    def test_load_stats_ignores_unreadable_stats(self):
+        stats_path = write_stats(self.file_path, analyze(self.file_path))
+        with open(stats_path) as f:
+            contents = f.read()
+        self.assertEqual(sorted(os.listdir(self.tmp_path)), ['table_d.txt', 'table_d.txt.stats.json'])
+
+        # e.g. written by an interrupted analyze from before sidecars were replaced whole
+        with open(stats_path, 'w') as f:
+            f.write(contents[:len(contents) // 2])
+        self.assertIsNone(load_stats(self.file_path))
+
+        with open(stats_path, 'w') as f:
+            f.write('{}')
+        self.assertIsNone(load_stats(self.file_path))
+
+    def test_equality_selectivity(self):
+        column_stats = {
+            'distinct': 12,
+            'nulls': 10,
+            'most_common_values': [['a', 50], ['b', 20]],
+        }
+        self.assertAlmostEqual(equality_selectivity(column_stats, 100, 'a'), 0.5)
+        self.assertAlmostEqual(equality_selectivity(column_stats, 100, ''), 0.1)
+        self.assertAlmostEqual(equality_selectivity(column_stats, 100, 'c'), 0.02)
+
+    def test_range_selectivity(self):
+        column_stats = { 'null_fraction': 0.5, 'histogram': [0.0, 10.0, 100.0] }
+        self.assertAlmostEqual(range_selectivity(column_stats, '<', 5), 0.125)
+        self.assertAlmostEqual(range_selectivity(column_stats, '>=', 55), 0.125)
+        self.assertAlmostEqual(range_selectivity(column_stats, '>', 1000), 0.0)
+        self.assertIsNone(range_selectivity(column_stats, '>', 'abc'))
+
+    def test_estimates_use_stats(self):
+        write_stats(self.file_path, analyze(self.file_path))
+        table = Table.from_file_path(self.file_path, alias='d')
+
+        condition = Expression(ColumnName('d.col_a'), '==', 1)
+        self.assertAlmostEqual(estimate_selectivity(condition, table), 0.5)
+
+        condition = Expression(3, '>', ColumnName('d.col_x'))
+        self.assertAlmostEqual(estimate_selectivity(condition, table), 1.0)
+
+        estimates = estimate_relations([table], [Expression(ColumnName('d.col_a'), '==', 1)])
+        self.assertAlmostEqual(estimates['d']['rows'], 2)
+        self.assertEqual(estimates['d']['distinct'], {'col_a': 3, 'col_b': 3, 'col_x': 4})
@@ -1,8 +1,13 @@
 import unittest
 import os
-from sqltxt.table import Table 
-from sqltxt.column import Column, ColumnName, AmbiguousColumnNameError
-from sqltxt.expression import Expression
+import subprocess
+import shutil
+import tempfile
+from sqltxt import table as table_module
+from sqltxt.table import Table, SortOptions, WHOLE_ROW_WRITES_PROGRAM
+from sqltxt.cache import SortedRunCache
+from sqltxt.column import Column, ColumnName, AmbiguousColumnNameError, UnknownColumnNameError
+from sqltxt.expression import Expression, OrList
 
 class TableTest(unittest.TestCase):
 
@@ -43,9 +48,80 @@ class TableTest(unittest.TestCase):
         cmds_actual = self.table_a.cmds
         cmds_expected = [
             'echo -e "1,1\n2,3\n3,2"',
-            "awk -F',' 'OFS=\",\" { if (($2 == 1 || $1 == 2)) { print $1,$2 } }'"]
+            "awk -F',' 'OFS=\",\" { if (($2 == 1 || $1 == 2)) { print $0 } }'"]
         self.assertEqual(cmds_actual, cmds_expected)
 
+    def test_subset_rows_and_order_columns_are_fused(self):
+
+        self.table_a.subset_rows([Expression('col_b', '>', '1')])
+        self.table_a.order_columns([ColumnName('col_b')], drop_other_columns=True)
+        self.table_a.subset_rows([Expression('col_b', '<', '3')])
+
+        cmds_actual = self.table_a.cmds
+        cmds_expected = [
+            'echo -e "1,1\n2,3\n3,2"',
+            "awk -F',' 'OFS=\",\" { if ($2 > 1 && $2 < 3) { print $2 } }'"]
+        self.assertEqual(cmds_actual, cmds_expected)
+
+    def test_awk_stages_are_not_fused_across_other_commands(self):
+
+        self.table_a.subset_rows([Expression('col_b', '>', '1')])
+        self.table_a.sort([ColumnName('col_b')])
+        self.table_a.order_columns([ColumnName('col_b')], drop_other_columns=True)
+
+        cmds_actual = self.table_a.cmds
+        cmds_expected = [
+            'echo -e "1,1\n2,3\n3,2"',
+            "awk -F',' 'OFS=\",\" { if ($2 > 1) { print $0 } }'",
+            "LC_ALL=C sort -t, -k 2,2",
+            "awk -F',' 'OFS=\",\" { print $2 }'"]
+        self.assertEqual(cmds_actual, cmds_expected)
+
+    def test_subset_rows_prefilters_lines_by_required_literals(self):
+
+        self.table_a.order_columns([ColumnName('col_b')], drop_other_columns=True)
+        self.table_a.subset_rows([
+            Expression('col_b', '>', '1'),
+            OrList([Expression('col_b', '==', '"y z"'), Expression('col_b', 'like', '"%x_"')]),
+        ])
+
+        cmds_actual = self.table_a.cmds
+        cmds_expected = [
+            'echo -e "1,1\n2,3\n3,2"',
+            "{ LC_ALL=C grep -F -e 'y z' -e x || test $? = 1; }",
+            "awk -F',' 'OFS=\",\" { if ($2 > 1 && ($2 == \"y z\" || $2 ~ /^.*x.$/)) { print $2 } }'"]
+        self.assertEqual(cmds_actual, cmds_expected)
+
+        # numbers aren't prefiltered, since awk compares them by value
+        self.table_b.subset_rows([Expression('col_b', '==', 1)])
+        self.assertEqual(len(self.table_b.cmds), 2)
+
+    def test_projections_and_filters_of_few_fields_use_cut(self):
+
+        columns = ['col_{0}'.format(idx) for idx in range(8)]
+        projected_columns = [ColumnName(c) for c in columns[:3] + ['col_6']]
+
+        # cut passes rows without a delimiter through whole, so awk is used unless it's known that
+        # every row has every column
+        table = Table.from_cmd('wide', 'echo -e "0,1,2,3,4,5,6,7\n8"', list(columns))
+        table.order_columns(projected_columns, drop_other_columns=True)
+        self.assertEqual(table.cmds[-1], "awk -F',' 'OFS=\",\" { print $1,$2,$3,$7 }'")
+        self.assertEqual(
+            subprocess.check_output(['/bin/bash', '-c', table.get_cmd_str()]), '0,1,2,6\n8,,,\n')
+
+        table = Table.from_cmd('wide', 'echo -e "0,1,2,3,4,5,6,7"', list(columns))
+        table.use_cut = True
+        table.order_columns(projected_columns, drop_other_columns=True)
+        self.assertEqual(table.cmds[-1], "cut -d',' -f1-3,7")
+
+        # a filter reading few of many fields reads them from a cut of those fields
+        table = Table.from_cmd('wide', 'echo -e "0,1,2,3,4,5,6,7"', list(columns))
+        table.use_cut = True
+        table.subset_rows([Expression('col_6', '>', '"$7"')])
+        table.order_columns([ColumnName('col_1')], drop_other_columns=True)
+        self.assertEqual(table.cmds[-1],
+            "cut -d',' -f2,7 | awk -F',' 'OFS=\",\" { if ($2 > \"$7\") { print $1 } }'")
+
     def test_order_columns(self):
 
         col_name_order = [ColumnName('col_b'), ColumnName('col_a')]
@@ -61,12 +137,80 @@ class TableTest(unittest.TestCase):
         self.table_a.sort(sort_by_col_names)
 
         cmds_actual = self.table_a.cmds
-        cmds_expected = ['echo -e "1,1\n2,3\n3,2"', "sort -t, -k 1,1 -k 2,2"]
+        cmds_expected = ['echo -e "1,1\n2,3\n3,2"', "LC_ALL=C sort -t, -k 1,1 -k 2,2"]
         self.assertEqual(cmds_actual, cmds_expected)
 
         sort_by_cols = [self.table_a.get_column_for_name(cn) for cn in sort_by_col_names]
         self.assertEqual(self.table_a.sorted_by, sort_by_cols)
 
+    def test_sort_with_options(self):
+
+        self.table_a.sort_options = SortOptions(
+            parallel=4,
+            buffer_size='1G',
+            temporary_directory='/tmp/sort space',
+            compress_program='lz4',
+        )
+        self.table_a.sort([ColumnName('col_b')])
+
+        cmds_actual = self.table_a.cmds
+        cmds_expected = [
+            'echo -e "1,1\n2,3\n3,2"',
+            "LC_ALL=C sort -t, --parallel=4 -S 1G -T '/tmp/sort space' --compress-program=lz4 -k 2,2"
+        ]
+        self.assertEqual(cmds_actual, cmds_expected)
+
+    def test_sort_leaves_out_options_the_local_sort_does_not_support(self):
+
+        self.table_a.sort_options = SortOptions(locale='C; x', parallel=4, buffer_size='1G')
+        sort_supports = table_module.sort_supports
+        try:
+            table_module.sort_supports = lambda option: not option.startswith('--parallel')
+            self.table_a.sort([ColumnName('col_b')])
+        finally:
+            table_module.sort_supports = sort_supports
+
+        self.assertEqual(self.table_a.cmds[-1], "LC_ALL='C; x' sort -t, -S 1G -k 2,2")
+
+    def test_sort_options_from_machine(self):
+
+        sort_options = SortOptions.from_machine(concurrent_sorts=2, buffer_size='10%')
+        self.assertEqual(sort_options.locale, 'C')
+        self.assertGreaterEqual(sort_options.parallel, 1)
+        self.assertEqual(sort_options.buffer_size, '10%')
+
+        sort_options = SortOptions.from_machine(parallel=3, locale='')
+        self.assertEqual(sort_options.parallel, 3)
+        self.assertTrue(sort_options.buffer_size.endswith('K'))
+        self.assertEqual(sort_options.get_env_prefix(), '')
+
+    def test_sort_options_shared_by_concurrent_sorts(self):
+
+        sort_options = SortOptions(parallel=8, buffer_size='1G').shared_by(4)
+        self.assertEqual(sort_options.parallel, 2)
+        self.assertEqual(sort_options.buffer_size, '262144K')
+
+        sort_options = SortOptions(parallel=2, buffer_size='10%').shared_by(4)
+        self.assertEqual(sort_options.parallel, 1)
+        self.assertEqual(sort_options.buffer_size, '2%')
+
+    def test_order_columns_keeps_sort_order_of_remaining_columns(self):
+
+        self.table_a.sort([ColumnName('col_b'), ColumnName('col_a')])
+        self.table_a.order_columns([ColumnName('col_b')], drop_other_columns=True)
+        self.assertTrue(self.table_a.is_sorted_by([0]))
+        self.assertEqual(len(self.table_a.sorted_by), 1)
+
+        self.table_b.sort([ColumnName('col_a'), ColumnName('col_b')])
+        self.table_b.order_columns([ColumnName('col_b')], drop_other_columns=True)
+        self.assertEqual(self.table_b.sorted_by, [])
+
+    def test_sample_rows_discards_sort_order(self):
+
+        self.table_a.sort([ColumnName('col_a')])
+        self.table_a.sample_rows(1)
+        self.assertFalse(self.table_a.is_sorted_by([0]))
+
     def test_is_sorted_by(self):
 
         table_from_cmd = Table.from_cmd(
@@ -121,6 +265,162 @@ class TableTest(unittest.TestCase):
         ]
         self.assertEqual(cmds_actual, cmds_expected)
 
+    def test_declared_sort_order(self):
+
+        file_path = os.path.join(self.data_path, 'table_a.txt')
+        table = Table.from_file_path(file_path, sorted_by=['col_a'])
+        self.assertEqual(table.sorted_by, [table.get_column_for_name(ColumnName('col_a'))])
+        self.assertTrue(table.is_sorted_by([0]))
+        self.assertEqual(table.get_cmd_str(), 'tail -n+2 {}'.format(file_path))
+
+        with self.assertRaises(UnknownColumnNameError):
+            Table.from_file_path(file_path, sorted_by=['col_q'])
+
+    def test_declared_sort_order_verified(self):
+
+        file_path = os.path.join(self.data_path, 'table_a.txt')
+        table = Table.from_file_path(file_path, sorted_by=['col_b'], verify_sorted=True)
+        table.order_columns([ColumnName('col_b')], drop_other_columns=True)
+
+        # the order is only checked once it's relied on
+        cmd_unchecked = "tail -n+2 {0} | awk -F',' 'OFS=\",\" {{ print $2 }}'".format(file_path)
+        self.assertEqual(table.get_cmd_str(), cmd_unchecked)
+
+        table.sort([ColumnName('col_b')])
+        self.assertEqual(table.cmds[-1], (
+            "awk -F',' -v pid=$$ '{ k = $1 \"\"; if (NR > 1 && k < p) { "
+            "print \"sqltxt: row \" NR \" of the rows left after filtering is out of its declared sort "
+            "order\" | \"cat 1>&2\"; "
+            "close(\"cat 1>&2\"); system(\"kill -TERM \" pid); exit 1 } p = k; print }'"))
+
+        # table_a's col_b isn't sorted, which stops the whole command from within a substitution
+        cmd = 'cat <({0}); echo finished'.format(table.get_cmd_str())
+        process = subprocess.Popen(['/bin/bash', '-c', cmd],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertNotEqual(process.returncode, 0)
+        self.assertNotIn('finished', stdout)
+        self.assertIn(
+            'row 3 of the rows left after filtering is out of its declared sort order', stderr)
+
+    def test_declared_sort_order_not_checked_in_collating_locale(self):
+
+        file_path = os.path.join(self.data_path, 'table_a.txt')
+        table = Table.from_file_path(file_path, sorted_by=['col_b'], verify_sorted=True,
+            sort_options=SortOptions(locale='en_US.UTF-8'))
+        self.assertEqual(table.sorted_by, [])
+
+    def test_partitioned_scan(self):
+
+        file_path = os.path.join(self.data_path, 'table_d.txt')
+        table = Table.from_file_path(file_path, partitions=2)
+        table.MIN_PARTITION_BYTES = 1
+
+        # there is nothing to run on each part until rows are filtered or projected
+        self.assertEqual(table.get_cmd_str(), 'tail -n+2 {0}'.format(file_path))
+
+        table.subset_rows([Expression(ColumnName('col_b'), '>', 2)])
+        table.order_columns([ColumnName('col_x')], drop_other_columns=True)
+        table.sort([ColumnName('col_x')])
+
+        # the rows are sorted after the scan, so its parts' rows are output as they come
+        awk_cmd = "awk -F',' 'OFS=\",\" { if ($2 > 2) { print $3 } }'"
+        write_cmd = "awk '{0}'".format(WHOLE_ROW_WRITES_PROGRAM)
+        cmd_expected = (
+            '( set -o pipefail; pids=; '
+            '{{ split -n l/1/2 {0} | tail -n+2 | {1} | {2}; }} & pids="$pids $!"; '
+            '{{ split -n l/2/2 {0} | {1} | {2}; }} & pids="$pids $!"; '
+            'status=0; for pid in $pids; do wait "$pid" || status=$?; done; '
+            '[ "$status" = 0 ] || exit "$status"; ) | LC_ALL=C sort -t, -k 1,1'
+        ).format(file_path, awk_cmd, write_cmd)
+        self.assertEqual(table.get_cmd_str(), cmd_expected)
+
+        unpartitioned_table = Table.from_file_path(file_path)
+        unpartitioned_table.subset_rows([Expression(ColumnName('col_b'), '>', 2)])
+        unpartitioned_table.order_columns([ColumnName('col_x')], drop_other_columns=True)
+        unpartitioned_table.sort([ColumnName('col_x')])
+
+        self.assertEqual(
+            subprocess.check_output(['/bin/bash', '-c', table.get_cmd_str()]),
+            subprocess.check_output(['/bin/bash', '-c', unpartitioned_table.get_cmd_str()])
+        )
+
+    def test_partitioned_scan_keeps_the_order_of_rows_relied_on(self):
+
+        file_path = os.path.join(self.data_path, 'table_d.txt')
+        tables = [
+            Table.from_file_path(file_path, partitions=partitions, sorted_by=['col_a'])
+            for partitions in (2, 1)
+        ]
+        for table in tables:
+            table.MIN_PARTITION_BYTES = 1
+            table.subset_rows([Expression(ColumnName('col_b'), '>', 2)])
+            table.sort([ColumnName('col_a')])
+
+        cmd = tables[0].get_cmd_str()
+        self.assertIn('cat "$d/1" "$d/2"', cmd)
+        self.assertNotIn(WHOLE_ROW_WRITES_PROGRAM, cmd)
+        self.assertEqual(
+            subprocess.check_output(['/bin/bash', '-c', cmd]),
+            subprocess.check_output(['/bin/bash', '-c', tables[1].get_cmd_str()])
+        )
+
+    def test_partitioned_scan_fails_if_a_part_fails_and_removes_its_parts(self):
+
+        tmp_path = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(tmp_path, 'table d.txt')
+
+            # whether the parts' rows are output as they come or in order from temporary files
+            for sorted_by in ([], ['col_a']):
+                shutil.copy(os.path.join(self.data_path, 'table_d.txt'), file_path)
+                table = Table.from_file_path(file_path, partitions=2, sorted_by=sorted_by,
+                    sort_options=SortOptions(temporary_directory=tmp_path))
+                table.MIN_PARTITION_BYTES = 1
+                table.subset_rows([Expression(ColumnName('col_b'), '>', 2)])
+
+                cmd = table.get_cmd_str()
+                self.assertIn("split -n l/1/2 '{0}'".format(file_path), cmd)
+                with open(os.devnull, 'w') as devnull:
+                    self.assertEqual(subprocess.call(['/bin/bash', '-c', cmd], stdout=devnull), 0)
+
+                os.remove(file_path)
+                with open(os.devnull, 'w') as devnull:
+                    self.assertNotEqual(subprocess.call(['/bin/bash', '-c', cmd],
+                        stdout=devnull, stderr=devnull), 0)
+                self.assertEqual(os.listdir(tmp_path), [])
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_sorted_run_cache(self):
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(self.data_path, 'table_d.txt')
+            sorted_run_cache = SortedRunCache(cache_dir, max_bytes=1024 ** 2)
+
+            def get_sorted_table():
+                table = Table.from_file_path(file_path, sorted_run_cache=sorted_run_cache)
+                table.order_columns([ColumnName('col_x'), ColumnName('col_a')], True)
+                table.sort([ColumnName('col_a')])
+                return table
+
+            table = get_sorted_table()
+            self.assertFalse(table.sorted_run['is_cached'])
+            self.assertEqual(table.sorted_by, [table.get_column_for_name(ColumnName('col_a'))])
+            self.assertNotIn('sort -t, -k 2,2', table.get_cmd_str())
+            self.assertIn('sort -t, -k 1,1', table.get_cmd_str())
+
+            output = subprocess.check_output(['/bin/bash', '-c', table.get_cmd_str()])
+            self.assertEqual(output, '-1,1\n-4,1\n-2,2\n-3,3\n')
+
+            cached_table = get_sorted_table()
+            self.assertTrue(cached_table.sorted_run['is_cached'])
+            self.assertEqual(
+                subprocess.check_output(['/bin/bash', '-c', cached_table.get_cmd_str()]), output)
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_get_cmd_str(self):
 
         table_from_file = Table.from_file_path(os.path.join(self.data_path, 'table_a.txt'))
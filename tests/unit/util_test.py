@@ -0,0 +1,51 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from sqltxt import util
+from sqltxt.util import parse_size, shell_quote, sort_supports, Stopwatch, SORT_PROBE_FILE_NAME
+
+class UtilTest(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('64k'), 64 * 1024)
+        self.assertEqual(parse_size('1.5M'), 3 * 512 * 1024)
+
+    def test_shell_quote(self):
+        self.assertEqual(shell_quote(''), "''")
+        self.assertEqual(shell_quote('/tmp/sort-dir'), '/tmp/sort-dir')
+        self.assertEqual(shell_quote('lz4 -1'), "'lz4 -1'")
+        self.assertEqual(shell_quote("it's"), "'it'\"'\"'s'")
+
+    def test_sort_supports_caches_probes(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            self.assertTrue(sort_supports('-r', tmp_path))
+            self.assertFalse(sort_supports('--no-such-option', tmp_path))
+
+            probe_path = os.path.join(tmp_path, SORT_PROBE_FILE_NAME)
+            with open(probe_path) as f:
+                probe = json.load(f)
+            self.assertEqual(probe['options'], {'-r': True, '--no-such-option': False})
+
+            # a new process reads the probes from the cache instead of running sort again
+            probe['options']['-r'] = False
+            with open(probe_path, 'w') as f:
+                json.dump(probe, f)
+            util._supported_sort_options.clear()
+            self.assertFalse(sort_supports('-r', tmp_path))
+        finally:
+            util._supported_sort_options.clear()
+            shutil.rmtree(tmp_path)
+
+    def test_stopwatch(self):
+        stopwatch = Stopwatch(start_time=0)
+        stopwatch.lap('parse')
+        stopwatch.lap('plan')
+        stopwatch.lap('parse')
+
+        self.assertEqual([name for name, elapsed in stopwatch.laps], ['parse', 'plan'])
+        report_lines = stopwatch.report().split('\n')
+        self.assertEqual([line.split()[0] for line in report_lines], ['parse', 'plan', 'total'])